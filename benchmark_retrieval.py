@@ -0,0 +1,100 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import statistics
+
+import numpy as np
+import chromadb
+
+from numpy_index import NumpyVectorIndex
+
+def percentil(valores, q):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))]
+
+def cargar_corpus(args):
+    """Vectores reales de chroma_db (--desde-chroma) o un corpus sintético agrupado"""
+    if args.desde_chroma:
+        from rag_system import leer_generacion_activa  # Solo aquí: el corpus sintético no necesita el RAG
+        persist_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chroma_db')
+        generacion = leer_generacion_activa(persist_directory)  # La misma que atiende el bot (blue/green)
+        print(f"📂 Generación activa de chroma_db: {generacion}")
+        coleccion = chromadb.PersistentClient(path=persist_directory).get_collection(generacion)
+        datos = coleccion.get(include=["embeddings", "documents", "metadatas"])
+        vectores = np.asarray(datos['embeddings'], dtype=np.float32)
+        return datos['ids'], vectores, datos['documents'], datos['metadatas']
+
+    rng = np.random.default_rng(42)
+    centros = rng.normal(size=(max(1, args.chunks // 50), args.dim)).astype(np.float32)
+    vectores = centros[rng.integers(0, len(centros), args.chunks)] + 0.3 * rng.normal(size=(args.chunks, args.dim)).astype(np.float32)
+    ids = [f"chunk-{i}" for i in range(args.chunks)]
+    documentos = [f"Texto del chunk {i} " * 40 for i in range(args.chunks)]
+    metadatas = [{'source_file': f"doc_{i % 200}.pdf", 'chunk_id': i} for i in range(args.chunks)]
+    return ids, vectores, documentos, metadatas
+
+def medir(nombre, buscar, consultas):
+    for consulta in consultas[:10]:  # Calentamiento
+        buscar(consulta)
+    tiempos = []
+    resultados = []
+    for consulta in consultas:
+        inicio = time.perf_counter()
+        resultados.append(buscar(consulta))
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    print(f"   {nombre:<8} p50: {statistics.median(tiempos):7.3f} ms | p99: {percentil(tiempos, 0.99):7.3f} ms | máx: {max(tiempos):7.3f} ms")
+    return resultados
+
+def main():
+    parser = argparse.ArgumentParser(description="Comparar latencia de recuperación: Chroma vs índice NumPy")
+    parser.add_argument("--chunks", type=int, default=5000, help="Tamaño del corpus sintético")
+    parser.add_argument("--dim", type=int, default=768, help="Dimensión de los embeddings sintéticos")
+    parser.add_argument("--consultas", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dtype", default="float32", choices=["float32", "float16"])
+    parser.add_argument("--desde-chroma", action="store_true", help="Usar los vectores reales de chroma_db")
+    args = parser.parse_args()
+
+    print("🧪 BENCHMARK DE RECUPERACIÓN: CHROMA vs NUMPY")
+    print("=" * 50)
+    ids, vectores, documentos, metadatas = cargar_corpus(args)
+    if not len(ids):
+        print("❌ El corpus está vacío")
+        sys.exit(1)
+    print(f"📚 Corpus: {len(ids)} chunks de dimensión {vectores.shape[1]} | k={args.k} | {args.consultas} consultas")
+
+    rng = np.random.default_rng(7)
+    consultas = vectores[rng.integers(0, len(ids), args.consultas)] + 0.1 * rng.normal(size=(args.consultas, vectores.shape[1])).astype(np.float32)
+
+    # Chroma efímero con distancia coseno (mismo criterio que el índice NumPy)
+    coleccion = chromadb.EphemeralClient().create_collection("benchmark", metadata={"hnsw:space": "cosine"})
+    for i in range(0, len(ids), 5000):
+        coleccion.add(ids=ids[i:i + 5000], embeddings=vectores[i:i + 5000].tolist(),
+                      documents=documentos[i:i + 5000], metadatas=metadatas[i:i + 5000])
+
+    with tempfile.TemporaryDirectory() as directorio:
+        indice = NumpyVectorIndex(directorio, dtype=args.dtype)
+        indice.upsert(ids, vectores, documentos, metadatas)
+
+        print("\n⏱️ Latencia por consulta (incluye construir los resultados):")
+        resultados_chroma = medir(
+            "chroma",
+            lambda q: coleccion.query(query_embeddings=[q.tolist()], n_results=args.k)['ids'][0],
+            consultas
+        )
+        resultados_numpy = medir(
+            "numpy",
+            lambda q: [doc.id for doc in indice.similarity_search_by_vector(q, k=args.k)],
+            consultas
+        )
+
+    # Coincidencia del top-k (HNSW de Chroma es aproximado; NumPy es exacto)
+    coincidencia = statistics.mean(
+        len(set(chroma) & set(numpy_ids)) / args.k for chroma, numpy_ids in zip(resultados_chroma, resultados_numpy)
+    )
+    print(f"\n🎯 Coincidencia media del top-{args.k} entre ambos backends: {coincidencia:.1%}")
+    print("=" * 50)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import os
+import re
+import math
+import pickle
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from logger_config import logger
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+# Códigos, marcas y siglas: tokens con dígitos ("017", "3ds") o siglas en mayúsculas en la query original
+_TERMINO_EXACTO_RE = re.compile(r"\b(?:\w*\d\w*|[A-ZÁÉÍÓÚÑ]{2,})\b")
+
+STOPWORDS = {
+    'a', 'al', 'como', 'con', 'cual', 'cuales', 'de', 'del', 'el', 'en', 'es', 'esta', 'este', 'hay',
+    'la', 'las', 'lo', 'los', 'me', 'mi', 'no', 'o', 'para', 'pero', 'por', 'puedo', 'que', 'qué',
+    'se', 'si', 'sin', 'sobre', 'su', 'sus', 'un', 'una', 'uno', 'y', 'ya', 'the', 'of', 'and', 'to',
+}
+
+def tokenizar(texto: str) -> List[str]:
+    """Minúsculas, sin tildes, tokens alfanuméricos sin stopwords (conserva ceros a la izquierda)"""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    return [token for token in _TOKEN_RE.findall(texto) if token not in STOPWORDS]
+
+def terminos_exactos(query: str) -> List[str]:
+    """Términos de la query que piden coincidencia léxica exacta (códigos, siglas, números)"""
+    return [token for termino in _TERMINO_EXACTO_RE.findall(query) for token in tokenizar(termino)]
+
+def cumple_filtro(metadata: dict, filtro: Optional[dict]) -> bool:
+    """Filtro de metadata por igualdad ({"campo": valor}), el subconjunto común con Chroma"""
+    return not filtro or all(metadata.get(campo) == valor for campo, valor in filtro.items())
+
+class BM25Index:
+    """Índice invertido BM25 en memoria, sincronizado con las altas y bajas del vectorstore.
+
+    Guarda por id el texto y la metadata del chunk para poder devolver coincidencias léxicas
+    que la búsqueda vectorial no trajo. Se persiste con pickle junto a chroma_db.
+    """
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[str, int]] = defaultdict(dict)  # término -> {id: tf}
+        self._docs: Dict[str, Tuple[str, dict, int]] = {}  # id -> (texto, metadata, longitud)
+        self._longitud_total = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._docs)
+
+    def agregar(self, ids: Sequence[str], textos: Sequence[str], metadatas: Sequence[dict]):
+        with self._lock:
+            for doc_id, texto, metadata in zip(ids, textos, metadatas):
+                if doc_id in self._docs:
+                    self._eliminar(doc_id)
+                tokens = tokenizar(texto)
+                for termino, tf in Counter(tokens).items():
+                    self._postings[termino][doc_id] = tf
+                self._docs[doc_id] = (texto, dict(metadata or {}), len(tokens))
+                self._longitud_total += len(tokens)
+
+    def _eliminar(self, doc_id: str):
+        texto, _, longitud = self._docs.pop(doc_id)
+        self._longitud_total -= longitud
+        for termino in set(tokenizar(texto)):
+            postings = self._postings.get(termino)
+            if postings is not None:
+                postings.pop(doc_id, None)
+                if not postings:
+                    del self._postings[termino]
+
+    def eliminar(self, ids: Sequence[str]):
+        with self._lock:
+            for doc_id in ids:
+                if doc_id in self._docs:
+                    self._eliminar(doc_id)
+
+    def actualizar_metadatas(self, ids: Sequence[str], metadatas: Sequence[dict]):
+        with self._lock:
+            for doc_id, metadata in zip(ids, metadatas):
+                if doc_id in self._docs:
+                    texto, anterior, longitud = self._docs[doc_id]
+                    self._docs[doc_id] = (texto, {**anterior, **metadata}, longitud)
+
+    def documento(self, doc_id: str) -> Optional[Tuple[str, dict]]:
+        entrada = self._docs.get(doc_id)
+        return (entrada[0], entrada[1]) if entrada else None
+
+    def buscar(self, query: str, k: int = 10, filtro: Optional[dict] = None) -> List[Tuple[str, float]]:
+        """Top-k (id, score BM25) para la query, opcionalmente solo entre chunks que cumplen el filtro"""
+        terminos = set(tokenizar(query))
+        with self._lock:
+            n = len(self._docs)
+            if not n or not terminos:
+                return []
+            longitud_media = self._longitud_total / n
+            scores = defaultdict(float)
+            for termino in terminos:
+                postings = self._postings.get(termino)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    if filtro and not cumple_filtro(self._docs[doc_id][1], filtro):
+                        continue
+                    longitud = self._docs[doc_id][2]
+                    scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * longitud / longitud_media))
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def contiene_todos(self, doc_id: str, terminos: Sequence[str]) -> bool:
+        with self._lock:
+            return all(doc_id in self._postings.get(termino, ()) for termino in terminos)
+
+    def guardar(self):
+        if not self.path:
+            return
+        with self._lock:
+            datos = {'postings': dict(self._postings), 'docs': self._docs, 'longitud_total': self._longitud_total}
+            try:
+                os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                temporal = f"{self.path}.tmp"
+                with open(temporal, 'wb') as f:
+                    pickle.dump(datos, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temporal, self.path)
+            except Exception as e:
+                logger.error(f"Error al guardar índice BM25 en {self.path}: {e}")
+
+    def cargar(self) -> bool:
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, 'rb') as f:
+                datos = pickle.load(f)
+        except (EOFError, pickle.UnpicklingError, OSError) as e:
+            logger.warning(f"Índice BM25 en {self.path} corrupto o ilegible, se reconstruirá: {e}")
+            return False
+        with self._lock:
+            self._postings = defaultdict(dict, datos['postings'])
+            self._docs = datos['docs']
+            self._longitud_total = datos['longitud_total']
+        return True
+
+    def limpiar(self):
+        with self._lock:
+            self._postings = defaultdict(dict)
+            self._docs = {}
+            self._longitud_total = 0
+
+def fusion_rrf(rankings: Sequence[Sequence], k: int = 60, pesos: Optional[Sequence[float]] = None) -> List:
+    """Reciprocal rank fusion: ordenar claves por la suma de peso/(k + posición) en cada ranking"""
+    pesos = pesos or [1.0] * len(rankings)
+    scores = defaultdict(float)
+    for ranking, peso in zip(rankings, pesos):
+        for posicion, clave in enumerate(ranking):
+            scores[clave] += peso / (k + posicion + 1)
+    return sorted(scores, key=scores.get, reverse=True)
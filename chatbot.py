@@ -1,28 +1,65 @@
+import io
 import os
 import time
+import asyncio
 import threading
 import re
 import mimetypes
-
-from langchain_community.document_loaders import UnstructuredFileIOLoader
-from langchain_google_genai import ChatGoogleGenerativeAI
+import hashlib
+import statistics
+import unicodedata
+from collections import deque
 
 import config
 from logger_config import logger
 from prompts import prompt_base
 from google_drive import file_memory_storage
-from rag_system import rag_system
-from llm_pool import llm_pool
-
-# Estado global del chatbot
-docs_string = ""
-system_prompt = ""
-ultimo_update = 0
-docs_actualizados = threading.Event()
+from rag_system import get_rag_system
+from llm_pool import get_llm_pool, get_async_llm_pool, MSG_SATURADO, MSG_ERROR, MENSAJES_ERROR
+from single_flight import SingleFlight
+from ttl_cache import LRUTTLCache
+from semantic_cache import SemanticAnswerCache
+from token_budget import ensamblar_prompt
+from xlsx_tables import MotorTablas, IndiceTablas
+from knowledge_snapshot import KnowledgeSnapshot, snapshot_actual, publicar, guardar_en_disco, cargar_de_disco
+
+# Estado global del chatbot: el conocimiento vive en el snapshot publicado (ver knowledge_snapshot)
+_carga_lock = threading.Lock()  # Serializa las cargas de documentos; las preguntas nunca lo toman
+_ultima_carga = 0  # Momento de la última carga completa de documentos
 llm = None
 conversaciones = {}  # Historiales por usuario - OPTIMIZADO para memoria
 conversaciones_lock = threading.Lock()  # Lock para conversaciones thread-safe
 
+# Métricas de latencia: tiempo hasta el primer token (streaming) y latencia total
+metricas_latencia = {'ttft': deque(maxlen=500), 'total': deque(maxlen=500)}
+metricas_lock = threading.Lock()
+
+# Preguntas idénticas concurrentes (sin historial) comparten una sola recuperación RAG + llamada LLM
+preguntas_en_curso = SingleFlight("preguntas")
+
+# Caché de respuestas: (pregunta normalizada, hash del historial, versión de conocimiento) -> respuesta
+answer_cache = LRUTTLCache(
+    max_entries=config.ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=config.ANSWER_CACHE_TTL_SECONDS,
+    nombre="respuestas"
+)
+
+# Caché semántica: reutiliza el embedding de la query que el RAG ya necesita para recuperar contexto
+semantic_cache = SemanticAnswerCache(
+    max_entries=config.SEMANTIC_CACHE_MAX_ENTRIES,
+    threshold=config.SEMANTIC_CACHE_THRESHOLD,
+    ttl_seconds=config.ANSWER_CACHE_TTL_SECONDS,
+    terminos_clave=config.SEMANTIC_CACHE_KEY_TERMS
+)
+
+# Construye el índice de tablas XLSX (índice invertido por columna) de cada snapshot
+motor_tablas = MotorTablas(
+    max_filas=config.XLSX_MAX_ROWS_PER_TABLE,
+    max_columnas=config.XLSX_MAX_COLUMNS,
+    max_tablas=config.XLSX_MAX_TABLES,
+    cache_dir=config.XLSX_CACHE_PATH
+)
+
 # Configuración de memoria optimizada
 MAX_MESSAGES_PER_USER = 5  # Solo 5 mensajes por usuario antes de reset
 MAX_CONCURRENT_USERS = 25  # Máximo de usuarios concurrentes
@@ -64,6 +101,28 @@ def limpiar_memoria_global():
                 del conversaciones[user_id]
                 logger.info(f"🧹 Usuario {user_id} removido por límite de concurrencia")
 
+def registrar_latencia(total: float, ttft: float = None):
+    """Registrar latencia total y, si aplica, tiempo hasta el primer token"""
+    with metricas_lock:
+        metricas_latencia['total'].append(total)
+        if ttft is not None:
+            metricas_latencia['ttft'].append(ttft)
+
+def get_latency_stats() -> dict:
+    """Percentiles p50/p95 de latencia total y tiempo hasta el primer token"""
+    stats = {}
+    with metricas_lock:
+        for nombre, valores in metricas_latencia.items():
+            valores = sorted(valores)
+            if len(valores) >= 2:
+                cuantiles = statistics.quantiles(valores, n=20)
+                stats[nombre] = {'n': len(valores), 'p50': statistics.median(valores), 'p95': cuantiles[18]}
+            elif valores:
+                stats[nombre] = {'n': 1, 'p50': valores[0], 'p95': valores[0]}
+            else:
+                stats[nombre] = {'n': 0}
+    return stats
+
 def inicializar_limpieza_memoria():
     """Inicializar thread de limpieza de memoria"""
     def cleanup_worker():
@@ -71,8 +130,13 @@ def inicializar_limpieza_memoria():
             time.sleep(USER_CLEANUP_INTERVAL)
             try:
                 limpiar_memoria_global()
-                stats = llm_pool.get_stats()
+                stats = get_llm_pool().get_stats()
                 logger.info(f"📊 Pool Stats: {stats}")
+                logger.info(f"🗃️ Caché de respuestas: {answer_cache.get_stats()}")
+                logger.info(f"🧭 Caché semántica: {semantic_cache.get_stats()}")
+                logger.info(f"⚡ Cachés RAG: {get_rag_system().get_cache_stats()}")
+                logger.info(f"⏱️ Latencias: {get_latency_stats()}")
+                logger.info(f"🔗 Single-flight: {preguntas_en_curso.get_stats()}")
                 logger.info(f"💾 Usuarios en memoria: {len(conversaciones)}")
             except Exception as e:
                 logger.error(f"Error en limpieza de memoria: {e}")
@@ -81,80 +145,137 @@ def inicializar_limpieza_memoria():
     cleanup_thread.start()
     logger.info("🧹 Sistema de limpieza de memoria iniciado")
 
-def cargar_documentos(force_reload=True):
-    global docs_string, system_prompt, ultimo_update
+def _iniciar_limpieza():
+    """Inicializar sistema de limpieza si no está iniciado"""
+    if not hasattr(inicializar_limpieza_memoria, '_iniciado'):
+        inicializar_limpieza_memoria()
+        inicializar_limpieza_memoria._iniciado = True
+
+def _huella(system_prompt: str, tablas: IndiceTablas) -> tuple:
+    """(hash del system prompt, hash de los XLSX, versión del índice RAG)"""
+    return (hashlib.sha1(system_prompt.encode('utf-8')).hexdigest(), tablas.huella, get_rag_system().index_version)
+
+def publicar_conocimiento(system_prompt: str, catalogo: str, tablas: IndiceTablas) -> KnowledgeSnapshot:
+    """Publicar un snapshot nuevo si cambió el system prompt, las tablas XLSX o el índice RAG"""
+    actual = snapshot_actual()
+    huella = _huella(system_prompt, tablas)
+    if huella == actual.huella:
+        logger.info(f"🏷️ Base de conocimiento sin cambios (versión {actual.version})")
+        return actual
+    rag_system = get_rag_system()
+    snapshot = KnowledgeSnapshot(
+        version=actual.version + 1,
+        system_prompt=system_prompt,
+        catalogo=catalogo,
+        tablas=tablas,
+        rag=rag_system,
+        indice=rag_system.indice,
+        version_rag=rag_system.index_version,
+        huella=huella
+    )
+    if publicar(snapshot):
+        answer_cache.clear()
+        logger.info(f"🏷️ Nueva versión de conocimiento: {snapshot.version}. Caché de respuestas invalidada")
+    return snapshot_actual()
+
+def arrancar_conocimiento():
+    """Publicar de inmediato el conocimiento disponible al arrancar, sin esperar a Drive.
+
+    Con un snapshot persistido se restauran las tablas, el system prompt y los XLSX en memoria
+    (milisegundos) y se devuelve el estado de Drive con el que se construyó, para que la
+    reconciliación en segundo plano solo descargue lo que cambió. Sin snapshot se publica el
+    prompt base (el índice RAG ya está en disco) y se devuelve None.
+    """
+    _iniciar_limpieza()
+    datos = cargar_de_disco(config.KNOWLEDGE_SNAPSHOT_PATH)
+    if datos is None:
+        logger.info("ℹ️ Sin snapshot de conocimiento persistido: se publica el prompt base hasta sincronizar Drive")
+        publicar_conocimiento(prompt_base + "\n", "", IndiceTablas())
+        return None
+
+    for nombre, contenido in datos['libros'].items():
+        file_memory_storage[nombre] = io.BytesIO(contenido)
+    rag_system = get_rag_system()
+    snapshot = KnowledgeSnapshot(
+        version=datos['version'],
+        system_prompt=datos['system_prompt'],
+        catalogo=datos['catalogo'],
+        tablas=datos['tablas'],
+        rag=rag_system,
+        indice=rag_system.indice,
+        version_rag=rag_system.index_version,
+        huella=_huella(datos['system_prompt'], datos['tablas']),
+        creado=datos['creado']
+    )
+    publicar(snapshot)
+    logger.info(f"⚡ Arranque en caliente: {len(snapshot.tablas)} tablas de {len(datos['libros'])} XLSX, "
+                f"snapshot creado el {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(snapshot.creado))}")
+    return datos['estado_drive']
+
+def cargar_documentos(force_reload=True, estado_drive: dict = None):
+    """Construir un snapshot de conocimiento nuevo (tablas, system prompt, RAG) y publicarlo.
 
+    Todo se prepara fuera del camino de las preguntas, que siguen usando el snapshot anterior
+    hasta el reemplazo de la referencia. Con estado_drive (el estado de Drive que refleja
+    file_memory_storage) el snapshot se persiste para el próximo arranque.
+    """
+    global _ultima_carga
     logger.info(f"🔄 Cargando documentos (force_reload={force_reload})")
     
     # Evitar recargas innecesarias si no hay cambios
-    if not force_reload and docs_string and system_prompt and time.time() - ultimo_update < 60:
+    if not force_reload and time.time() - _ultima_carga < 60:
         logger.info("⏭️ Documentos cargados recientemente, saltando recarga")
         return
 
-    # Procesar solo archivos XLSX desde memoria para system prompt
+    with _carga_lock:
+        _cargar_documentos(estado_drive)
+        _ultima_carga = time.time()
+
+    _iniciar_limpieza()
+
+def sincronizar_rag():
+    """Reconciliar el índice RAG con los documentos en disco sin reconstruir tablas ni system prompt.
+
+    Para el arranque en caliente sin cambios en Drive: el snapshot restaurado sigue vigente, pero
+    el índice pudo quedar a medias (reinicio durante una ingesta). Si cambia, se publica un snapshot
+    con el mismo conocimiento y la nueva generación del índice.
+    """
+    rag_system = get_rag_system()
+    if not rag_system.is_initialized():
+        logger.warning("❌ Sistema RAG no está inicializado correctamente")
+        return
+    with _carga_lock:
+        if not rag_system.update_vectorstore(config.DOWNLOAD_PATH):
+            logger.warning("⚠️ No se pudo reconciliar el sistema RAG")
+            return
+        actual = snapshot_actual()
+        publicar_conocimiento(actual.system_prompt, actual.catalogo, actual.tablas)
+        rag_system.retirar_generaciones_anteriores()
+
+def _cargar_documentos(estado_drive: dict = None):
+    # Los XLSX se cargan como tablas: el system prompt solo lleva su catálogo y cada
+    # pregunta recibe las filas relevantes (ver _construir_prompt)
     archivos_xlsx = [f for f in file_memory_storage.keys() if f.lower().endswith('.xlsx')] if file_memory_storage else []
     
     logger.info(f"📊 Archivos en memoria total: {len(file_memory_storage) if file_memory_storage else 0}")
-    logger.info(f"📋 Archivos XLSX para system prompt: {len(archivos_xlsx)}")
-    
-    if not archivos_xlsx:
-        logger.info("ℹ️ No hay archivos XLSX en memoria, usando solo prompt base")
-        docs_string = ""
-        system_prompt = prompt_base + "\n"
-        ultimo_update = time.time()
-    else:
+    logger.info(f"📋 Archivos XLSX para tablas: {len(archivos_xlsx)}")
 
-        todos_docs = []
-        for archivo_nombre in archivos_xlsx:
-            try:
-                archivo_contenido = file_memory_storage[archivo_nombre]
-                extension = os.path.splitext(archivo_nombre)[1].lower()
-                
-                logger.info(f"Procesando archivo XLSX en memoria: {archivo_nombre}")
-                
-                # Reiniciar el puntero al inicio del archivo en memoria
-                archivo_contenido.seek(0)
-                
-                # Usar UnstructuredFileIOLoader para trabajar con archivos en memoria
-                loader = UnstructuredFileIOLoader(
-                    archivo_contenido, 
-                    mode="elements"
-                )
-                
-                try:
-                    docs = loader.load()
-                    todos_docs.extend(docs)
-                    logger.info(f"Archivo XLSX {archivo_nombre} cargado con {len(docs)} elementos.")
-                except Exception as e:
-                    logger.error(f"Error durante la carga de {archivo_nombre}: {e}")
-                    # Si falla el primer intento, intentamos de nuevo con diferentes configuraciones
-                    try:
-                        archivo_contenido.seek(0)
-                        loader = UnstructuredFileIOLoader(
-                            archivo_contenido,
-                            mode="single"
-                        )
-                        docs = loader.load()
-                        todos_docs.extend(docs)
-                        logger.info(f"Segundo intento exitoso para {archivo_nombre}: {len(docs)} elementos.")
-                    except Exception as e2:
-                        logger.error(f"Error en segundo intento para {archivo_nombre}: {e2}")
-                
-            except Exception as e:
-                logger.error(f"Error al procesar el archivo XLSX {archivo_nombre}: {e}")
-
-        if todos_docs:
-            docs_string = "\n".join([doc.page_content for doc in todos_docs])
-            system_prompt = prompt_base + docs_string + "\n"
-            ultimo_update = time.time()
-            logger.info(f"Documentos XLSX cargados: {len(todos_docs)} elementos. Longitud texto: {len(docs_string)} chars.")
-            logger.debug(f"Muestra contenido XLSX: {docs_string[:200]}...")
+    libros = {archivo_nombre: file_memory_storage[archivo_nombre] for archivo_nombre in archivos_xlsx}
+    tablas = motor_tablas.cargar(libros)
+    catalogo = tablas.catalogo()
+    if catalogo:
+        system_prompt = (
+            prompt_base
+            + "Tablas disponibles (con cada pregunta recibirás sus filas relevantes en formato de tabla):\n"
+            + catalogo + "\n"
+        )
+        logger.info(f"Tablas XLSX cargadas: {len(tablas)} tablas. Catálogo: {len(catalogo)} chars.")
+    else:
+        if archivos_xlsx:
+            logger.warning("Se encontraron archivos XLSX pero no se pudo extraer ninguna tabla.")
         else:
-            logger.warning("Se encontraron archivos XLSX pero no se pudo extraer contenido.")
-            docs_string = ""
-            system_prompt = prompt_base + "\n"
-            ultimo_update = time.time()
-            logger.info("Usando prompt base sin documentos XLSX adicionales.")
+            logger.info("ℹ️ No hay archivos XLSX en memoria, usando solo prompt base")
+        system_prompt = prompt_base + "\n"
 
     # Guardar system prompt en archivo para verificación
     try:
@@ -163,7 +284,7 @@ def cargar_documentos(force_reload=True):
             f.write("SYSTEM PROMPT - VERIFICACIÓN\n")
             f.write(f"Generado: {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
             f.write("="*80 + "\n\n")
-            f.write("NOTA: Este archivo debe contener SOLO contenido de archivos XLSX.\n")
+            f.write("NOTA: Este archivo debe contener SOLO el catálogo de tablas XLSX (sus filas se envían por pregunta).\n")
             f.write("Los archivos PDF/DOCX deben procesarse por RAG, no aparecer aquí.\n")
             f.write("="*80 + "\n\n")
             f.write(system_prompt)
@@ -171,21 +292,23 @@ def cargar_documentos(force_reload=True):
         logger.info("System prompt guardado en 'system_prompt_verificacion.txt' para verificación")
         print(f"✅ System prompt guardado en: system_prompt_verificacion.txt")
         print(f"📊 Longitud total: {len(system_prompt)} caracteres")
-        print(f"📁 Archivos XLSX procesados: {len(archivos_xlsx) if 'archivos_xlsx' in locals() else 0}")
+        print(f"📁 Archivos XLSX procesados: {len(archivos_xlsx)} ({len(tablas)} tablas)")
         
     except Exception as e:
         logger.error(f"Error al guardar system prompt en archivo: {e}")
 
     # Actualizar el sistema RAG con archivos PDF/DOCX del directorio de descarga
+    rag_system = get_rag_system()
     if rag_system.is_initialized():
         logger.info("🤖 Iniciando actualización del sistema RAG...")
         
         # Verificar si hay archivos PDF/DOCX en el directorio
         pdf_docx_files = []
         if os.path.exists(config.DOWNLOAD_PATH):
-            for file in os.listdir(config.DOWNLOAD_PATH):
-                if file.lower().endswith(('.pdf', '.docx', '.doc')):
-                    pdf_docx_files.append(file)
+            for _, _, files in os.walk(config.DOWNLOAD_PATH):
+                for file in files:
+                    if file.lower().endswith(('.pdf', '.docx', '.doc')):
+                        pdf_docx_files.append(file)
         
         logger.info(f"📁 Archivos PDF/DOCX en directorio: {len(pdf_docx_files)}")
         
@@ -196,69 +319,277 @@ def cargar_documentos(force_reload=True):
     else:
         logger.warning("❌ Sistema RAG no está inicializado correctamente")
 
-    # Inicializar sistema de limpieza si no está iniciado
-    if not hasattr(cargar_documentos, '_cleanup_iniciado'):
-        inicializar_limpieza_memoria()
-        cargar_documentos._cleanup_iniciado = True
+    snapshot = publicar_conocimiento(system_prompt, catalogo, tablas)
+    # El snapshot vigente ya fija la generación activa: las reemplazadas se pueden eliminar
+    rag_system.retirar_generaciones_anteriores()
+    if estado_drive is not None:
+        guardar_en_disco(snapshot, config.KNOWLEDGE_SNAPSHOT_PATH,
+                         {nombre: contenido.getvalue() for nombre, contenido in libros.items()}, estado_drive)
 
 def inicializar_llm():
     global llm
     logger.info("NOTA: Usando LLM Pool en lugar de instancia única")
     # Ya no necesitamos una instancia única, usamos el pool
 
-def generar_respuesta(pregunta, historial_mensajes, user_id: str):
-    """Generar respuesta usando el pool de LLMs con optimización de memoria"""
-    
-    if docs_actualizados.is_set():
-        logger.info("Esperando actualización de documentos...")
-        docs_actualizados.wait()
-        logger.info("Actualización de documentos completada.")
+def _construir_prompt(pregunta, historial_mensajes, user_id: str, snapshot: KnowledgeSnapshot, embedding=None) -> str:
+    """Construir el prompt completo (system prompt + contexto RAG + historial) con un único snapshot"""
 
-    logger.info(f"👤 Generando respuesta para usuario {user_id}: {pregunta[:50]}...")
+    logger.info(f"👤 Generando respuesta para usuario {user_id} (conocimiento v{snapshot.version}): {pregunta[:50]}...")
 
     # Obtener contexto relevante del RAG si está disponible
-    rag_context = ""
-    if rag_system.is_initialized():
+    rag_chunks = []
+    if snapshot.rag is not None and snapshot.rag.is_initialized():
         try:
-            rag_context = rag_system.get_context_from_query(pregunta, k=5)
-            if rag_context:
-                logger.info(f"📚 Contexto RAG obtenido: {len(rag_context)} caracteres")
+            rag_chunks = snapshot.rag.get_context_chunks(pregunta, k=5, embedding=embedding, indice=snapshot.indice)
+            if rag_chunks:
+                logger.info(f"📚 Contexto RAG obtenido: {len(rag_chunks)} fragmentos")
             else:
                 logger.info("ℹ️ No se encontró contexto relevante en RAG")
         except Exception as e:
             logger.error(f"Error al obtener contexto RAG: {e}")
-            rag_context = ""
+            rag_chunks = []
     else:
         logger.warning("⚠️ Sistema RAG no inicializado, solo usando context XLSX")
 
     # Optimización de memoria: limitar historial automáticamente
     historial_limitado = historial_mensajes[-MAX_MESSAGES_PER_USER*2:] if len(historial_mensajes) > MAX_MESSAGES_PER_USER*2 else historial_mensajes
 
-    history_text = ""
+    lineas_historial = []
     for msg in historial_limitado:
         role = "Usuario" if msg["role"] == "user" else "Asistente"
-        history_text += f"{role}: {msg['content']}\n"
+        lineas_historial.append(f"{role}: {msg['content']}\n")
 
-    # Construir prompt con contexto RAG adicional si está disponible
-    if rag_context:
-        full_prompt = f"{system_prompt}\n\n# Contexto adicional de documentos PDF/DOCX:\n{rag_context}\n\n{history_text}Usuario: {pregunta}\nAsistente:"
-    else:
-        full_prompt = f"{system_prompt}\n{history_text}Usuario: {pregunta}\nAsistente:"
+    # Filas de las tablas XLSX relevantes a la pregunta (índice invertido, sin llamadas de red)
+    try:
+        tablas = snapshot.tablas.seleccionar(pregunta)
+    except Exception as e:
+        logger.error(f"Error al seleccionar filas de tablas XLSX: {e}")
+        tablas = []
+
+    # Ensamblar dentro del presupuesto de tokens (recorta RAG peor clasificado, tablas e historial antiguo)
+    return ensamblar_prompt(snapshot.system_prompt, rag_chunks, lineas_historial, pregunta, tablas=tablas)
+
+def normalizar_pregunta(pregunta: str) -> str:
+    """Normalizar una pregunta para comparar: minúsculas, sin tildes, sin signos y espacios colapsados"""
+    texto = unicodedata.normalize('NFKD', pregunta.lower())
+    texto = ''.join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r'[¿?¡!.,;:"\'()]', ' ', texto)
+    return ' '.join(texto.split())
+
+def _clave_single_flight(pregunta, historial_mensajes, version: int):
+    """Clave de coalescencia: solo para preguntas de primer turno (sin historial)"""
+    if historial_mensajes:
+        return None
+    return (normalizar_pregunta(pregunta), version)
+
+def _clave_cache(pregunta, historial_mensajes, version: int):
+    """Clave de la caché: pregunta normalizada, hash del historial reciente y versión de conocimiento"""
+    historial = historial_mensajes[-MAX_MESSAGES_PER_USER*2:]
+    texto_historial = "\n".join(f"{msg['role']}:{msg['content']}" for msg in historial)
+    hash_historial = hashlib.sha1(texto_historial.encode('utf-8')).hexdigest()
+    return (normalizar_pregunta(pregunta), hash_historial, version)
+
+def _es_respuesta_cacheable(respuesta):
+    """Nunca cachear mensajes de error ni respuestas interrumpidas"""
+    return bool(respuesta) and respuesta not in MENSAJES_ERROR and not respuesta.endswith(MSG_ERROR)
+
+def _guardar_en_cache(clave, respuesta):
+    if _es_respuesta_cacheable(respuesta):
+        answer_cache.put(clave, respuesta)
+
+def _buscar_en_cache_semantica(pregunta, historial_mensajes, user_id: str, snapshot: KnowledgeSnapshot):
+    """Para preguntas de primer turno: calcular el embedding y consultar la caché semántica.
+
+    Devuelve (embedding, respuesta); el embedding se reutiliza después para el retrieval RAG.
+    """
+    rag = snapshot.rag
+    if historial_mensajes or not config.SEMANTIC_CACHE_ENABLED or rag is None or not rag.is_initialized():
+        return None, None
+    embedding = rag.embed_query(pregunta)
+    if embedding is None:
+        return None, None
+    respuesta = semantic_cache.get(embedding, pregunta, snapshot.version)
+    if respuesta is not None:
+        logger.info(f"🧭 Respuesta servida desde caché semántica para usuario {user_id}")
+    return embedding, respuesta
+
+def _guardar_en_cache_semantica(embedding, pregunta, respuesta, version):
+    if embedding is not None and _es_respuesta_cacheable(respuesta):
+        semantic_cache.put(embedding, pregunta, respuesta, version)
+
+def _prioridad(pregunta, historial_mensajes) -> int:
+    """Prioridad en la cola del pool: preguntas cortas de primer turno pasan antes"""
+    return 1 if not historial_mensajes and len(pregunta) <= 200 else 0
+
+def _registrar_version(user_id: str, snapshot: KnowledgeSnapshot, origen: str):
+    """Etiquetar en el log cada respuesta con la versión de conocimiento con la que se generó"""
+    logger.info(f"🏷️ Respuesta para usuario {user_id} ({origen}) con conocimiento v{snapshot.version}")
+
+def _generar_respuesta(pregunta, historial_mensajes, user_id: str, snapshot: KnowledgeSnapshot):
+    inicio = time.time()
+    embedding, respuesta = _buscar_en_cache_semantica(pregunta, historial_mensajes, user_id, snapshot)
+    if respuesta is not None:
+        return respuesta
+
+    # Circuito abierto: responder saturación de inmediato en vez de hacer cola 45s
+    llm_pool = get_llm_pool()
+    if llm_pool.circuito_abierto():
+        return MSG_SATURADO
+
+    full_prompt = _construir_prompt(pregunta, historial_mensajes, user_id, snapshot, embedding=embedding)
 
     # Obtener LLM del pool
-    llm = llm_pool.get_llm(user_id, timeout=45.0)
+    llm = llm_pool.get_llm(user_id, timeout=45.0, prioridad=_prioridad(pregunta, historial_mensajes))
     if llm is None:
-        return "Lo siento, el servicio está temporalmente saturado. Por favor, intenta en unos momentos."
+        return MSG_SATURADO
 
     try:
         # Usar el método de retry del pool
         respuesta = llm_pool.invoke_with_retry(llm, full_prompt, user_id)
+        registrar_latencia(time.time() - inicio)
+        _guardar_en_cache_semantica(embedding, pregunta, respuesta, snapshot.version)
         return respuesta
     finally:
         # Liberar LLM inmediatamente después de cada respuesta para mejor concurrencia
         llm_pool.release_llm(user_id, llm)
         logger.debug(f"🔄 LLM liberado para usuario {user_id} después de respuesta")
 
+def generar_respuesta(pregunta, historial_mensajes, user_id: str, snapshot: KnowledgeSnapshot = None):
+    """Generar respuesta usando el pool de LLMs con optimización de memoria.
+
+    snapshot: conocimiento con el que responder (por defecto el publicado al momento de la llamada).
+    """
+    snapshot = snapshot or snapshot_actual()
+    clave_cache = _clave_cache(pregunta, historial_mensajes, snapshot.version)
+    respuesta = answer_cache.get(clave_cache)
+    if respuesta is not None:
+        logger.info(f"🗃️ Respuesta servida desde caché para usuario {user_id}")
+        _registrar_version(user_id, snapshot, "caché")
+        return respuesta
+
+    clave = _clave_single_flight(pregunta, historial_mensajes, snapshot.version)
+    if clave is None:
+        respuesta = _generar_respuesta(pregunta, historial_mensajes, user_id, snapshot)
+    else:
+        respuesta = preguntas_en_curso.do(clave, _generar_respuesta, pregunta, historial_mensajes, user_id, snapshot)
+    _guardar_en_cache(clave_cache, respuesta)
+    _registrar_version(user_id, snapshot, "LLM")
+    return respuesta
+
+def _generar_respuesta_stream(pregunta, historial_mensajes, user_id: str, snapshot: KnowledgeSnapshot):
+    inicio = time.time()
+    embedding, respuesta = _buscar_en_cache_semantica(pregunta, historial_mensajes, user_id, snapshot)
+    if respuesta is not None:
+        yield respuesta
+        return
+
+    llm_pool = get_llm_pool()
+    if llm_pool.circuito_abierto():
+        yield MSG_SATURADO
+        return
+
+    full_prompt = _construir_prompt(pregunta, historial_mensajes, user_id, snapshot, embedding=embedding)
+
+    llm = llm_pool.get_llm(user_id, timeout=45.0, prioridad=_prioridad(pregunta, historial_mensajes))
+    if llm is None:
+        yield MSG_SATURADO
+        return
+
+    ttft = None
+    fragmentos = []
+    try:
+        for fragmento in llm_pool.stream_with_retry(llm, full_prompt, user_id):
+            if ttft is None:
+                ttft = time.time() - inicio
+                logger.info(f"⚡ Primer token para usuario {user_id} en {ttft:.2f}s")
+            fragmentos.append(fragmento)
+            yield fragmento
+        total = time.time() - inicio
+        registrar_latencia(total, ttft)
+        _guardar_en_cache_semantica(embedding, pregunta, "".join(fragmentos), snapshot.version)
+        logger.info(f"✅ Streaming completado para usuario {user_id} en {total:.2f}s (primer token: {ttft or 0:.2f}s)")
+    finally:
+        llm_pool.release_llm(user_id, llm)
+        logger.debug(f"🔄 LLM liberado para usuario {user_id} después de streaming")
+
+def generar_respuesta_stream(pregunta, historial_mensajes, user_id: str, snapshot: KnowledgeSnapshot = None):
+    """Generar la respuesta como fragmentos de texto (llm.stream) midiendo el tiempo hasta el primer token.
+
+    Si ya hay una pregunta idéntica en curso, se espera su resultado y se entrega en un solo fragmento.
+    snapshot: conocimiento con el que responder (por defecto el publicado al momento de la llamada).
+    """
+    snapshot = snapshot or snapshot_actual()
+    clave_cache = _clave_cache(pregunta, historial_mensajes, snapshot.version)
+    respuesta = answer_cache.get(clave_cache)
+    if respuesta is not None:
+        logger.info(f"🗃️ Respuesta servida desde caché para usuario {user_id}")
+        _registrar_version(user_id, snapshot, "caché")
+        yield respuesta
+        return
+
+    clave = _clave_single_flight(pregunta, historial_mensajes, snapshot.version)
+    if clave is None:
+        fragmentos = []
+        for fragmento in _generar_respuesta_stream(pregunta, historial_mensajes, user_id, snapshot):
+            fragmentos.append(fragmento)
+            yield fragmento
+        _guardar_en_cache(clave_cache, "".join(fragmentos))
+        _registrar_version(user_id, snapshot, "streaming")
+        return
+
+    llamada, es_lider = preguntas_en_curso.unirse_o_liderar(clave)
+    if not es_lider:
+        logger.info(f"🔗 Usuario {user_id} se une a una pregunta idéntica en curso")
+        respuesta = llamada.wait()
+        _registrar_version(user_id, snapshot, "single-flight")
+        yield respuesta
+        return
+
+    fragmentos = []
+    try:
+        for fragmento in _generar_respuesta_stream(pregunta, historial_mensajes, user_id, snapshot):
+            fragmentos.append(fragmento)
+            yield fragmento
+    except GeneratorExit:
+        preguntas_en_curso.fallar(clave, llamada, RuntimeError("La respuesta compartida se interrumpió"))
+        raise
+    except Exception as e:
+        preguntas_en_curso.fallar(clave, llamada, e)
+        raise
+    respuesta = "".join(fragmentos)
+    preguntas_en_curso.completar(clave, llamada, respuesta)
+    _guardar_en_cache(clave_cache, respuesta)
+    _registrar_version(user_id, snapshot, "streaming")
+
+async def _agenerar_respuesta(pregunta, historial_mensajes, user_id: str, snapshot: KnowledgeSnapshot):
+    # El embedding y la recuperación RAG (Chroma) son síncronos: se ejecutan en el executor por defecto
+    embedding, respuesta = await asyncio.to_thread(_buscar_en_cache_semantica, pregunta, historial_mensajes, user_id, snapshot)
+    if respuesta is not None:
+        return respuesta
+    full_prompt = await asyncio.to_thread(_construir_prompt, pregunta, historial_mensajes, user_id, snapshot, embedding)
+    respuesta = await get_async_llm_pool().ainvoke_with_retry(full_prompt, user_id, timeout=45.0)
+    _guardar_en_cache_semantica(embedding, pregunta, respuesta, snapshot.version)
+    return respuesta
+
+async def agenerar_respuesta(pregunta, historial_mensajes, user_id: str, snapshot: KnowledgeSnapshot = None):
+    """Versión asíncrona de generar_respuesta sobre el pool asíncrono (ainvoke)"""
+    snapshot = snapshot or snapshot_actual()
+    clave_cache = _clave_cache(pregunta, historial_mensajes, snapshot.version)
+    respuesta = answer_cache.get(clave_cache)
+    if respuesta is not None:
+        logger.info(f"🗃️ Respuesta servida desde caché para usuario {user_id}")
+        _registrar_version(user_id, snapshot, "caché")
+        return respuesta
+
+    clave = _clave_single_flight(pregunta, historial_mensajes, snapshot.version)
+    if clave is None:
+        respuesta = await _agenerar_respuesta(pregunta, historial_mensajes, user_id, snapshot)
+    else:
+        respuesta = await preguntas_en_curso.ado(clave, _agenerar_respuesta, pregunta, historial_mensajes, user_id, snapshot)
+    _guardar_en_cache(clave_cache, respuesta)
+    _registrar_version(user_id, snapshot, "LLM")
+    return respuesta
+
 def limitar_historial(historial):
     """Limitar historial a MAX_MESSAGES_PER_USER para optimizar memoria"""
     if len(historial) > MAX_MESSAGES_PER_USER * 2:  # *2 porque son pares usuario-asistente
@@ -272,6 +603,19 @@ def convertir_a_slack_markdown(texto):
     texto = re.sub(r'^- (.*)$', r'• \1', texto, flags=re.MULTILINE) 
     return texto
 
+def punto_de_corte(texto, max_length=config.SLACK_MAX_MESSAGE_LENGTH):
+    """Mejor posición para cortar un texto largo: párrafo, línea, espacio o corte duro"""
+    corte_parrafo = texto.rfind('\n\n', 0, max_length)
+    if corte_parrafo != -1:
+        return corte_parrafo
+    corte_linea = texto.rfind('\n', 0, max_length)
+    if corte_linea != -1:
+        return corte_linea
+    corte_espacio = texto.rfind(' ', 0, max_length)
+    if corte_espacio != -1:
+        return corte_espacio
+    return max_length
+
 def dividir_mensaje(texto, max_length=config.SLACK_MAX_MESSAGE_LENGTH):
     if len(texto) <= max_length:
         return [texto]
@@ -279,20 +623,7 @@ def dividir_mensaje(texto, max_length=config.SLACK_MAX_MESSAGE_LENGTH):
     partes = []
     texto_restante = texto
     while len(texto_restante) > max_length:
-        punto_corte = -1
-        corte_parrafo = texto_restante.rfind('\n\n', 0, max_length)
-        if corte_parrafo != -1:
-            punto_corte = corte_parrafo
-        else:
-            corte_linea = texto_restante.rfind('\n', 0, max_length)
-            if corte_linea != -1:
-                punto_corte = corte_linea
-            else:
-                corte_espacio = texto_restante.rfind(' ', 0, max_length)
-                if corte_espacio != -1:
-                    punto_corte = corte_espacio
-                else:
-                    punto_corte = max_length
+        punto_corte = punto_de_corte(texto_restante, max_length)
 
         partes.append(texto_restante[:punto_corte].strip())
         texto_restante = texto_restante[punto_corte:].strip()
@@ -303,4 +634,4 @@ def dividir_mensaje(texto, max_length=config.SLACK_MAX_MESSAGE_LENGTH):
         partes.append(texto_restante)
 
     logger.info(f"Mensaje dividido en {len(partes)} partes.")
-    return partes 
\ No newline at end of file
+    return partes
\ No newline at end of file
@@ -23,13 +23,91 @@ LLM_TOP_K = 40
 LLM_TOP_P = 0.95
 LLM_MAX_OUTPUT_TOKENS = 2048
 SLACK_MAX_MESSAGE_LENGTH = 2900
+SLACK_STREAMING_ENABLED = True  # Publicar la respuesta progresivamente (chat.update) mientras el LLM genera
+SLACK_STREAM_UPDATE_INTERVAL = 1.0  # Segundos mínimos entre actualizaciones del mensaje en streaming
 HISTORY_MAX_MESSAGES = 5
+EMBEDDING_MODEL_NAME = "models/text-embedding-004"
+RAG_INGEST_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))  # Procesos para parsear PDF/DOCX en paralelo
+RAG_EMBED_CONCURRENCY = 4  # Lotes de embeddings simultáneos durante la ingesta (limitador AIMD propio)
+RAG_EMBED_BATCH_SIZE = 50  # Tamaño inicial de lote; se reduce ante 429 y crece con los éxitos
+RAG_EMBED_BATCH_MIN = 10
+RAG_EMBED_BATCH_MAX = 100
+RAG_VECTOR_BACKEND = "chroma"  # "chroma" o "numpy" (matriz en memoria, top-k con argpartition)
+RAG_NUMPY_INDEX_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'numpy_index')
+RAG_NUMPY_DTYPE = "float32"  # "float16" reduce la memoria a la mitad a costa de una conversión por consulta
+RAG_BM25_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chroma_db', 'bm25_index.pkl')  # Índice léxico persistido
+RAG_EXACT_TERM_K = 3  # Chunks para consultas por código/sigla exacta (menos y más precisos)
+RAG_EXTRA_CANDIDATES = 3  # Candidatos vectoriales extra sobre k cuando BM25 aporta resultados a la fusión
+RAG_BLUE_GREEN_FRACTION = 0.5  # Si cambia al menos esta fracción de archivos, se reindexa en otra colección y se intercambia
+RAG_MMR_LAMBDA = 0.7  # MMR del contexto: 1.0 solo relevancia, valores menores penalizan chunks redundantes
+EMBEDDING_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'embedding_cache.sqlite3')  # Caché persistente de embeddings por hash de texto
+
+# Caché de respuestas (coincidencia exacta, invalidada por versión de conocimiento)
+ANSWER_CACHE_MAX_ENTRIES = 512
+ANSWER_CACHE_TTL_SECONDS = 6 * 3600
+
+# Caché semántica (preguntas de primer turno parecidas por similitud coseno del embedding)
+SEMANTIC_CACHE_ENABLED = True
+SEMANTIC_CACHE_MAX_ENTRIES = 512
+SEMANTIC_CACHE_THRESHOLD = 0.92  # Similitud coseno mínima para reutilizar una respuesta
+# Además de códigos, números y siglas: términos que cambian la respuesta aunque la pregunta sea casi igual
+SEMANTIC_CACHE_KEY_TERMS = (
+    "Ecuador", "Colombia", "Perú", "Chile", "México", "Panamá", "Costa Rica",
+    "El Salvador", "Guatemala", "Honduras", "Nicaragua", "Brasil", "Estados Unidos",
+)
+
+# Cachés del RAG: texto de la query -> embedding y (query, k, filtro, versión del índice) -> chunks recuperados
+RAG_QUERY_EMBEDDING_CACHE_MAX_ENTRIES = 1024
+RAG_QUERY_EMBEDDING_CACHE_TTL_SECONDS = 6 * 3600
+RAG_RETRIEVAL_CACHE_MAX_ENTRIES = 512
+RAG_RETRIEVAL_CACHE_TTL_SECONDS = 3600
+
+# Tablas XLSX: por pregunta solo se envían las filas y columnas relevantes
+XLSX_MAX_ROWS_PER_TABLE = 30
+XLSX_MAX_COLUMNS = 8  # Tablas más anchas se recortan a la primera columna + las pedidas/coincidentes
+XLSX_MAX_TABLES = 4
+XLSX_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'xlsx_cache')  # Tablas parseadas por hash de contenido del libro
+
+# Snapshot de conocimiento persistido (tablas, system prompt, XLSX y estado de Drive) para arrancar sin esperar a Drive
+KNOWLEDGE_SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'knowledge_snapshot.pkl')
+
+# Presupuesto de tokens del prompt (system prompt + contexto RAG + historial + pregunta)
+PROMPT_TOKEN_BUDGET = 120000  # Tope total estimado de tokens de entrada por llamada
+PROMPT_RAG_MAX_TOKENS = 3000  # Tope para los fragmentos RAG (se descartan los peor clasificados)
+PROMPT_TABLES_MAX_TOKENS = 2500  # Tope para las filas de tablas XLSX seleccionadas por pregunta
+PROMPT_HISTORY_MAX_TOKENS = 2000  # Tope para el historial (se descartan los mensajes más antiguos)
+PROMPT_CHARS_PER_TOKEN = 4.0  # Caracteres por token para la estimación local
+
+# Arranque: Slack se conecta de inmediato y responde "arrancando" hasta que el bot está listo
+STARTUP_READY_WAIT_SECONDS = 5  # Espera máxima de una pregunta por el arranque antes de avisar
+STARTUP_PROFILE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'startup_profile.jsonl')  # Un perfil de arranque por línea
 
 # Configuración de concurrencia y rendimiento
-LLM_POOL_SIZE = 15  # Pool de 15 instancias LLM para mejor concurrencia
+LLM_POOL_SIZE = 15  # Máximo de instancias LLM del pool elástico
+LLM_POOL_MIN_SIZE = 2  # Instancias que se mantienen calientes
+LLM_POOL_IDLE_SECONDS = 300  # Una instancia libre más tiempo que esto se destruye (por encima del mínimo)
 MAX_CONCURRENT_USERS = 25  # Máximo usuarios concurrentes
 USER_MEMORY_LIMIT = 5  # Máximo mensajes por usuario antes de reset
 CONNECTION_TIMEOUT = 120  # Timeout de conexiones LLM en segundos (reducido)
+LLM_POOL_SCHEDULER = "fair"  # "fair" (encolado justo por usuario con prioridades/deadlines) o "fifo"
+LLM_ASYNC_MAX_CONCURRENCY = 15  # Llamadas ainvoke simultáneas en el pool asíncrono
+
+# Limitador adaptativo (AIMD) compartido ante errores 429
+LLM_AIMD_INITIAL_LIMIT = LLM_POOL_SIZE  # Concurrencia inicial permitida hacia Gemini
+LLM_AIMD_MIN_LIMIT = 1
+LLM_AIMD_MAX_LIMIT = LLM_POOL_SIZE
+LLM_AIMD_DECREASE_FACTOR = 0.5  # Reducción multiplicativa por cada ráfaga de 429
+LLM_AIMD_DECREASE_COOLDOWN = 2.0  # Segundos mínimos entre reducciones consecutivas
+
+# Resiliencia: timeout por intento, cobertura (hedging) y circuit breaker
+LLM_ATTEMPT_TIMEOUT = 25  # Segundos máximos por intento de llamada a Gemini
+LLM_HEDGING_ENABLED = True  # Lanzar un duplicado si un intento supera el p95 observado
+LLM_HEDGE_MIN_DELAY = 2.0  # Nunca lanzar la cobertura antes de estos segundos
+LLM_MAX_ORPHAN_ATTEMPTS = LLM_POOL_SIZE  # Intentos abandonados (timeout o cobertura perdedora) que pueden seguir corriendo
+LLM_BREAKER_FAILURE_THRESHOLD = 0.5  # Tasa de fallos que abre el circuito
+LLM_BREAKER_WINDOW = 20  # Últimas llamadas consideradas
+LLM_BREAKER_MIN_CALLS = 10  # Llamadas mínimas en la ventana antes de evaluar
+LLM_BREAKER_OPEN_SECONDS = 30  # Tiempo que el circuito permanece abierto antes de probar
 
 # --- INICIO: Nueva lista de usuarios autorizados ---
 # Lista de IDs de usuario de Slack autorizados para interactuar con el bot
@@ -0,0 +1,74 @@
+import os
+import time
+import hashlib
+from typing import List, Optional
+
+from langchain_core.documents import Document
+
+# Módulo ligero a propósito: los procesos de ingesta lo importan sin cargar Chroma, embeddings ni config.
+# Los loaders de unstructured y el splitter se importan al parsear el primer archivo de cada tipo
+
+CHUNK_SIZE = 2000  # Chunks más manejables para mejor precisión
+CHUNK_OVERLAP = 400  # Overlap optimizado (se recorta al unir chunks contiguos en el contexto)
+
+def hash_texto(texto: str) -> str:
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+def dividir_documento(file_path: str, source_path: Optional[str] = None, file_hash: Optional[str] = None) -> List[Document]:
+    """Cargar y dividir un documento en chunks (lanza excepción si falla)"""
+    # Determinar el tipo de loader basado en la extensión
+    file_extension = os.path.splitext(file_path)[1].lower()
+
+    if file_extension == '.pdf':
+        from langchain_community.document_loaders import UnstructuredPDFLoader
+        loader = UnstructuredPDFLoader(file_path)
+    elif file_extension in ['.docx', '.doc']:
+        from langchain_community.document_loaders import UnstructuredWordDocumentLoader
+        loader = UnstructuredWordDocumentLoader(file_path)
+    else:
+        raise ValueError(f"Tipo de archivo no soportado para RAG: {file_extension}")
+
+    documents = loader.load()
+
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    # Configurar el text splitter optimizado para mejor retrieval
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=CHUNK_SIZE,
+        chunk_overlap=CHUNK_OVERLAP,
+        length_function=len,
+        separators=["\n\n", "\n", ". ", "! ", "? ", "; ", ", ", " ", ""]
+    )
+
+    # Dividir documentos en chunks
+    splits = text_splitter.split_documents(documents)
+
+    # Agregar metadata adicional
+    source_path = source_path or os.path.basename(file_path)
+    for i, split in enumerate(splits):
+        split.metadata.update({
+            'source_file': os.path.basename(file_path),
+            'source_path': source_path,
+            'file_hash': file_hash or '',
+            'chunk_hash': hash_texto(split.page_content),
+            'chunk_id': i,
+            'file_type': file_extension,
+            'processed_time': time.time()
+        })
+    return splits
+
+def procesar_archivo(file_path: str, source_path: str, file_hash: str) -> dict:
+    """Tarea de un worker de ingesta: nunca lanza, devuelve chunks o el error y el tiempo empleado"""
+    inicio = time.perf_counter()
+    try:
+        splits = dividir_documento(file_path, source_path, file_hash)
+        error = None
+    except Exception as e:
+        splits = []
+        error = f"{type(e).__name__}: {e}"
+    return {
+        'source_path': source_path,
+        'splits': splits,
+        'error': error,
+        'segundos': time.perf_counter() - inicio,
+    }
@@ -0,0 +1,94 @@
+import hashlib
+import sqlite3
+import threading
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from logger_config import logger
+
+class CachedEmbeddings(Embeddings):
+    """Envoltorio de un modelo de embeddings con caché persistente en SQLite.
+
+    La clave es (modelo, sha256 del texto) y el vector se guarda como BLOB float32.
+    Solo se llama al modelo para los textos que no están en caché, en un único lote.
+    Los embeddings de consultas no se persisten (usan otro task type y cambian en cada pregunta).
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, path: str):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL, "
+            "PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.commit()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _hash(texto: str) -> str:
+        return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+    def _leer(self, hashes: List[str]) -> dict:
+        encontrados = {}
+        with self._lock:
+            # SQLite limita el número de parámetros por consulta
+            for i in range(0, len(hashes), 500):
+                lote = hashes[i:i + 500]
+                filas = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({','.join('?' * len(lote))})",
+                    [self.model_name, *lote]
+                ).fetchall()
+                for text_hash, blob in filas:
+                    encontrados[text_hash] = np.frombuffer(blob, dtype=np.float32).tolist()
+        return encontrados
+
+    def _guardar(self, pares):
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(self.model_name, text_hash, np.asarray(vector, dtype=np.float32).tobytes()) for text_hash, vector in pares]
+            )
+            self._conn.commit()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [self._hash(texto) for texto in texts]
+        cacheados = self._leer(list(set(hashes)))
+
+        # Textos pendientes sin duplicados (chunks idénticos se embeben una sola vez)
+        pendientes = {}
+        for texto, text_hash in zip(texts, hashes):
+            if text_hash not in cacheados and text_hash not in pendientes:
+                pendientes[text_hash] = texto
+
+        if pendientes:
+            vectores = self.embeddings.embed_documents(list(pendientes.values()))
+            nuevos = list(zip(pendientes.keys(), vectores))
+            self._guardar(nuevos)
+            cacheados.update(nuevos)
+
+        self.hits += len(texts) - len(pendientes)
+        self.misses += len(pendientes)
+        logger.debug(f"🧠 Embeddings: {len(texts) - len(pendientes)} desde caché, {len(pendientes)} calculados")
+        return [cacheados[text_hash] for text_hash in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            entradas = self._conn.execute("SELECT COUNT(*) FROM embeddings WHERE model = ?", (self.model_name,)).fetchone()[0]
+        consultas = self.hits + self.misses
+        return {
+            'entries': entradas,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / consultas, 3) if consultas else 0.0,
+        }
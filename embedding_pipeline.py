@@ -0,0 +1,157 @@
+import time
+import queue
+import contextlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from langchain_core.documents import Document
+
+import config
+from logger_config import logger
+from rate_limiter import AdaptiveConcurrencyLimiter, extraer_retry_after, es_error_rate_limit
+
+class EmbeddingPipeline:
+    """Ingesta en tubería: varios lotes de embeddings en paralelo y un único escritor de Chroma.
+
+    agregar() acumula chunks y despacha un lote cada vez que alcanza el tamaño actual. Cada
+    lote se embebe en un hilo bajo el limitador AIMD; ante un 429 se reduce la concurrencia
+    y el tamaño de los lotes siguientes y se reintenta con backoff. Los vectores pasan a una
+    cola que consume un solo hilo escritor, así la escritura en Chroma se solapa con los
+    siguientes embeddings.
+    """
+
+    def __init__(self, coleccion, embeddings, limiter: AdaptiveConcurrencyLimiter,
+                 concurrencia: int = None, batch_size: int = None, max_retries: int = 5, al_escribir=None,
+                 bloqueo_escritura=None):
+        self.coleccion = coleccion  # Colección de Chroma o índice NumPy (misma API de upsert)
+        self.al_escribir = al_escribir  # Callback (ids, docs) tras cada escritura, p. ej. para el índice BM25
+        self.bloqueo_escritura = bloqueo_escritura or contextlib.nullcontext  # Fábrica de context manager por lote
+        self.embeddings = embeddings
+        self.limiter = limiter
+        self.concurrencia = concurrencia or config.RAG_EMBED_CONCURRENCY
+        self.batch_size = batch_size or config.RAG_EMBED_BATCH_SIZE
+        self.batch_min = config.RAG_EMBED_BATCH_MIN
+        self.batch_max = config.RAG_EMBED_BATCH_MAX
+        self.max_retries = max_retries
+
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrencia, thread_name_prefix="embed")
+        self._en_vuelo = threading.BoundedSemaphore(self.concurrencia * 2)  # Contrapresión sobre el productor
+        self._futuros = []
+        self._cola_escritura = queue.Queue(maxsize=self.concurrencia * 2)
+        self._escritor = threading.Thread(target=self._escribir, daemon=True)
+        self._escritor.start()
+
+        self._buffer_docs: List[Document] = []
+        self._buffer_ids: List[str] = []
+        self._lock = threading.Lock()
+        self._inicio = time.perf_counter()
+        self.agregados = 0
+        self.lotes = 0
+        self.reintentos = 0
+        self.fallidos = set()  # source_path con chunks que no se pudieron indexar
+
+    def agregar(self, docs: List[Document], ids: List[str]):
+        """Encolar chunks para embeber; bloquea si ya hay demasiados lotes en vuelo"""
+        self._buffer_docs.extend(docs)
+        self._buffer_ids.extend(ids)
+        while len(self._buffer_docs) >= self.batch_size:
+            tamaño = self.batch_size
+            self._despachar(self._buffer_docs[:tamaño], self._buffer_ids[:tamaño])
+            del self._buffer_docs[:tamaño]
+            del self._buffer_ids[:tamaño]
+
+    def _despachar(self, docs: List[Document], ids: List[str]):
+        self._en_vuelo.acquire()
+        self._futuros.append(self._executor.submit(self._embeber, docs, ids))
+
+    def _ajustar_lote(self, rate_limited: bool):
+        with self._lock:
+            if rate_limited:
+                self.batch_size = max(self.batch_min, self.batch_size // 2)
+            else:
+                self.batch_size = min(self.batch_max, self.batch_size + 5)
+
+    def _embeber(self, docs: List[Document], ids: List[str]):
+        try:
+            textos = [doc.page_content for doc in docs]
+            for intento in range(self.max_retries):
+                self.limiter.acquire()
+                try:
+                    vectores = self.embeddings.embed_documents(textos)
+                except Exception as e:
+                    self.limiter.release()
+                    error_str = str(e)
+                    if es_error_rate_limit(error_str):
+                        self.limiter.on_rate_limited()
+                        self._ajustar_lote(rate_limited=True)
+                        espera = self.limiter.backoff_delay(intento, extraer_retry_after(e))
+                    else:
+                        espera = self.limiter.backoff_delay(intento)
+                    if intento == self.max_retries - 1:
+                        logger.error(f"❌ Lote de {len(docs)} chunks sin embeber tras {self.max_retries} intentos: {error_str}")
+                        break
+                    logger.warning(f"⏱️ Error embebiendo lote de {len(docs)} chunks (intento {intento + 1}), reintentando en {espera:.1f}s: {error_str}")
+                    with self._lock:
+                        self.reintentos += 1
+                    time.sleep(espera)
+                    continue
+
+                self.limiter.release()
+                self.limiter.on_success()
+                self._ajustar_lote(rate_limited=False)
+                self._cola_escritura.put((docs, ids, vectores))
+                return
+            self._marcar_fallidos(docs)
+        finally:
+            self._en_vuelo.release()
+
+    def _escribir(self):
+        """Único escritor de Chroma: upsert de lotes ya embebidos"""
+        while True:
+            item = self._cola_escritura.get()
+            if item is None:
+                return
+            docs, ids, vectores = item
+            try:
+                # Upsert y callback bajo el mismo bloqueo: las consultas ven el lote completo o nada
+                with self.bloqueo_escritura():
+                    self.coleccion.upsert(
+                        ids=ids,
+                        embeddings=vectores,
+                        documents=[doc.page_content for doc in docs],
+                        metadatas=[doc.metadata for doc in docs]
+                    )
+                    if self.al_escribir:
+                        self.al_escribir(ids, docs)
+                with self._lock:
+                    self.agregados += len(ids)
+                    self.lotes += 1
+                logger.info(f"✅ Lote de {len(ids)} chunks escrito en vectorstore (total {self.agregados})")
+            except Exception as e:
+                logger.error(f"Error escribiendo lote en vectorstore: {e}")
+                self._marcar_fallidos(docs)
+
+    def _marcar_fallidos(self, docs: List[Document]):
+        with self._lock:
+            self.fallidos.update(doc.metadata.get('source_path') for doc in docs)
+
+    def finalizar(self) -> dict:
+        """Despachar el resto, esperar embeddings y escrituras y devolver el resumen"""
+        if self._buffer_docs:
+            self._despachar(self._buffer_docs, self._buffer_ids)
+            self._buffer_docs, self._buffer_ids = [], []
+        for futuro in self._futuros:
+            futuro.result()
+        self._executor.shutdown(wait=True)
+        self._cola_escritura.put(None)
+        self._escritor.join()
+
+        duracion = time.perf_counter() - self._inicio
+        if self.agregados or self.fallidos:
+            logger.info(
+                f"🚀 Ingesta de embeddings: {self.agregados} chunks en {duracion:.1f}s "
+                f"({self.agregados / max(duracion, 1e-6):.1f} chunks/s), {self.lotes} lotes, "
+                f"{self.reintentos} reintentos, lote final {self.batch_size}, limitador {self.limiter.get_stats()}"
+            )
+        return {'agregados': self.agregados, 'fallidos': set(self.fallidos)}
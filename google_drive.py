@@ -1,25 +1,25 @@
 import os
 import io
 import pickle
+import shutil
 from datetime import datetime
 import time
 import threading
 
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-from googleapiclient.http import MediaIoBaseDownload
-
 import config
 from logger_config import logger
 import chatbot 
 
+# Los clientes de Google se importan dentro de las funciones: chatbot importa este módulo
+# (por file_memory_storage) y el arranque no debe esperar a cargarlos
+
 # Almacenamiento en memoria de archivos
 file_memory_storage = {}
 
 def authenticate():
+    from google.auth.transport.requests import Request
+    from google_auth_oauthlib.flow import InstalledAppFlow
+
     creds = None
     if os.path.exists(config.TOKEN_PICKLE):
         try:
@@ -79,8 +79,15 @@ def save_state(state):
     except Exception as e:
         logger.error(f"Error al guardar el estado en {config.STATE_FILE}: {e}")
 
+def ruta_descarga(file_id, file_name):
+    """Ruta en disco de un PDF/DOCX: una carpeta por ID de Drive evita colisiones entre archivos homónimos"""
+    return os.path.join(config.DOWNLOAD_PATH, file_id, file_name)
+
 def download_file_to_memory(service, file_id, file_name):
     """Solo para archivos XLSX - descargar en memoria"""
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaIoBaseDownload
+
     try:
         logger.info(f"Descargando archivo XLSX en memoria: {file_name} (ID: {file_id})")
         request = service.files().get_media(fileId=file_id)
@@ -103,11 +110,14 @@ def download_file_to_memory(service, file_id, file_name):
 
 def download_file_to_disk(service, file_id, file_name):
     """Para archivos PDF/DOCX - descargar al disco"""
+    from googleapiclient.errors import HttpError
+    from googleapiclient.http import MediaIoBaseDownload
+
     try:
+        file_path = ruta_descarga(file_id, file_name)
         # Crear directorio si no existe
-        os.makedirs(config.DOWNLOAD_PATH, exist_ok=True)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
         
-        file_path = os.path.join(config.DOWNLOAD_PATH, file_name)
         logger.info(f"Descargando archivo al disco: {file_name} (ID: {file_id})")
         
         request = service.files().get_media(fileId=file_id)
@@ -118,6 +128,15 @@ def download_file_to_disk(service, file_id, file_name):
             while not done:
                 status, done = downloader.next_chunk()
         
+        # Eliminar versiones con otro nombre (archivo renombrado en Drive) y la copia del
+        # esquema plano anterior (DOWNLOAD_PATH/nombre) para no indexarlas dos veces
+        carpeta = os.path.dirname(file_path)
+        obsoletos = [os.path.join(carpeta, f) for f in os.listdir(carpeta) if f != file_name]
+        obsoletos.append(os.path.join(config.DOWNLOAD_PATH, file_name))
+        for ruta in obsoletos:
+            if os.path.isfile(ruta):
+                os.remove(ruta)
+        
         logger.info(f"Archivo '{file_name}' descargado exitosamente al disco: {file_path}")
         return True
     except HttpError as error:
@@ -224,7 +243,7 @@ def check_drive_files(service, current_state):
                         force_download = file_name not in file_memory_storage
                     elif mime_type in ['application/pdf', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
                         # Para PDF/DOCX, verificar en disco
-                        file_path = os.path.join(config.DOWNLOAD_PATH, file_name)
+                        file_path = ruta_descarga(file_id, file_name)
                         force_download = not os.path.exists(file_path)
 
                 if force_download or file_id not in current_state or current_state[file_id] != drive_modified_time:
@@ -235,7 +254,7 @@ def check_drive_files(service, current_state):
                             else:
                                 logger.info(f"🆕 Nuevo archivo XLSX para descargar: {file_name}")
                         else:
-                            file_path = os.path.join(config.DOWNLOAD_PATH, file_name)
+                            file_path = ruta_descarga(file_id, file_name)
                             if os.path.exists(file_path):
                                 logger.info(f"♻️ Archivo PDF/DOCX ya en disco, forzando descarga: {file_name}")
                             else:
@@ -289,16 +308,15 @@ def check_drive_files(service, current_state):
                     if file_name.lower().endswith('.xlsx') and file_name in file_memory_storage:
                         del file_memory_storage[file_name]
                         logger.info(f"Archivo XLSX {file_name} eliminado de memoria")
-                    
-                    # Eliminar del disco si es PDF/DOCX
-                    elif file_name.lower().endswith(('.pdf', '.docx', '.doc')):
-                        file_path = os.path.join(config.DOWNLOAD_PATH, file_name)
-                        if os.path.exists(file_path):
-                            try:
-                                os.remove(file_path)
-                                logger.info(f"Archivo {file_name} eliminado del disco")
-                            except Exception as e:
-                                logger.error(f"Error al eliminar archivo del disco {file_name}: {e}")
+                
+                # Eliminar del disco si es PDF/DOCX (la carpeta del ID no depende del nombre)
+                carpeta_archivo = os.path.join(config.DOWNLOAD_PATH, id_to_remove)
+                if os.path.isdir(carpeta_archivo):
+                    try:
+                        shutil.rmtree(carpeta_archivo)
+                        logger.info(f"Archivo con ID {id_to_remove} eliminado del disco")
+                    except Exception as e:
+                        logger.error(f"Error al eliminar archivo del disco {id_to_remove}: {e}")
                 
                 logger.info(f"Archivo con ID {id_to_remove} ya no está en Drive o fue eliminado. Eliminando del estado.")
                 del new_state[id_to_remove]
@@ -310,7 +328,15 @@ def check_drive_files(service, current_state):
         logger.error(f'Ocurrió un error durante la verificación de Drive: {e}')
         return current_state, 0, 0, False
 
-def monitoreo_drive():
+def monitoreo_drive(estado_inicial=None):
+    """Sincronizar Drive periódicamente.
+
+    estado_inicial: estado de Drive del snapshot restaurado al arrancar; los XLSX en memoria
+    corresponden a él, así que la primera verificación parte de ahí y no de STATE_FILE.
+    """
+    from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
+
     logger.info("Iniciando monitoreo de Google Drive...")
     creds = authenticate()
     if not creds:
@@ -321,8 +347,12 @@ def monitoreo_drive():
         service = build('drive', 'v3', credentials=creds)
         logger.info("Autenticación exitosa y servicio de Drive creado.")
 
-        current_state = load_state()
-        logger.info(f"Estado inicial cargado con {len(current_state)} archivos rastreados.")
+        if estado_inicial is not None:
+            current_state = estado_inicial
+            logger.info(f"Estado inicial restaurado del snapshot con {len(current_state)} archivos rastreados.")
+        else:
+            current_state = load_state()
+            logger.info(f"Estado inicial cargado con {len(current_state)} archivos rastreados.")
 
         logger.info("Realizando verificación inicial de archivos en Drive...")
         new_state, added, updated, cambios = check_drive_files(service, current_state)
@@ -332,11 +362,14 @@ def monitoreo_drive():
             save_state(new_state)
             current_state = new_state
             logger.info(f"Resumen inicial: {added} archivos agregados, {updated} archivos actualizados.")
-            chatbot.cargar_documentos(force_reload=True)
-            chatbot.docs_actualizados.set()
+            chatbot.cargar_documentos(force_reload=True, estado_drive=new_state)
+        elif estado_inicial is not None:
+            logger.info("No se detectaron cambios respecto al snapshot restaurado: el conocimiento publicado está vigente. "
+                        "Reconciliando el índice RAG en segundo plano...")
+            threading.Thread(target=chatbot.sincronizar_rag, daemon=True).start()
         else:
             logger.info("No se detectaron cambios respecto al estado guardado. Cargando documentos existentes...")
-            chatbot.cargar_documentos(force_reload=False)
+            chatbot.cargar_documentos(force_reload=False, estado_drive=current_state)
         while True:
             logger.info(f"Esperando {config.CHECK_INTERVAL_SECONDS} segundos para la próxima verificación de Drive...")
             time.sleep(config.CHECK_INTERVAL_SECONDS)
@@ -351,8 +384,7 @@ def monitoreo_drive():
                     save_state(new_state)
                     current_state = new_state
                     logger.info(f"Resumen: {added} archivos agregados, {updated} archivos actualizados.")
-                    chatbot.cargar_documentos(force_reload=True)
-                    chatbot.docs_actualizados.set()
+                    chatbot.cargar_documentos(force_reload=True, estado_drive=new_state)
                 else:
                     logger.info("No se detectaron cambios en los archivos.")
 
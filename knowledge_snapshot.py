@@ -0,0 +1,113 @@
+import os
+import pickle
+import threading
+import time
+from typing import Dict, Optional
+
+from logger_config import logger
+from xlsx_tables import IndiceTablas, VERSION_PARSEO
+
+FORMATO_DISCO = 1  # Subir al cambiar qué se guarda en disco: los snapshots anteriores se ignoran
+
+class KnowledgeSnapshot:
+    """Estado de la base de conocimiento con el que se responde una pregunta.
+
+    Inmutable: se construye completo fuera del camino de las preguntas (hilo de Drive) y se
+    publica reemplazando una sola referencia. Cada pregunta toma el snapshot actual una vez
+    y usa ese mismo objeto de principio a fin, así nunca ve un prompt nuevo con tablas viejas.
+
+    Del RAG se fija la generación del índice (IndiceRAG): una reindexación blue/green no la
+    elimina hasta que se publica el snapshot con la nueva. Las actualizaciones incrementales
+    (archivos sueltos) sí se aplican sobre la misma generación y se ven de inmediato.
+    """
+
+    __slots__ = ('version', 'system_prompt', 'catalogo', 'tablas', 'rag', 'indice', 'version_rag', 'huella', 'creado')
+
+    def __init__(self, version: int, system_prompt: str, catalogo: str, tablas: IndiceTablas,
+                 rag=None, indice=None, version_rag: int = 0, huella: tuple = None, creado: float = None):
+        valores = {
+            'version': version,
+            'system_prompt': system_prompt,
+            'catalogo': catalogo,
+            'tablas': tablas,
+            'rag': rag,  # RAGSystem que atiende la recuperación (con su propio lock de lectura)
+            'indice': indice,  # Generación del índice RAG activa al construir el snapshot
+            'version_rag': version_rag,  # index_version del RAG al construir el snapshot
+            'huella': huella,  # (hash del system prompt, hash de los XLSX, versión del índice RAG)
+            'creado': time.time() if creado is None else creado,
+        }
+        for nombre, valor in valores.items():
+            object.__setattr__(self, nombre, valor)
+
+    def __setattr__(self, nombre, valor):
+        raise AttributeError("KnowledgeSnapshot es inmutable: construir uno nuevo y publicarlo")
+
+    def __delattr__(self, nombre):
+        raise AttributeError("KnowledgeSnapshot es inmutable: construir uno nuevo y publicarlo")
+
+    def __repr__(self):
+        return (f"KnowledgeSnapshot(version={self.version}, tablas={len(self.tablas)}, "
+                f"prompt={len(self.system_prompt)} chars, version_rag={self.version_rag})")
+
+# Snapshot vigente: leerlo es leer una referencia (atómico), los lectores nunca se bloquean
+_actual = KnowledgeSnapshot(0, "", "", IndiceTablas())
+_publicacion_lock = threading.Lock()  # Solo entre publicadores, para que la versión nunca retroceda
+
+def snapshot_actual() -> KnowledgeSnapshot:
+    return _actual
+
+def publicar(snapshot: KnowledgeSnapshot) -> bool:
+    """Reemplazar el snapshot vigente; se descarta si es más viejo que el publicado"""
+    global _actual
+    with _publicacion_lock:
+        if snapshot.version < _actual.version:
+            logger.warning(f"🏷️ Snapshot v{snapshot.version} descartado: ya está publicado v{_actual.version}")
+            return False
+        _actual = snapshot
+    logger.info(f"🏷️ Publicado {snapshot!r}")
+    return True
+
+def guardar_en_disco(snapshot: KnowledgeSnapshot, ruta: str, libros: Dict[str, bytes], estado_drive: dict) -> bool:
+    """Persistir el snapshot (tablas ya parseadas, system prompt) junto con los XLSX y el estado de Drive.
+
+    Los libros y el estado de Drive van juntos para que, tras un reinicio, la reconciliación con
+    Drive parta exactamente de lo que hay en memoria y solo descargue lo que cambió.
+    """
+    datos = {
+        'formato': FORMATO_DISCO,
+        'version_parseo': VERSION_PARSEO,
+        'version': snapshot.version,
+        'system_prompt': snapshot.system_prompt,
+        'catalogo': snapshot.catalogo,
+        'tablas': snapshot.tablas,
+        'creado': snapshot.creado,
+        'libros': libros,
+        'estado_drive': estado_drive,
+    }
+    try:
+        os.makedirs(os.path.dirname(ruta) or '.', exist_ok=True)
+        with open(f"{ruta}.tmp", 'wb') as f:
+            pickle.dump(datos, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(f"{ruta}.tmp", ruta)
+        logger.info(f"💾 Snapshot v{snapshot.version} persistido en {ruta} ({os.path.getsize(ruta) / 1024:.0f} KB)")
+        return True
+    except Exception as e:
+        logger.warning(f"No se pudo persistir el snapshot de conocimiento: {e}")
+        return False
+
+def cargar_de_disco(ruta: str) -> Optional[dict]:
+    """Leer un snapshot persistido; None si no existe, está corrupto o es de otro formato"""
+    if not os.path.exists(ruta):
+        return None
+    inicio = time.time()
+    try:
+        with open(ruta, 'rb') as f:
+            datos = pickle.load(f)
+    except Exception as e:
+        logger.warning(f"Snapshot de conocimiento ilegible ({ruta}), se ignorará: {e}")
+        return None
+    if datos.get('formato') != FORMATO_DISCO or datos.get('version_parseo') != VERSION_PARSEO:
+        logger.info("ℹ️ Snapshot de conocimiento de un formato anterior, se ignorará")
+        return None
+    logger.info(f"💾 Snapshot v{datos['version']} leído de disco en {(time.time() - inicio) * 1000:.0f} ms")
+    return datos
@@ -1,68 +1,253 @@
+import asyncio
 import threading
 import time
-import queue
-from typing import Optional
-from langchain_google_genai import ChatGoogleGenerativeAI
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import TYPE_CHECKING, Optional
 
 import config
 from logger_config import logger
+from rate_limiter import AdaptiveConcurrencyLimiter, extraer_retry_after, es_error_rate_limit
+from scheduler import Ticket, crear_scheduler
+from resilience import CircuitBreaker, LatencyTracker, PermisoCircuito
+
+if TYPE_CHECKING:
+    from langchain_google_genai import ChatGoogleGenerativeAI  # Se importa al crear la primera instancia
+
+MSG_SATURADO = "Lo siento, el servicio está temporalmente saturado. Por favor, intenta en unos momentos."
+MSG_SATURADO_REINTENTOS = "Lo siento, el servicio está temporalmente saturado. Por favor, intenta en unos minutos."
+MSG_PAYLOAD = "Lo siento, tu consulta es demasiado larga. Por favor, intenta con una pregunta más específica."
+MSG_ERROR = "Lo siento, ocurrió un error inesperado. Por favor, intenta nuevamente."
+MSG_REINTENTOS = "Lo siento, no se pudo procesar tu solicitud después de varios intentos."
+MENSAJES_ERROR = (MSG_SATURADO, MSG_SATURADO_REINTENTOS, MSG_PAYLOAD, MSG_ERROR, MSG_REINTENTOS)
+
+def _es_error_payload(error_str: str) -> bool:
+    """Detectar errores de tamaño de payload"""
+    return "400" in error_str and "request payload size" in error_str.lower()
+
+def _resolver_error(error: Exception, attempt: int, max_retries: int, limiter: AdaptiveConcurrencyLimiter, user_id: str):
+    """Clasificar un error del LLM: devuelve (segundos a esperar antes de reintentar, None) o (None, mensaje final)"""
+    error_str = str(error)
+    logger.error(f"❌ Error LLM para usuario {user_id} (intento {attempt + 1}): {error_str}")
+
+    # Detectar errores 429 (rate limit): reducir la concurrencia compartida y esperar con jitter
+    if es_error_rate_limit(error_str):
+        limiter.on_rate_limited()
+        if attempt < max_retries - 1:
+            wait_time = limiter.backoff_delay(attempt, extraer_retry_after(error))
+            logger.warning(f"⏱️ Error 429 para usuario {user_id}, esperando {wait_time:.1f}s antes de reintentar...")
+            return wait_time, None
+        return None, MSG_SATURADO_REINTENTOS
+
+    # Timeout del intento: reintentar de inmediato (la cobertura ya cubrió la cola de latencia)
+    if isinstance(error, TimeoutError):
+        if attempt < max_retries - 1:
+            logger.warning(f"⏱️ Timeout del intento para usuario {user_id}, reintentando...")
+            return 0, None
+        return None, MSG_SATURADO_REINTENTOS
+
+    # Detectar errores de tamaño de payload
+    if _es_error_payload(error_str):
+        return None, MSG_PAYLOAD
+
+    # Para otros errores, no reintentar
+    return None, MSG_ERROR
+
+def _retraso_cobertura(latencias: LatencyTracker, attempt_timeout: float) -> Optional[float]:
+    """Segundos tras los que lanzar un duplicado (p95 observado) o None si no aplica"""
+    if not config.LLM_HEDGING_ENABLED:
+        return None
+    p95 = latencias.percentile(0.95)
+    if p95 is None:
+        return None
+    retraso = max(config.LLM_HEDGE_MIN_DELAY, p95)
+    return retraso if retraso < attempt_timeout else None
 
 class LLMPool:
-    def __init__(self, pool_size: int = 5, max_retries: int = 3):
-        self.pool_size = pool_size
+    """Pool elástico de instancias LLM.
+
+    No crea nada al importarse: en el primer uso calienta min_size instancias en segundo
+    plano, crea más (hasta pool_size) cuando no hay ninguna libre y destruye las que
+    pasan idle_seconds sin usarse mientras se supere el mínimo.
+    """
+
+    def __init__(self, pool_size: int = 5, max_retries: int = 3, limiter: AdaptiveConcurrencyLimiter = None,
+                 scheduler=None, min_size: int = 1, idle_seconds: float = 300,
+                 breaker: CircuitBreaker = None, latencias: LatencyTracker = None):
+        self.pool_size = pool_size  # Máximo de instancias
+        self.min_size = min(min_size, pool_size)
+        self.idle_seconds = idle_seconds
         self.max_retries = max_retries
-        self.pool = queue.Queue(maxsize=pool_size)
+        self.limiter = limiter or AdaptiveConcurrencyLimiter(initial_limit=pool_size, max_limit=pool_size)
+        self.scheduler = scheduler or crear_scheduler(config.LLM_POOL_SCHEDULER)
+        self.breaker = breaker or CircuitBreaker()
+        self.latencias = latencias or LatencyTracker()
+        self.attempt_timeout = config.LLM_ATTEMPT_TIMEOUT
+        self._executor = None  # Hilos para intentos con timeout y cobertura (hedging)
+        self.coberturas = 0
+        self.coberturas_ganadas = 0
+        self.timeouts = 0
+        self.max_huerfanos = config.LLM_MAX_ORPHAN_ATTEMPTS
+        self.huerfanos = 0  # Intentos abandonados que siguen corriendo en el executor
+        self.intentos_en_vuelo = {}  # id(llm) -> intentos del executor que aún usan la instancia
+        self.devolucion_diferida = {}  # id(llm) -> instancia liberada con intentos aún en vuelo
+        self.pool = deque()  # Instancias libres (la más reciente a la derecha)
         self.pool_lock = threading.Lock()
         self.active_connections = {}  # user_id -> (llm_instance, timestamp)
+        self.en_uso = {}  # id(llm) -> instante en que se asignó
+        self.libre_desde = {}  # id(llm) -> instante en que quedó libre
+        self.creadas = 0  # Instancias existentes (o en construcción)
+        self.iniciado = False
         self.connection_timeout = 120  # 2 minutos (reducido)
         self.use_session_persistence = False  # Deshabilitar persistencia para mejor concurrencia
-        
-        # Inicializar pool de LLMs
-        self._initialize_pool()
-        
+        self.cleanup_thread = None
+
+    def _iniciar(self):
+        """Primer uso: lanzar el calentamiento y el hilo de limpieza (llamar con el lock tomado)"""
+        if self.iniciado:
+            return
+        self.iniciado = True
+        logger.info(f"Inicializando pool elástico de LLMs (mínimo {self.min_size}, máximo {self.pool_size})...")
+        threading.Thread(target=self._calentar, daemon=True).start()
+
         # Thread para limpieza periódica
         self.cleanup_thread = threading.Thread(target=self._cleanup_connections, daemon=True)
         self.cleanup_thread.start()
-        
-    def _initialize_pool(self):
-        """Inicializar el pool con instancias LLM"""
-        logger.info(f"Inicializando pool de LLMs con {self.pool_size} instancias...")
-        
-        for i in range(self.pool_size):
+
+    def iniciar(self):
+        """Lanzar el calentamiento durante el arranque, sin esperar a la primera pregunta"""
+        with self.pool_lock:
+            self._iniciar()
+
+    def _crear_instancia(self) -> "ChatGoogleGenerativeAI":
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        llm = ChatGoogleGenerativeAI(
+            model=config.MODEL_NAME,
+            temperature=config.LLM_TEMPERATURE,
+            timeout=config.LLM_ATTEMPT_TIMEOUT,  # El intento abandonado termina y devuelve su permiso e instancia
+        )
+        logger.info(f"LLM creado en pool ({self.creadas}/{self.pool_size})")
+        return llm
+
+    def _calentar(self):
+        """Crear en segundo plano las instancias mínimas"""
+        while True:
+            with self.pool_lock:
+                if self.creadas >= self.min_size:
+                    break
+                self.creadas += 1
             try:
-                llm = ChatGoogleGenerativeAI(
-                    model=config.MODEL_NAME,
-                    temperature=config.LLM_TEMPERATURE,
-                )
-                self.pool.put(llm)
-                logger.info(f"LLM {i+1}/{self.pool_size} inicializado en pool")
+                llm = self._crear_instancia()
             except Exception as e:
-                logger.error(f"Error al inicializar LLM {i+1}: {e}")
-        
-        logger.info(f"Pool de LLMs inicializado con {self.pool.qsize()} instancias disponibles")
+                with self.pool_lock:
+                    self.creadas -= 1
+                logger.error(f"Error al inicializar LLM del pool: {e}")
+                return
+            self._devolver_instancia(llm)
+        logger.info(f"Pool de LLMs caliente con {self.creadas} instancias")
+
+    def _tomar_instancia(self, user_id: str, timeout: float, prioridad: int = 0) -> Optional["ChatGoogleGenerativeAI"]:
+        """Obtener una instancia libre, crear una nueva si hay margen o esperar turno en el scheduler"""
+        deadline = time.time() + timeout
+        crear = False
+        with self.pool_lock:
+            self._iniciar()
+            if self.pool and len(self.scheduler) == 0:
+                llm = self.pool.pop()
+                self.libre_desde.pop(id(llm), None)
+                self.en_uso[id(llm)] = time.time()
+                return llm
+
+            if self.creadas < self.pool_size:
+                # Sin instancias libres pero con margen: crecer
+                self.creadas += 1
+                crear = True
+            else:
+                ticket = Ticket(user_id, prioridad=prioridad, deadline=deadline)
+                espera = self.scheduler.espera_estimada(self.pool_size)
+                if not ticket.puede_terminar(time.time() + espera, self.scheduler.servicio_estimado):
+                    # Con la cola actual no llegaría a tiempo: descartar ya en vez de esperar 45s
+                    self.scheduler.descartar(ticket, f"espera estimada {espera:.1f}s excede el deadline")
+                    return None
+                self.scheduler.encolar(ticket)
+
+        if crear:
+            try:
+                llm = self._crear_instancia()
+            except Exception as e:
+                with self.pool_lock:
+                    self.creadas -= 1
+                logger.error(f"Error al crear LLM para usuario {user_id}: {e}")
+                return None
+            with self.pool_lock:
+                self.en_uso[id(llm)] = time.time()
+            return llm
+
+        ticket.evento.wait(timeout)
+        with self.pool_lock:
+            if ticket.llm is None and not ticket.descartado:
+                self.scheduler.quitar(ticket)
+            llm = ticket.llm
+        if llm is not None:
+            self.scheduler.registrar_espera(ticket)
+        return llm
+
+    def _devolver_instancia(self, llm: "ChatGoogleGenerativeAI"):
+        """Entregar la instancia al siguiente ticket del scheduler o dejarla libre"""
+        with self.pool_lock:
+            if self.intentos_en_vuelo.get(id(llm)):
+                # Un intento abandonado sigue usándola: se devuelve cuando termine (_terminar_intento)
+                self.devolucion_diferida[id(llm)] = llm
+                return
+            inicio = self.en_uso.pop(id(llm), None)
+            if inicio is not None:
+                self.scheduler.registrar_servicio(time.time() - inicio)
+            ticket = self.scheduler.siguiente()
+            if ticket is not None:
+                ticket.llm = llm
+                self.en_uso[id(llm)] = time.time()
+                ticket.evento.set()
+            else:
+                self.pool.append(llm)
+                self.libre_desde[id(llm)] = time.time()
+
+    def _reducir_inactivas(self):
+        """Destruir instancias libres que llevan idle_seconds sin uso, respetando el mínimo"""
+        ahora = time.time()
+        eliminadas = 0
+        with self.pool_lock:
+            # Las menos usadas quedan a la izquierda porque se reutiliza la más reciente
+            while self.pool and self.creadas > self.min_size:
+                llm = self.pool[0]
+                if ahora - self.libre_desde.get(id(llm), ahora) < self.idle_seconds:
+                    break
+                self.pool.popleft()
+                self.libre_desde.pop(id(llm), None)
+                self.creadas -= 1
+                eliminadas += 1
+        if eliminadas:
+            logger.info(f"🧹 Pool reducido en {eliminadas} instancias inactivas. Total: {self.creadas}")
     
-    def get_llm(self, user_id: str, timeout: float = 45.0) -> Optional[ChatGoogleGenerativeAI]:
+    def get_llm(self, user_id: str, timeout: float = 45.0, prioridad: int = 0) -> Optional["ChatGoogleGenerativeAI"]:
         """Obtener una instancia LLM del pool para un usuario"""
         start_time = time.time()
         
         # Si la persistencia está deshabilitada, siempre obtener del pool
         if not self.use_session_persistence:
-            try:
-                logger.info(f"🔄 Usuario {user_id} solicitando LLM del pool. Disponibles: {self.pool.qsize()}")
-                llm = self.pool.get(timeout=timeout)
-                
-                elapsed = time.time() - start_time
-                logger.info(f"✅ LLM asignado a usuario {user_id} en {elapsed:.2f}s. Pool restante: {self.pool.qsize()}")
-                return llm
-                
-            except queue.Empty:
-                elapsed = time.time() - start_time
+            logger.info(f"🔄 Usuario {user_id} solicitando LLM del pool. Disponibles: {len(self.pool)}")
+            llm = self._tomar_instancia(user_id, timeout, prioridad)
+            
+            elapsed = time.time() - start_time
+            if llm is None:
                 logger.warning(f"⏱️ Timeout obteniendo LLM para usuario {user_id} después de {elapsed:.2f}s")
                 return None
+            logger.info(f"✅ LLM asignado a usuario {user_id} en {elapsed:.2f}s. Pool restante: {len(self.pool)}")
+            return llm
         
         # Código legacy para persistencia (si se habilita)
         # Verificar si el usuario ya tiene una conexión activa
         with self.pool_lock:
+            expirado = None
             if user_id in self.active_connections:
                 llm, timestamp = self.active_connections[user_id]
                 # Verificar si la conexión no ha expirado
@@ -74,119 +259,501 @@ class LLMPool:
                 else:
                     # Conexión expirada, remover
                     del self.active_connections[user_id]
-                    self.pool.put(llm)
-                    logger.info(f"Conexión LLM expirada para usuario {user_id}, devolviendo al pool")
+                    expirado = llm
+        if expirado is not None:
+            self._devolver_instancia(expirado)
+            logger.info(f"Conexión LLM expirada para usuario {user_id}, devolviendo al pool")
         
         # Intentar obtener una nueva instancia del pool
-        try:
-            logger.info(f"🔄 Usuario {user_id} solicitando LLM del pool. Disponibles: {self.pool.qsize()}")
-            llm = self.pool.get(timeout=timeout)
-            
-            # Asignar al usuario
-            with self.pool_lock:
-                self.active_connections[user_id] = (llm, time.time())
-            
-            elapsed = time.time() - start_time
-            logger.info(f"✅ LLM asignado a usuario {user_id} en {elapsed:.2f}s. Pool restante: {self.pool.qsize()}")
-            return llm
-            
-        except queue.Empty:
-            elapsed = time.time() - start_time
+        logger.info(f"🔄 Usuario {user_id} solicitando LLM del pool. Disponibles: {len(self.pool)}")
+        llm = self._tomar_instancia(user_id, timeout, prioridad)
+        
+        elapsed = time.time() - start_time
+        if llm is None:
             logger.warning(f"⏱️ Timeout obteniendo LLM para usuario {user_id} después de {elapsed:.2f}s")
             return None
+        
+        # Asignar al usuario
+        with self.pool_lock:
+            self.active_connections[user_id] = (llm, time.time())
+        
+        logger.info(f"✅ LLM asignado a usuario {user_id} en {elapsed:.2f}s. Pool restante: {len(self.pool)}")
+        return llm
     
-    def release_llm(self, user_id: str, llm_instance: ChatGoogleGenerativeAI = None):
+    def release_llm(self, user_id: str, llm_instance: "ChatGoogleGenerativeAI" = None):
         """Liberar la instancia LLM de un usuario de vuelta al pool"""
         
         # Si no se usa persistencia, liberar directamente la instancia
         if not self.use_session_persistence and llm_instance:
-            try:
-                self.pool.put_nowait(llm_instance)
-                logger.info(f"🔄 LLM liberado de usuario {user_id} y devuelto al pool. Disponibles: {self.pool.qsize()}")
-                return
-            except queue.Full:
-                logger.warning(f"Pool lleno, no se pudo devolver LLM de usuario {user_id}")
-                return
+            self._devolver_instancia(llm_instance)
+            logger.info(f"🔄 LLM liberado de usuario {user_id} y devuelto al pool. Disponibles: {len(self.pool)}")
+            return
         
         # Código legacy para persistencia
         with self.pool_lock:
+            llm = None
             if user_id in self.active_connections:
                 llm, _ = self.active_connections[user_id]
                 del self.active_connections[user_id]
-                
-                # Devolver al pool si hay espacio
-                try:
-                    self.pool.put_nowait(llm)
-                    logger.info(f"🔄 LLM liberado de usuario {user_id} y devuelto al pool. Disponibles: {self.pool.qsize()}")
-                except queue.Full:
-                    logger.warning(f"Pool lleno, no se pudo devolver LLM de usuario {user_id}")
-            else:
-                logger.debug(f"Usuario {user_id} no tenía LLM asignado")
+        if llm is not None:
+            self._devolver_instancia(llm)
+            logger.info(f"🔄 LLM liberado de usuario {user_id} y devuelto al pool. Disponibles: {len(self.pool)}")
+        else:
+            logger.debug(f"Usuario {user_id} no tenía LLM asignado")
     
     def _cleanup_connections(self):
         """Limpiar conexiones expiradas periódicamente"""
         while True:
             time.sleep(60)  # Verificar cada minuto
             current_time = time.time()
-            expired_users = []
+            expirados = []
             
             with self.pool_lock:
-                for user_id, (llm, timestamp) in self.active_connections.items():
+                for user_id, (llm, timestamp) in list(self.active_connections.items()):
                     if current_time - timestamp > self.connection_timeout:
-                        expired_users.append(user_id)
-                
-                # Limpiar conexiones expiradas
-                for user_id in expired_users:
-                    llm, _ = self.active_connections[user_id]
-                    del self.active_connections[user_id]
-                    try:
-                        self.pool.put_nowait(llm)
-                        logger.info(f"🧹 Conexión LLM limpiada para usuario inactivo {user_id}")
-                    except queue.Full:
-                        logger.warning(f"Pool lleno durante limpieza de usuario {user_id}")
+                        del self.active_connections[user_id]
+                        expirados.append((user_id, llm))
+            
+            # Limpiar conexiones expiradas
+            for user_id, llm in expirados:
+                self._devolver_instancia(llm)
+                logger.info(f"🧹 Conexión LLM limpiada para usuario inactivo {user_id}")
+            
+            self._reducir_inactivas()
     
     def get_stats(self) -> dict:
         """Obtener estadísticas del pool"""
         with self.pool_lock:
             return {
                 'pool_size': self.pool_size,
-                'available': self.pool.qsize(),
+                'min_size': self.min_size,
+                'created': self.creadas,
+                'available': len(self.pool),
+                'capacity': self.pool_size - len(self.en_uso),
                 'active_connections': len(self.active_connections),
-                'active_users': list(self.active_connections.keys())
+                'active_users': list(self.active_connections.keys()),
+                'limiter': self.limiter.get_stats(),
+                'scheduler': self.scheduler.get_stats(),
+                'breaker': self.breaker.get_stats(),
+                'latencias': self.latencias.get_stats(),
+                'hedging': {'lanzadas': self.coberturas, 'ganadas': self.coberturas_ganadas, 'timeouts': self.timeouts,
+                            'huerfanos': self.huerfanos}
             }
+
+    def circuito_abierto(self) -> bool:
+        """True si Gemini está fallando y conviene responder saturación sin hacer cola"""
+        return self.breaker.esta_abierto()
+
+    def _registrar_resultado(self, permiso: PermisoCircuito, error: Exception = None):
+        """Alimentar el circuit breaker (los errores de payload son del cliente, no cuentan)"""
+        if error is None:
+            self.breaker.registrar_exito(permiso)
+        elif not _es_error_payload(str(error)):
+            self.breaker.registrar_fallo(permiso)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        with self.pool_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.pool_size * 2, thread_name_prefix="llm-intento")
+            return self._executor
+
+    def _lanzar_intento(self, llm: "ChatGoogleGenerativeAI", prompt: str):
+        """Ejecutar llm.invoke en el executor; el permiso del limitador se libera al terminar"""
+        inicio = time.monotonic()
+        with self.pool_lock:
+            self.intentos_en_vuelo[id(llm)] = self.intentos_en_vuelo.get(id(llm), 0) + 1
+
+        def al_terminar(futuro):
+            self.limiter.release()
+            if not futuro.cancelled() and futuro.exception() is None:
+                self.latencias.record(time.monotonic() - inicio)
+            self._terminar_intento(llm)
+
+        try:
+            futuro = self._get_executor().submit(llm.invoke, prompt)
+        except Exception:
+            self.limiter.release()
+            self._terminar_intento(llm)
+            raise
+        futuro.add_done_callback(al_terminar)
+        return futuro
+
+    def _terminar_intento(self, llm: "ChatGoogleGenerativeAI"):
+        """Descontar un intento de la instancia y completar su devolución al pool si estaba diferida"""
+        with self.pool_lock:
+            restantes = self.intentos_en_vuelo.pop(id(llm), 1) - 1
+            if restantes > 0:
+                self.intentos_en_vuelo[id(llm)] = restantes
+                return
+            diferida = self.devolucion_diferida.pop(id(llm), None)
+        if diferida is not None:
+            self._devolver_instancia(diferida)
+
+    def _abandonar_intentos(self, futuros):
+        """Cancelar los intentos que aún no arrancaron; los que ya corren quedan huérfanos hasta terminar"""
+        for futuro in futuros:
+            if futuro.done() or futuro.cancel():
+                continue
+            with self.pool_lock:
+                self.huerfanos += 1
+            futuro.add_done_callback(self._terminar_huerfano)
+
+    def _terminar_huerfano(self, futuro):
+        with self.pool_lock:
+            self.huerfanos -= 1
+
+    def _demasiados_huerfanos(self) -> bool:
+        with self.pool_lock:
+            return self.huerfanos >= self.max_huerfanos
+
+    def _invocar_con_cobertura(self, llm: "ChatGoogleGenerativeAI", prompt: str, user_id: str) -> str:
+        """Un intento con timeout. Si supera el p95 observado se lanza un duplicado y gana el primero.
+
+        Los intentos perdedores o vencidos que ya corren no se pueden cancelar: quedan huérfanos,
+        conservan su permiso del limitador y retienen la instancia hasta terminar (ver _terminar_intento).
+        """
+        limite = time.monotonic() + self.attempt_timeout
+        primario = self._lanzar_intento(llm, prompt)
+        pendientes = {primario}
+        completados = set()
+        try:
+            retraso = _retraso_cobertura(self.latencias, self.attempt_timeout)
+            if retraso is not None:
+                completados, pendientes = wait(pendientes, timeout=retraso)
+                if not completados and not self._demasiados_huerfanos() and self.limiter.try_acquire():
+                    logger.info(f"🪂 Intento para usuario {user_id} supera el p95 ({retraso:.1f}s): lanzando cobertura")
+                    self.coberturas += 1
+                    pendientes.add(self._lanzar_intento(llm, prompt))
+
+            error = None
+            while True:
+                for futuro in completados:
+                    if futuro.exception() is None:
+                        if futuro is not primario:
+                            self.coberturas_ganadas += 1
+                        return futuro.result().content
+                    error = futuro.exception()
+                if not pendientes:
+                    raise error
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                completados, pendientes = wait(pendientes, timeout=restante, return_when=FIRST_COMPLETED)
+                if not completados:
+                    break
+
+            self.timeouts += 1
+            raise TimeoutError(f"El LLM no respondió en {self.attempt_timeout:.0f}s")
+        finally:
+            self._abandonar_intentos(pendientes)
     
-    def invoke_with_retry(self, llm: ChatGoogleGenerativeAI, prompt: str, user_id: str) -> str:
-        """Invocar LLM con reintentos y manejo de errores específicos"""
-        for attempt in range(self.max_retries):
+    def invoke_with_retry(self, llm: "ChatGoogleGenerativeAI", prompt: str, user_id: str) -> str:
+        """Invocar LLM con reintentos, limitador AIMD, timeout por intento, cobertura y circuit breaker"""
+        permiso = self.breaker.permitir()
+        if permiso is None:
+            logger.warning(f"🔌 Circuito abierto: respondiendo saturación a usuario {user_id} sin llamar al LLM")
+            return MSG_SATURADO
+
+        # Toda salida sin éxito ni fallo registrado (saturación, payload) debe soltar la llamada de prueba
+        try:
+            for attempt in range(self.max_retries):
+                if self._demasiados_huerfanos():
+                    logger.warning(f"🪂 {self.huerfanos} intentos abandonados siguen en curso: respondiendo saturación a usuario {user_id}")
+                    return MSG_SATURADO
+                if not self.limiter.acquire(timeout=45.0):
+                    logger.warning(f"⏱️ Limitador de cuota sin capacidad para usuario {user_id}")
+                    return MSG_SATURADO
+
+                try:
+                    logger.debug(f"🚀 Invocando LLM para usuario {user_id} (intento {attempt + 1}/{self.max_retries})")
+                    content = self._invocar_con_cobertura(llm, prompt, user_id)
+                    self.limiter.on_success()
+                    self._registrar_resultado(permiso)
+                    logger.info(f"✅ Respuesta LLM exitosa para usuario {user_id}: {content[:50]}...")
+                    return content
+                except Exception as e:
+                    error = e
+
+                self._registrar_resultado(permiso, error)
+                wait_time, mensaje = _resolver_error(error, attempt, self.max_retries, self.limiter, user_id)
+                if mensaje is not None:
+                    return mensaje
+                time.sleep(wait_time)
+
+            return MSG_REINTENTOS
+        finally:
+            self.breaker.liberar_prueba(permiso)
+
+    def stream_with_retry(self, llm: "ChatGoogleGenerativeAI", prompt: str, user_id: str):
+        """Igual que invoke_with_retry pero generando fragmentos de texto con llm.stream.
+
+        Solo se reintenta mientras no se haya emitido ningún fragmento. No aplica cobertura:
+        duplicar un stream ya iniciado no reduce el tiempo hasta el primer token.
+        """
+        permiso = self.breaker.permitir()
+        if permiso is None:
+            logger.warning(f"🔌 Circuito abierto: respondiendo saturación a usuario {user_id} sin llamar al LLM")
+            yield MSG_SATURADO
+            return
+
+        # También cubre el stream cerrado por el consumidor a mitad de camino (GeneratorExit)
+        try:
+            for attempt in range(self.max_retries):
+                if not self.limiter.acquire(timeout=45.0):
+                    logger.warning(f"⏱️ Limitador de cuota sin capacidad para usuario {user_id}")
+                    yield MSG_SATURADO
+                    return
+
+                error = None
+                emitido = False
+                try:
+                    logger.debug(f"🚀 Streaming LLM para usuario {user_id} (intento {attempt + 1}/{self.max_retries})")
+                    for chunk in llm.stream(prompt):
+                        if chunk.content:
+                            emitido = True
+                            yield chunk.content
+                    self.limiter.on_success()
+                    self._registrar_resultado(permiso)
+                    logger.info(f"✅ Streaming LLM completado para usuario {user_id}")
+                    return
+                except Exception as e:
+                    error = e
+                finally:
+                    self.limiter.release()
+
+                self._registrar_resultado(permiso, error)
+                if emitido:
+                    logger.error(f"❌ Streaming interrumpido para usuario {user_id}: {error}")
+                    yield "\n\n" + MSG_ERROR
+                    return
+
+                wait_time, mensaje = _resolver_error(error, attempt, self.max_retries, self.limiter, user_id)
+                if mensaje is not None:
+                    yield mensaje
+                    return
+                time.sleep(wait_time)
+
+            yield MSG_REINTENTOS
+        finally:
+            self.breaker.liberar_prueba(permiso)
+
+class AsyncLLMPool:
+    """Pool asíncrono: un único cliente compartido y un semáforo que limita las llamadas en vuelo.
+
+    Cada petición en espera es una corrutina, no un hilo bloqueado en get_llm.
+    """
+
+    def __init__(self, max_concurrency: int = 15, max_retries: int = 3, limiter: AdaptiveConcurrencyLimiter = None,
+                 breaker: CircuitBreaker = None, latencias: LatencyTracker = None):
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.limiter = limiter or AdaptiveConcurrencyLimiter(initial_limit=max_concurrency, max_limit=max_concurrency)
+        self.breaker = breaker or CircuitBreaker()
+        self.latencias = latencias or LatencyTracker()
+        self.attempt_timeout = config.LLM_ATTEMPT_TIMEOUT
+        self.coberturas = 0
+        self.coberturas_ganadas = 0
+        self.timeouts = 0
+        self._llm = None
+        self._llm_lock = threading.Lock()
+        self._semaphore = None
+        self._loop = None
+        self.in_flight = 0
+        self.waiting = 0
+        self.total_calls = 0
+
+    def _get_llm(self) -> "ChatGoogleGenerativeAI":
+        """Crear el cliente compartido la primera vez que se necesita"""
+        if self._llm is None:
+            with self._llm_lock:
+                if self._llm is None:
+                    from langchain_google_genai import ChatGoogleGenerativeAI
+                    self._llm = ChatGoogleGenerativeAI(
+                        model=config.MODEL_NAME,
+                        temperature=config.LLM_TEMPERATURE,
+                        timeout=config.LLM_ATTEMPT_TIMEOUT,
+                    )
+                    logger.info("Cliente LLM compartido inicializado para el pool asíncrono")
+        return self._llm
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """El semáforo pertenece al event loop actual; se recrea si cambia el loop"""
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._loop = loop
+        return self._semaphore
+
+    def get_stats(self) -> dict:
+        """Obtener estadísticas del pool asíncrono"""
+        return {
+            'max_concurrency': self.max_concurrency,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'total_calls': self.total_calls,
+            'limiter': self.limiter.get_stats(),
+            'breaker': self.breaker.get_stats(),
+            'latencias': self.latencias.get_stats(),
+            'hedging': {'lanzadas': self.coberturas, 'ganadas': self.coberturas_ganadas, 'timeouts': self.timeouts},
+        }
+
+    async def _intento(self, llm: "ChatGoogleGenerativeAI", prompt: str):
+        """Un ainvoke que libera su permiso del limitador al terminar o al cancelarse"""
+        inicio = time.monotonic()
+        try:
+            response = await llm.ainvoke(prompt)
+            self.latencias.record(time.monotonic() - inicio)
+            return response
+        finally:
+            self.limiter.release()
+
+    async def _ainvocar_con_cobertura(self, llm: "ChatGoogleGenerativeAI", prompt: str, user_id: str) -> str:
+        """Un intento con timeout; pasado el p95 se lanza un duplicado y se cancela el que pierda"""
+        limite = time.monotonic() + self.attempt_timeout
+        primario = asyncio.ensure_future(self._intento(llm, prompt))
+        tareas = [primario]
+        pendientes = {primario}
+        completados = set()
+        try:
+            retraso = _retraso_cobertura(self.latencias, self.attempt_timeout)
+            if retraso is not None:
+                completados, pendientes = await asyncio.wait(pendientes, timeout=retraso)
+                if not completados and self.limiter.try_acquire():
+                    logger.info(f"🪂 Intento para usuario {user_id} supera el p95 ({retraso:.1f}s): lanzando cobertura")
+                    self.coberturas += 1
+                    cobertura = asyncio.ensure_future(self._intento(llm, prompt))
+                    tareas.append(cobertura)
+                    pendientes.add(cobertura)
+
+            error = None
+            while True:
+                for tarea in completados:
+                    if tarea.exception() is None:
+                        if tarea is not primario:
+                            self.coberturas_ganadas += 1
+                        return tarea.result().content
+                    error = tarea.exception()
+                if not pendientes:
+                    raise error
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                completados, pendientes = await asyncio.wait(pendientes, timeout=restante, return_when=asyncio.FIRST_COMPLETED)
+                if not completados:
+                    break
+
+            self.timeouts += 1
+            raise TimeoutError(f"El LLM no respondió en {self.attempt_timeout:.0f}s")
+        finally:
+            for tarea in tareas:
+                if not tarea.done():
+                    tarea.cancel()
+
+    async def ainvoke_with_retry(self, prompt: str, user_id: str, timeout: float = 45.0) -> str:
+        """Invocar el LLM con ainvoke respetando el límite de concurrencia"""
+        permiso = self.breaker.permitir()
+        if permiso is None:
+            logger.warning(f"🔌 Circuito abierto: respondiendo saturación a usuario {user_id} sin llamar al LLM")
+            return MSG_SATURADO
+
+        # Toda salida sin éxito ni fallo registrado (turno, cuota, payload) debe soltar la llamada de prueba
+        try:
+            semaphore = self._get_semaphore()
+            start_time = time.time()
+
+            self.waiting += 1
             try:
-                logger.debug(f"🚀 Invocando LLM para usuario {user_id} (intento {attempt + 1}/{self.max_retries})")
-                response = llm.invoke(prompt)
-                logger.info(f"✅ Respuesta LLM exitosa para usuario {user_id}: {response.content[:50]}...")
-                return response.content
-                
-            except Exception as e:
-                error_str = str(e)
-                logger.error(f"❌ Error LLM para usuario {user_id} (intento {attempt + 1}): {error_str}")
-                
-                # Detectar errores 429 (rate limit)
-                if "429" in error_str or "quota" in error_str.lower() or "ResourceExhausted" in error_str:
-                    if attempt < self.max_retries - 1:
-                        wait_time = (attempt + 1) * 5  # 5, 10, 15 segundos
-                        logger.warning(f"⏱️ Error 429 para usuario {user_id}, esperando {wait_time}s antes de reintentar...")
-                        time.sleep(wait_time)
-                        continue
-                    else:
-                        return "Lo siento, el servicio está temporalmente saturado. Por favor, intenta en unos minutos."
-                
-                # Detectar errores de tamaño de payload
-                elif "400" in error_str and "request payload size" in error_str.lower():
-                    return "Lo siento, tu consulta es demasiado larga. Por favor, intenta con una pregunta más específica."
-                
-                # Para otros errores, no reintentar
-                else:
-                    return f"Lo siento, ocurrió un error inesperado. Por favor, intenta nuevamente."
-        
-        return "Lo siento, no se pudo procesar tu solicitud después de varios intentos."
+                await asyncio.wait_for(semaphore.acquire(), timeout=timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"⏱️ Timeout esperando turno LLM asíncrono para usuario {user_id} después de {time.time() - start_time:.2f}s")
+                return MSG_SATURADO
+            finally:
+                self.waiting -= 1
+
+            self.in_flight += 1
+            self.total_calls += 1
+            logger.info(f"✅ Turno LLM asíncrono asignado a usuario {user_id} en {time.time() - start_time:.2f}s. En vuelo: {self.in_flight}")
+            try:
+                llm = self._get_llm()
+                for attempt in range(self.max_retries):
+                    if not await self.limiter.acquire_async(timeout=timeout):
+                        logger.warning(f"⏱️ Limitador de cuota sin capacidad para usuario {user_id}")
+                        return MSG_SATURADO
 
-# Instancia global del pool
-llm_pool = LLMPool(pool_size=15)  # 15 instancias para manejar mejor la concurrencia 
\ No newline at end of file
+                    try:
+                        logger.debug(f"🚀 Invocando LLM (async) para usuario {user_id} (intento {attempt + 1}/{self.max_retries})")
+                        content = await self._ainvocar_con_cobertura(llm, prompt, user_id)
+                        self.limiter.on_success()
+                        self.breaker.registrar_exito(permiso)
+                        logger.info(f"✅ Respuesta LLM exitosa para usuario {user_id}: {content[:50]}...")
+                        return content
+                    except Exception as e:
+                        error = e
+
+                    if not _es_error_payload(str(error)):
+                        self.breaker.registrar_fallo(permiso)
+                    wait_time, mensaje = _resolver_error(error, attempt, self.max_retries, self.limiter, user_id)
+                    if mensaje is not None:
+                        return mensaje
+                    await asyncio.sleep(wait_time)
+
+                return MSG_REINTENTOS
+            finally:
+                self.in_flight -= 1
+                semaphore.release()
+        finally:
+            self.breaker.liberar_prueba(permiso)
+
+# Limitador AIMD único: ambos pools comparten la misma cuota de Gemini
+llm_rate_limiter = AdaptiveConcurrencyLimiter(
+    initial_limit=config.LLM_AIMD_INITIAL_LIMIT,
+    min_limit=config.LLM_AIMD_MIN_LIMIT,
+    max_limit=config.LLM_AIMD_MAX_LIMIT,
+    decrease_factor=config.LLM_AIMD_DECREASE_FACTOR,
+    decrease_cooldown=config.LLM_AIMD_DECREASE_COOLDOWN,
+    name="gemini"
+)
+
+# Circuit breaker y latencias compartidos: ambos pools hablan con el mismo servicio
+llm_circuit_breaker = CircuitBreaker(
+    failure_threshold=config.LLM_BREAKER_FAILURE_THRESHOLD,
+    window=config.LLM_BREAKER_WINDOW,
+    min_calls=config.LLM_BREAKER_MIN_CALLS,
+    open_seconds=config.LLM_BREAKER_OPEN_SECONDS,
+    nombre="gemini"
+)
+llm_latencias = LatencyTracker()
+
+# Pools globales creados en el primer uso (importar este módulo no crea clientes ni hilos)
+_llm_pool: Optional[LLMPool] = None
+_async_llm_pool: Optional[AsyncLLMPool] = None
+_pools_lock = threading.Lock()
+
+def get_llm_pool() -> LLMPool:
+    global _llm_pool
+    if _llm_pool is None:
+        with _pools_lock:
+            if _llm_pool is None:
+                _llm_pool = LLMPool(
+                    pool_size=config.LLM_POOL_SIZE,
+                    min_size=config.LLM_POOL_MIN_SIZE,
+                    idle_seconds=config.LLM_POOL_IDLE_SECONDS,
+                    limiter=llm_rate_limiter,
+                    breaker=llm_circuit_breaker,
+                    latencias=llm_latencias
+                )  # Las instancias se crean bajo demanda
+    return _llm_pool
+
+def get_async_llm_pool() -> AsyncLLMPool:
+    """Pool asíncrono (ainvoke): el cliente se crea en la primera llamada"""
+    global _async_llm_pool
+    if _async_llm_pool is None:
+        with _pools_lock:
+            if _async_llm_pool is None:
+                _async_llm_pool = AsyncLLMPool(
+                    max_concurrency=config.LLM_ASYNC_MAX_CONCURRENCY,
+                    limiter=llm_rate_limiter,
+                    breaker=llm_circuit_breaker,
+                    latencias=llm_latencias
+                )
+    return _async_llm_pool
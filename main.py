@@ -1,23 +1,59 @@
-import os
 import threading
-import sys
 import config
 from logger_config import logger
-from chatbot import cargar_documentos
-from google_drive import monitoreo_drive
-from slack_app import start_slack_app
 
 if __name__ == "__main__":
+    # Importaciones dentro del guard: los procesos de ingesta (spawn) reimportan este módulo
+    # y no deben levantar el chatbot, Drive ni Slack
+    from readiness import readiness  # Primero: el perfil de arranque mide desde aquí
+
     logger.info("Iniciando Chaski Bot...")
 
-    logger.info("Cargando documentos iniciales...")
-    cargar_documentos()
+    with readiness.etapa("import chatbot"):
+        import chatbot
+        from rag_system import get_rag_system
+        from llm_pool import get_llm_pool
+    with readiness.etapa("import google_drive"):
+        from google_drive import monitoreo_drive
+    with readiness.etapa("import slack_app"):
+        from slack_app import start_slack_app
+
+    def preparar_componente(componente, nombre_etapa, funcion):
+        """Inicializar un componente: listo si termina bien, degradado (sin bloquear a los demás) si falla"""
+        try:
+            with readiness.etapa(nombre_etapa):
+                resultado = funcion()
+        except Exception as e:
+            logger.error(f"Error al preparar {componente}, se atenderá con lo disponible: {e}")
+            readiness.marcar_degradado(componente, e)
+            return None
+        readiness.marcar_listo(componente)
+        return resultado
+
+    def iniciar_rag():
+        # RAGSystem registra sus propios errores de inicialización y queda sin índice: eso también es un fallo
+        if not get_rag_system().is_initialized():
+            raise RuntimeError("sin embeddings o sin índice vectorial")
+
+    def preparar():
+        """Inicializar los subsistemas pesados mientras Slack ya está conectado respondiendo "arrancando" """
+        preparar_componente("rag", "RAG (embeddings + índice)", iniciar_rag)
+        # Snapshot persistido (o prompt base): se responde sin esperar a Drive
+        estado_drive = preparar_componente("conocimiento", "snapshot de conocimiento", chatbot.arrancar_conocimiento)
+        preparar_componente("llm", "pool LLM", lambda: get_llm_pool().iniciar())
+
+        logger.info("Iniciando monitoreo de Google Drive (reconciliación en segundo plano)...")
+        drive_thread = threading.Thread(target=monitoreo_drive, args=(estado_drive,), daemon=True)
+        drive_thread.start()
+
+    def reportar_arranque():
+        readiness.esperar()
+        readiness.reporte(config.STARTUP_PROFILE_PATH)
 
-    logger.info("Iniciando monitoreo de Google Drive...")
-    drive_thread = threading.Thread(target=monitoreo_drive, daemon=True)
-    drive_thread.start()
+    threading.Thread(target=preparar, daemon=True).start()
+    threading.Thread(target=reportar_arranque, daemon=True).start()
 
     logger.info("Iniciando conexión con Slack...")
     start_slack_app()
 
-    logger.info("Chaski Bot detenido.")
\ No newline at end of file
+    logger.info("Chaski Bot detenido.")
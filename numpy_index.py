@@ -0,0 +1,196 @@
+import os
+import pickle
+import threading
+from typing import List, Optional, Sequence
+
+import numpy as np
+from langchain_core.documents import Document
+
+from logger_config import logger
+from bm25_index import cumple_filtro
+
+class NumpyVectorIndex:
+    """Índice vectorial en memoria: matriz contigua de vectores normalizados.
+
+    La búsqueda es un único producto matriz-vector más argpartition para el top-k. Expone
+    el subconjunto de la API de una colección de Chroma que usa RAGSystem (upsert, update,
+    delete, get, count) y similarity_search_by_vector como el vectorstore de langchain.
+    Se persiste como vectores.npy (cargado con mmap) y un sidecar con ids, textos y metadata.
+    """
+
+    ARCHIVO_VECTORES = "vectores.npy"
+    ARCHIVO_METADATOS = "metadatos.pkl"
+
+    def __init__(self, directorio: str, dtype: str = "float32"):
+        self.directorio = directorio
+        self.dtype = np.dtype(dtype)
+        self._matriz: Optional[np.ndarray] = None  # Filas [0, n) ocupadas; capacidad >= n
+        self._ids: List[str] = []
+        self._textos: List[str] = []
+        self._metadatas: List[dict] = []
+        self._fila = {}  # id -> fila
+        self._lock = threading.RLock()
+        os.makedirs(directorio, exist_ok=True)
+        self.cargar()
+
+    def count(self) -> int:
+        return len(self._ids)
+
+    def _asegurar_capacidad(self, dimension: int, necesarias: int):
+        """Crear o ampliar la matriz (duplicando capacidad); materializa la copia mmap si hace falta"""
+        n = len(self._ids)
+        if self._matriz is None or self._matriz.shape[1] != dimension:
+            if self._matriz is not None and n:
+                raise ValueError(f"Dimensión de embedding {dimension} distinta a la del índice {self._matriz.shape[1]}")
+            self._matriz = np.zeros((max(necesarias, 1024), dimension), dtype=self.dtype)
+            return
+        capacidad = max(self._matriz.shape[0], 1)
+        while capacidad < necesarias:
+            capacidad *= 2
+        if capacidad != self._matriz.shape[0] or not self._matriz.flags.writeable:
+            nueva = np.zeros((capacidad, dimension), dtype=self.dtype)
+            nueva[:n] = self._matriz[:n]
+            self._matriz = nueva
+
+    def upsert(self, ids: Sequence[str], embeddings: Sequence[Sequence[float]], documents: Sequence[str], metadatas: Sequence[dict]):
+        vectores = np.asarray(embeddings, dtype=np.float32)
+        normas = np.linalg.norm(vectores, axis=1, keepdims=True)
+        vectores = vectores / np.where(normas == 0, 1.0, normas)
+        with self._lock:
+            self._asegurar_capacidad(vectores.shape[1], len(self._ids) + len(ids))
+            for doc_id, vector, texto, metadata in zip(ids, vectores, documents, metadatas):
+                fila = self._fila.get(doc_id)
+                if fila is None:
+                    fila = len(self._ids)
+                    self._fila[doc_id] = fila
+                    self._ids.append(doc_id)
+                    self._textos.append(texto)
+                    self._metadatas.append(dict(metadata or {}))
+                else:
+                    self._textos[fila] = texto
+                    self._metadatas[fila] = dict(metadata or {})
+                self._matriz[fila] = vector
+
+    def update(self, ids: Sequence[str], metadatas: Sequence[dict]):
+        """Actualizar metadata (se fusiona con la existente, como en Chroma)"""
+        with self._lock:
+            for doc_id, metadata in zip(ids, metadatas):
+                fila = self._fila.get(doc_id)
+                if fila is not None:
+                    self._metadatas[fila] = {**self._metadatas[fila], **metadata}
+
+    def delete(self, ids: Sequence[str]):
+        """Eliminar moviendo la última fila al hueco (O(1) por id)"""
+        with self._lock:
+            if self._matriz is None:
+                return
+            if not self._matriz.flags.writeable:
+                self._asegurar_capacidad(self._matriz.shape[1], len(self._ids))
+            for doc_id in ids:
+                fila = self._fila.pop(doc_id, None)
+                if fila is None:
+                    continue
+                ultima = len(self._ids) - 1
+                if fila != ultima:
+                    self._matriz[fila] = self._matriz[ultima]
+                    self._ids[fila] = self._ids[ultima]
+                    self._textos[fila] = self._textos[ultima]
+                    self._metadatas[fila] = self._metadatas[ultima]
+                    self._fila[self._ids[fila]] = fila
+                self._ids.pop()
+                self._textos.pop()
+                self._metadatas.pop()
+
+    def get(self, include: Sequence[str] = ("metadatas", "documents")) -> dict:
+        with self._lock:
+            datos = {'ids': list(self._ids)}
+            if "metadatas" in include:
+                datos['metadatas'] = [dict(metadata) for metadata in self._metadatas]
+            if "documents" in include:
+                datos['documents'] = list(self._textos)
+            if "embeddings" in include:
+                datos['embeddings'] = np.array(self._matriz[:len(self._ids)], dtype=np.float32)
+            return datos
+
+    def buscar(self, embedding: Sequence[float], k: int = 5, filtro: Optional[dict] = None) -> List[tuple]:
+        """Top-k (fila, similitud coseno) por producto matriz-vector + argpartition"""
+        consulta = np.asarray(embedding, dtype=np.float32)
+        norma = np.linalg.norm(consulta)
+        with self._lock:
+            n = len(self._ids)
+            if n == 0 or norma == 0 or k <= 0:
+                return []
+            similitudes = self._matriz[:n] @ (consulta / norma).astype(self.dtype, copy=False)
+            if filtro:
+                # Las filas que no cumplen el filtro quedan al final del ranking
+                validas = np.fromiter((cumple_filtro(metadata, filtro) for metadata in self._metadatas), dtype=bool, count=n)
+                n = int(validas.sum())
+                if not n:
+                    return []
+                similitudes = np.where(validas, similitudes, -np.inf)
+            k = min(k, n)
+            mejores = np.argpartition(-similitudes, k - 1)[:k] if k < len(similitudes) else np.arange(len(similitudes))
+            mejores = mejores[np.argsort(-similitudes[mejores])]
+            return [(int(fila), float(similitudes[fila])) for fila in mejores]
+
+    def similarity_search_by_vector(self, embedding: Sequence[float], k: int = 4, filter: Optional[dict] = None) -> List[Document]:
+        with self._lock:
+            return [
+                Document(page_content=self._textos[fila], metadata=dict(self._metadatas[fila]), id=self._ids[fila])
+                for fila, _ in self.buscar(embedding, k, filtro=filter)
+            ]
+
+    def guardar(self):
+        """Persistir vectores (.npy) y sidecar de forma atómica"""
+        with self._lock:
+            n = len(self._ids)
+            ruta_vectores = os.path.join(self.directorio, self.ARCHIVO_VECTORES)
+            ruta_metadatos = os.path.join(self.directorio, self.ARCHIVO_METADATOS)
+            try:
+                matriz = self._matriz[:n] if self._matriz is not None else np.zeros((0, 0), dtype=self.dtype)
+                with open(f"{ruta_vectores}.tmp", 'wb') as f:
+                    np.save(f, matriz)
+                with open(f"{ruta_metadatos}.tmp", 'wb') as f:
+                    pickle.dump({'ids': self._ids, 'textos': self._textos, 'metadatas': self._metadatas}, f,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(f"{ruta_vectores}.tmp", ruta_vectores)
+                os.replace(f"{ruta_metadatos}.tmp", ruta_metadatos)
+            except Exception as e:
+                logger.error(f"Error al guardar índice NumPy en {self.directorio}: {e}")
+
+    def eliminar_persistencia(self):
+        """Borrar los archivos persistidos del índice (al retirar una generación blue/green)"""
+        with self._lock:
+            for archivo in (self.ARCHIVO_VECTORES, self.ARCHIVO_METADATOS):
+                ruta = os.path.join(self.directorio, archivo)
+                if os.path.exists(ruta):
+                    os.remove(ruta)
+            try:
+                os.rmdir(self.directorio)  # Solo si quedó vacío
+            except OSError:
+                pass
+
+    def cargar(self) -> bool:
+        ruta_vectores = os.path.join(self.directorio, self.ARCHIVO_VECTORES)
+        ruta_metadatos = os.path.join(self.directorio, self.ARCHIVO_METADATOS)
+        if not (os.path.exists(ruta_vectores) and os.path.exists(ruta_metadatos)):
+            return False
+        try:
+            # mmap: arranque sin copiar los vectores; se materializa en memoria en la primera escritura
+            matriz = np.load(ruta_vectores, mmap_mode='r')
+            with open(ruta_metadatos, 'rb') as f:
+                sidecar = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Índice NumPy en {self.directorio} ilegible, se empezará vacío: {e}")
+            return False
+        if matriz.dtype != self.dtype or len(sidecar['ids']) != matriz.shape[0]:
+            logger.warning(f"Índice NumPy en {self.directorio} inconsistente (dtype o tamaño), se empezará vacío")
+            return False
+        with self._lock:
+            self._matriz = matriz if matriz.size else None
+            self._ids = sidecar['ids']
+            self._textos = sidecar['textos']
+            self._metadatas = sidecar['metadatas']
+            self._fila = {doc_id: fila for fila, doc_id in enumerate(self._ids)}
+        logger.info(f"🧮 Índice NumPy cargado: {len(self._ids)} vectores ({self.dtype})")
+        return True
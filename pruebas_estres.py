@@ -1,6 +1,7 @@
 import os
 import sys
 import time
+import asyncio
 import threading
 import random
 import statistics
@@ -14,11 +15,13 @@ sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 import chatbot
 from logger_config import logger
-from llm_pool import llm_pool
+from llm_pool import get_llm_pool, get_async_llm_pool
 
 class EstressTester:
-    def __init__(self, num_usuarios: int = 18, preguntas_por_usuario: int = 10, duracion_minutos: int = 10):
+    def __init__(self, num_usuarios: int = 18, preguntas_por_usuario: int = 10, duracion_minutos: int = 10, modo_async: bool = False, modo_streaming: bool = False):
         self.num_usuarios = num_usuarios
+        self.modo_async = modo_async
+        self.modo_streaming = modo_streaming
         self.preguntas_por_usuario = preguntas_por_usuario
         self.duracion_minutos = duracion_minutos
         self.intervalo_preguntas = (duracion_minutos * 60) / preguntas_por_usuario  # segundos entre preguntas
@@ -26,6 +29,7 @@ class EstressTester:
         # Métricas
         self.metricas = {
             'tiempos_respuesta': [],
+            'tiempos_primer_token': [],
             'errores': [],
             'respuestas_exitosas': 0,
             'respuestas_fallidas': 0,
@@ -104,7 +108,8 @@ class EstressTester:
         """Capturar estadísticas del pool periódicamente"""
         while not hasattr(self, '_detener_stats'):
             try:
-                stats = llm_pool.get_stats()
+                stats = get_async_llm_pool().get_stats() if self.modo_async else get_llm_pool().get_stats()
+                stats['answer_cache'] = chatbot.answer_cache.get_stats()
                 timestamp = datetime.now().isoformat()
                 
                 with self.metricas_lock:
@@ -118,6 +123,43 @@ class EstressTester:
                 logger.error(f"Error capturando stats del pool: {e}")
                 time.sleep(5)
 
+    def _consumir_streaming(self, pregunta: str, historial: List[Dict], user_id: str, inicio_pregunta: float) -> str:
+        """Consumir la respuesta en streaming registrando el tiempo hasta el primer token"""
+        fragmentos = []
+        for fragmento in chatbot.generar_respuesta_stream(pregunta, historial, user_id):
+            if not fragmentos:
+                with self.metricas_lock:
+                    self.metricas['tiempos_primer_token'].append(time.time() - inicio_pregunta)
+            fragmentos.append(fragmento)
+        return "".join(fragmentos)
+
+    def _procesar_respuesta(self, user_id: str, pregunta: str, respuesta: str, tiempo_respuesta: float, stats_usuario: Dict):
+        """Actualizar historial y métricas tras recibir una respuesta"""
+        # Actualizar historial de forma thread-safe
+        with chatbot.conversaciones_lock:
+            chatbot.conversaciones[user_id].extend([
+                {"role": "user", "content": pregunta},
+                {"role": "assistant", "content": respuesta}
+            ])
+            chatbot.conversaciones[user_id] = chatbot.limitar_historial(chatbot.conversaciones[user_id])
+        
+        # Verificar si la respuesta indica error
+        es_error = any(error_phrase in respuesta.lower() for error_phrase in [
+            "temporalmente saturado", "error inesperado", "varios intentos"
+        ])
+        
+        # Registrar métricas
+        self.registrar_metrica(user_id, tiempo_respuesta, not es_error, 
+                             respuesta if es_error else None)
+        
+        stats_usuario['preguntas_completadas'] += 1
+        stats_usuario['tiempo_total'] += tiempo_respuesta
+        
+        if es_error:
+            stats_usuario['errores'] += 1
+        
+        logger.info(f"✅ {user_id} - Respuesta recibida en {tiempo_respuesta:.2f}s")
+
     def simular_usuario(self, numero_usuario: int) -> Dict:
         """Simular las acciones de un usuario durante la prueba"""
         user_id = self.generar_user_id(numero_usuario)
@@ -150,34 +192,13 @@ class EstressTester:
                     logger.info(f"👤 {user_id} - Pregunta {pregunta_num + 1}/10: {pregunta[:50]}...")
                     
                     # Generar respuesta usando el sistema del chatbot
-                    respuesta = chatbot.generar_respuesta(pregunta, historial_actual, user_id)
+                    if self.modo_streaming:
+                        respuesta = self._consumir_streaming(pregunta, historial_actual, user_id, inicio_pregunta)
+                    else:
+                        respuesta = chatbot.generar_respuesta(pregunta, historial_actual, user_id)
                     
                     tiempo_respuesta = time.time() - inicio_pregunta
-                    
-                    # Actualizar historial de forma thread-safe
-                    with chatbot.conversaciones_lock:
-                        chatbot.conversaciones[user_id].extend([
-                            {"role": "user", "content": pregunta},
-                            {"role": "assistant", "content": respuesta}
-                        ])
-                        chatbot.conversaciones[user_id] = chatbot.limitar_historial(chatbot.conversaciones[user_id])
-                    
-                    # Verificar si la respuesta indica error
-                    es_error = any(error_phrase in respuesta.lower() for error_phrase in [
-                        "temporalmente saturado", "error inesperado", "varios intentos"
-                    ])
-                    
-                    # Registrar métricas
-                    self.registrar_metrica(user_id, tiempo_respuesta, not es_error, 
-                                         respuesta if es_error else None)
-                    
-                    stats_usuario['preguntas_completadas'] += 1
-                    stats_usuario['tiempo_total'] += tiempo_respuesta
-                    
-                    if es_error:
-                        stats_usuario['errores'] += 1
-                    
-                    logger.info(f"✅ {user_id} - Respuesta recibida en {tiempo_respuesta:.2f}s")
+                    self._procesar_respuesta(user_id, pregunta, respuesta, tiempo_respuesta, stats_usuario)
                     
                 except Exception as e:
                     tiempo_respuesta = time.time() - inicio_pregunta
@@ -209,6 +230,95 @@ class EstressTester:
         
         return stats_usuario
 
+    async def simular_usuario_async(self, numero_usuario: int) -> Dict:
+        """Simular un usuario como corrutina sobre chatbot.agenerar_respuesta"""
+        user_id = self.generar_user_id(numero_usuario)
+        stats_usuario = {
+            'user_id': user_id,
+            'preguntas_completadas': 0,
+            'tiempo_total': 0,
+            'errores': 0,
+            'inicio': datetime.now()
+        }
+        
+        logger.info(f"🚀 Iniciando simulación asíncrona para usuario {user_id}")
+        
+        with chatbot.conversaciones_lock:
+            chatbot.conversaciones[user_id] = []
+        
+        try:
+            for pregunta_num in range(self.preguntas_por_usuario):
+                inicio_pregunta = time.time()
+                
+                try:
+                    pregunta = self.obtener_pregunta_aleatoria()
+                    
+                    with chatbot.conversaciones_lock:
+                        historial_actual = chatbot.conversaciones[user_id].copy()
+                    
+                    logger.info(f"👤 {user_id} - Pregunta {pregunta_num + 1}/{self.preguntas_por_usuario}: {pregunta[:50]}...")
+                    
+                    respuesta = await chatbot.agenerar_respuesta(pregunta, historial_actual, user_id)
+                    
+                    tiempo_respuesta = time.time() - inicio_pregunta
+                    self._procesar_respuesta(user_id, pregunta, respuesta, tiempo_respuesta, stats_usuario)
+                    
+                except Exception as e:
+                    tiempo_respuesta = time.time() - inicio_pregunta
+                    error_msg = str(e)
+                    
+                    logger.error(f"❌ {user_id} - Error en pregunta {pregunta_num + 1}: {error_msg}")
+                    
+                    self.registrar_metrica(user_id, tiempo_respuesta, False, error_msg)
+                    stats_usuario['errores'] += 1
+                
+                if pregunta_num < self.preguntas_por_usuario - 1:
+                    variacion = random.uniform(0.8, 1.2)
+                    await asyncio.sleep(self.intervalo_preguntas * variacion)
+        
+        finally:
+            chatbot.limpiar_memoria_usuario(user_id)
+        
+        stats_usuario['fin'] = datetime.now()
+        stats_usuario['duracion_total'] = (stats_usuario['fin'] - stats_usuario['inicio']).total_seconds()
+        
+        logger.info(f"🏁 Usuario {user_id} completado: {stats_usuario['preguntas_completadas']}/{self.preguntas_por_usuario} preguntas, {stats_usuario['errores']} errores")
+        
+        return stats_usuario
+
+    async def ejecutar_prueba_async(self) -> Dict:
+        """Ejecutar la prueba de estrés con usuarios como corrutinas (pool asíncrono)"""
+        logger.info("🧪 INICIANDO PRUEBA DE ESTRÉS (ASYNC)")
+        logger.info(f"📊 Configuración: {self.num_usuarios} usuarios, {self.preguntas_por_usuario} preguntas c/u, {self.duracion_minutos} minutos")
+        
+        self._verificar_sistema()
+        
+        self.metricas['inicio_prueba'] = datetime.now()
+        
+        stats_thread = threading.Thread(target=self.capturar_stats_pool, daemon=True)
+        stats_thread.start()
+        
+        resultados_usuarios = []
+        try:
+            resultados = await asyncio.gather(
+                *(self.simular_usuario_async(i) for i in range(1, self.num_usuarios + 1)),
+                return_exceptions=True
+            )
+            for usuario_num, resultado in enumerate(resultados, start=1):
+                if isinstance(resultado, Exception):
+                    logger.error(f"❌ Usuario {usuario_num} falló: {resultado}")
+                else:
+                    resultados_usuarios.append(resultado)
+        finally:
+            self._detener_stats = True
+        
+        self.metricas['fin_prueba'] = datetime.now()
+        
+        reporte = self._generar_reporte(resultados_usuarios)
+        
+        logger.info("🎉 PRUEBA DE ESTRÉS (ASYNC) COMPLETADA")
+        return reporte
+
     def ejecutar_prueba(self) -> Dict:
         """Ejecutar la prueba de estrés completa"""
         logger.info("🧪 INICIANDO PRUEBA DE ESTRÉS")
@@ -264,14 +374,18 @@ class EstressTester:
         logger.info("🔍 Verificando sistema...")
         
         # Verificar pool de LLMs
-        stats = llm_pool.get_stats()
-        logger.info(f"📊 Pool LLM: {stats['available']}/{stats['pool_size']} disponibles")
-        
-        if stats['available'] == 0:
-            raise Exception("No hay LLMs disponibles en el pool")
+        if self.modo_async:
+            stats = get_async_llm_pool().get_stats()
+            logger.info(f"📊 Pool LLM asíncrono: concurrencia máxima {stats['max_concurrency']}")
+        else:
+            stats = get_llm_pool().get_stats()
+            logger.info(f"📊 Pool LLM: {stats['created']} creadas, capacidad libre {stats['capacity']}/{stats['pool_size']}")
+            
+            if stats['capacity'] == 0:
+                raise Exception("No hay LLMs disponibles en el pool")
         
         # Verificar que los documentos estén cargados
-        if not chatbot.system_prompt:
+        if not chatbot.snapshot_actual().system_prompt:
             logger.warning("⚠️ System prompt vacío, cargando documentos...")
             chatbot.cargar_documentos()
         
@@ -311,6 +425,14 @@ class EstressTester:
                 'throughput_preguntas_por_segundo': len(tiempos) / duracion_total if duracion_total > 0 else 0
             }
         
+        if self.metricas['tiempos_primer_token']:
+            ttft = self.metricas['tiempos_primer_token']
+            reporte['rendimiento'].update({
+                'primer_token_promedio': statistics.mean(ttft),
+                'primer_token_mediana': statistics.median(ttft),
+                'primer_token_max': max(ttft),
+            })
+        
         return reporte
 
 def imprimir_reporte(reporte: Dict):
@@ -338,6 +460,10 @@ def imprimir_reporte(reporte: Dict):
         print(f"   📊 Tiempo máximo: {perf['tiempo_respuesta_max']:.2f}s")
         print(f"   📊 Desviación estándar: {perf['tiempo_respuesta_std']:.2f}s")
         print(f"   🚀 Throughput: {perf['throughput_preguntas_por_segundo']:.2f} preguntas/segundo")
+        if 'primer_token_mediana' in perf:
+            print(f"   ⚡ Primer token promedio: {perf['primer_token_promedio']:.2f}s")
+            print(f"   ⚡ Primer token mediana: {perf['primer_token_mediana']:.2f}s")
+            print(f"   ⚡ Primer token máximo: {perf['primer_token_max']:.2f}s")
     
     if reporte['errores']:
         print(f"\n❌ ERRORES ({len(reporte['errores'])}):")
@@ -355,14 +481,20 @@ def main():
     
     try:
         # Configuración de la prueba
+        modo_async = "--async" in sys.argv
         tester = EstressTester(
             num_usuarios=18,
             preguntas_por_usuario=10,
-            duracion_minutos=10
+            duracion_minutos=10,
+            modo_async=modo_async,
+            modo_streaming="--stream" in sys.argv
         )
         
         # Ejecutar prueba
-        reporte = tester.ejecutar_prueba()
+        if modo_async:
+            reporte = asyncio.run(tester.ejecutar_prueba_async())
+        else:
+            reporte = tester.ejecutar_prueba()
         
         # Mostrar resultados
         imprimir_reporte(reporte)
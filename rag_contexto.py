@@ -0,0 +1,105 @@
+from typing import List
+
+from langchain_core.documents import Document
+
+from bm25_index import tokenizar
+from document_parser import CHUNK_OVERLAP
+from logger_config import logger
+
+_MIN_SOLAPE = 20  # Coincidencias más cortas que esto no se consideran overlap del splitter
+_CASI_DUPLICADO = 0.9  # Similitud a partir de la cual un candidato se descarta sin puntuarlo
+
+def _archivo(doc: Document):
+    return doc.metadata.get('source_path') or doc.metadata.get('source_file')
+
+def _contiguos(a: Document, b: Document) -> bool:
+    """Chunks consecutivos del mismo archivo (su redundancia se elimina al unirlos, no con MMR)"""
+    chunk_a, chunk_b = a.metadata.get('chunk_id'), b.metadata.get('chunk_id')
+    return (_archivo(a) == _archivo(b) and isinstance(chunk_a, int) and isinstance(chunk_b, int)
+            and abs(chunk_a - chunk_b) == 1)
+
+def _similitud(tokens_a: set, tokens_b: set) -> float:
+    """Jaccard entre los conjuntos de tokens de dos chunks"""
+    if not tokens_a or not tokens_b:
+        return 0.0
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b)
+
+def mmr(docs: List[Document], k: int, lambda_mult: float = 0.7) -> List[Document]:
+    """Maximal marginal relevance sobre un ranking ya fusionado.
+
+    La relevancia sale de la posición en el ranking (vectorial + BM25) y la redundancia de
+    la similitud léxica con lo ya elegido, así se descartan casi-duplicados (el mismo texto
+    en dos archivos, secciones repetidas) sin volver a pedir embeddings.
+    """
+    if len(docs) <= 1:
+        return list(docs)
+
+    tokens = [set(tokenizar(doc.page_content)) for doc in docs]
+    relevancia = [1 - posicion / len(docs) for posicion in range(len(docs))]
+    elegidos = [0]
+    restantes = list(range(1, len(docs)))
+    while restantes and len(elegidos) < k:
+        redundancia = {
+            i: max(0.0 if _contiguos(docs[i], docs[j]) else _similitud(tokens[i], tokens[j]) for j in elegidos)
+            for i in restantes
+        }
+        # El mismo texto en otro archivo no aporta nada, por alta que sea su relevancia
+        restantes = [i for i in restantes if redundancia[i] < _CASI_DUPLICADO]
+        if not restantes:
+            break
+        mejor = max(restantes, key=lambda i: lambda_mult * relevancia[i] - (1 - lambda_mult) * redundancia[i])
+        elegidos.append(mejor)
+        restantes.remove(mejor)
+
+    if len(elegidos) < len(docs):
+        descartados = [docs[i].metadata.get('source_file', 'desconocida') for i in range(len(docs)) if i not in elegidos]
+        logger.info(f"🧭 MMR: {len(elegidos)} de {len(docs)} candidatos (descartados: {descartados})")
+    return [docs[i] for i in elegidos]
+
+def _solape(anterior: str, siguiente: str) -> int:
+    """Longitud del overlap del splitter: el sufijo más largo de anterior que es prefijo de siguiente"""
+    maximo = min(len(anterior), len(siguiente), CHUNK_OVERLAP * 2)
+    if maximo < _MIN_SOLAPE:
+        return 0
+    cola = anterior[-maximo:]
+    semilla = siguiente[:_MIN_SOLAPE]
+    inicio = cola.find(semilla)
+    while inicio != -1:
+        # La primera aparición que llega hasta el final de la cola es el solape más largo
+        if siguiente.startswith(cola[inicio:]):
+            return len(cola) - inicio
+        inicio = cola.find(semilla, inicio + 1)
+    return 0
+
+def unir_contiguos(docs: List[Document]) -> List[Document]:
+    """Unir chunks con chunk_id consecutivo del mismo archivo en un solo tramo sin el texto repetido.
+
+    El tramo ocupa la posición del mejor de sus chunks; el orden por relevancia se conserva.
+    """
+    por_archivo = {}
+    for posicion, doc in enumerate(docs):
+        por_archivo.setdefault(_archivo(doc), []).append((posicion, doc))
+
+    tramos = []  # (mejor posición, Document)
+    ahorrado = 0
+    for grupo in por_archivo.values():
+        grupo.sort(key=lambda item: (not isinstance(item[1].metadata.get('chunk_id'), int), item[1].metadata.get('chunk_id') or 0))
+        posicion, actual = grupo[0]
+        texto, metadata = actual.page_content, dict(actual.metadata)
+        for siguiente_posicion, siguiente in grupo[1:]:
+            if _contiguos(actual, siguiente):
+                solape = _solape(texto, siguiente.page_content)
+                ahorrado += solape
+                texto += ("" if solape else "\n\n") + siguiente.page_content[solape:]
+                posicion = min(posicion, siguiente_posicion)
+                metadata['chunk_id_final'] = siguiente.metadata.get('chunk_id')
+            else:
+                tramos.append((posicion, Document(page_content=texto, metadata=metadata)))
+                posicion, texto, metadata = siguiente_posicion, siguiente.page_content, dict(siguiente.metadata)
+            actual = siguiente
+        tramos.append((posicion, Document(page_content=texto, metadata=metadata)))
+
+    tramos.sort(key=lambda item: item[0])
+    if len(tramos) < len(docs):
+        logger.info(f"🧵 {len(docs)} chunks unidos en {len(tramos)} tramos ({ahorrado} caracteres de overlap eliminados)")
+    return [doc for _, doc in tramos]
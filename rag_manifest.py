@@ -0,0 +1,121 @@
+import time
+import sqlite3
+import threading
+from typing import Dict, Iterable, Optional, Sequence, Tuple
+
+class RAGManifest:
+    """Manifiesto persistente del índice RAG: archivo -> hash/tamaño/mtime y chunk -> archivo.
+
+    Permite planificar una sincronización sin leer la colección completa: los archivos se
+    consultan en O(archivos) y los ids de un archivo en O(chunks de ese archivo). Se actualiza
+    en la misma secuencia que las escrituras y borrados del vectorstore.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS archivos ("
+            " source_path TEXT PRIMARY KEY, file_hash TEXT NOT NULL, tamaño INTEGER, mtime_ns INTEGER,"
+            " chunks INTEGER NOT NULL DEFAULT 0, actualizado REAL);"
+            "CREATE TABLE IF NOT EXISTS chunks ("
+            " id TEXT PRIMARY KEY, source_path TEXT NOT NULL, chunk_id INTEGER);"
+            "CREATE INDEX IF NOT EXISTS chunks_por_archivo ON chunks (source_path);"
+        )
+        self._conn.commit()
+
+    def archivos(self) -> Dict[str, Tuple[str, Optional[int], Optional[int]]]:
+        """{source_path: (file_hash, tamaño, mtime_ns)}"""
+        with self._lock:
+            filas = self._conn.execute("SELECT source_path, file_hash, tamaño, mtime_ns FROM archivos").fetchall()
+        return {source_path: (file_hash, tamaño, mtime_ns) for source_path, file_hash, tamaño, mtime_ns in filas}
+
+    def ids_de(self, source_path: str) -> Dict[str, Optional[int]]:
+        """{id: chunk_id} de los chunks indexados de un archivo"""
+        with self._lock:
+            filas = self._conn.execute("SELECT id, chunk_id FROM chunks WHERE source_path = ?", (source_path,)).fetchall()
+        return dict(filas)
+
+    def _recontar(self, source_paths: Iterable[str]):
+        """Actualizar el contador de chunks por archivo (llamar con el lock tomado)"""
+        for source_path in set(source_paths):
+            self._conn.execute(
+                "INSERT INTO archivos (source_path, file_hash, chunks, actualizado) VALUES (?, '', 0, ?) "
+                "ON CONFLICT(source_path) DO NOTHING",
+                (source_path, time.time())
+            )
+            self._conn.execute(
+                "UPDATE archivos SET chunks = (SELECT COUNT(*) FROM chunks WHERE source_path = ?) WHERE source_path = ?",
+                (source_path, source_path)
+            )
+
+    def registrar_chunks(self, ids: Sequence[str], source_paths: Sequence[str], chunk_ids: Sequence[Optional[int]]):
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO chunks (id, source_path, chunk_id) VALUES (?, ?, ?)",
+                list(zip(ids, source_paths, chunk_ids))
+            )
+            self._recontar(source_paths)
+
+    def actualizar_posiciones(self, ids: Sequence[str], chunk_ids: Sequence[Optional[int]]):
+        with self._lock, self._conn:
+            self._conn.executemany("UPDATE chunks SET chunk_id = ? WHERE id = ?", list(zip(chunk_ids, ids)))
+
+    def eliminar_chunks(self, ids: Sequence[str]):
+        with self._lock, self._conn:
+            afectados = set()
+            for i in range(0, len(ids), 500):
+                lote = list(ids[i:i + 500])
+                marcadores = ','.join('?' * len(lote))
+                afectados.update(fila[0] for fila in self._conn.execute(
+                    f"SELECT DISTINCT source_path FROM chunks WHERE id IN ({marcadores})", lote))
+                self._conn.execute(f"DELETE FROM chunks WHERE id IN ({marcadores})", lote)
+            self._recontar(afectados)
+
+    def fijar_archivo(self, source_path: str, file_hash: str, tamaño: Optional[int] = None, mtime_ns: Optional[int] = None):
+        """Registrar el estado de un archivo ya sincronizado (file_hash '' fuerza reprocesarlo)"""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO archivos (source_path, file_hash, tamaño, mtime_ns, actualizado) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(source_path) DO UPDATE SET file_hash = excluded.file_hash, tamaño = excluded.tamaño, "
+                "mtime_ns = excluded.mtime_ns, actualizado = excluded.actualizado",
+                (source_path, file_hash, tamaño, mtime_ns, time.time())
+            )
+            self._recontar([source_path])
+
+    def olvidar_archivo(self, source_path: str):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks WHERE source_path = ?", (source_path,))
+            self._conn.execute("DELETE FROM archivos WHERE source_path = ?", (source_path,))
+
+    def totales(self) -> Tuple[int, int]:
+        """(archivos, chunks) sin recorrer la colección"""
+        with self._lock:
+            archivos, chunks = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(chunks), 0) FROM archivos").fetchone()
+        return archivos, chunks
+
+    def cerrar(self):
+        with self._lock:
+            self._conn.close()
+
+    def reconstruir(self, ids: Sequence[str], metadatas: Sequence[dict]):
+        """Reconstruir el manifiesto desde un recorrido completo de la colección (solo una vez)"""
+        archivos = {}
+        filas = []
+        for doc_id, metadata in zip(ids, metadatas):
+            metadata = metadata or {}
+            # Chunks anteriores al manifiesto sin source_path: archivo '' que la sincronización elimina
+            source_path = metadata.get('source_path') or ''
+            archivos.setdefault(source_path, metadata.get('file_hash') or '')
+            filas.append((doc_id, source_path, metadata.get('chunk_id')))
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM archivos")
+            self._conn.executemany("INSERT OR REPLACE INTO chunks (id, source_path, chunk_id) VALUES (?, ?, ?)", filas)
+            self._conn.executemany(
+                "INSERT INTO archivos (source_path, file_hash, actualizado) VALUES (?, ?, ?)",
+                [(source_path, file_hash, time.time()) for source_path, file_hash in archivos.items()]
+            )
+            self._recontar(archivos)
@@ -1,215 +1,580 @@
 import os
 import time
-from typing import List
-from langchain_community.document_loaders import UnstructuredPDFLoader, UnstructuredWordDocumentLoader
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_chroma import Chroma
+import hashlib
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import List, Optional
 from langchain_core.documents import Document
 
 import config
 from logger_config import logger
+from embedding_cache import CachedEmbeddings
+from document_parser import dividir_documento, procesar_archivo, hash_texto
+from embedding_pipeline import EmbeddingPipeline
+from rate_limiter import AdaptiveConcurrencyLimiter
+from bm25_index import BM25Index, fusion_rrf, terminos_exactos
+from numpy_index import NumpyVectorIndex
+from rag_manifest import RAGManifest
+from rw_lock import ReadWriteLock
+from rag_contexto import mmr, unir_contiguos
+from ttl_cache import LRUTTLCache
+
+def hash_archivo(file_path: str) -> str:
+    """SHA-256 del contenido de un archivo (leído por bloques)"""
+    sha = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(bloque)
+    return sha.hexdigest()
+
+def id_chunk(source_path: str, chunk_hash: str, ocurrencia: int = 1) -> str:
+    """Id determinista de un chunk: mismo archivo y mismo texto producen el mismo id"""
+    return hashlib.sha1(f"{source_path}|{chunk_hash}|{ocurrencia}".encode('utf-8')).hexdigest()
+
+COLECCION_BASE = "kushki_docs"  # Generación original del índice; las reindexaciones blue/green usan un sufijo
+
+def _ruta_generacion(path: str, nombre: str) -> str:
+    """Ruta de un archivo o directorio del índice para una generación (la base conserva la ruta original)"""
+    if nombre == COLECCION_BASE:
+        return path
+    raiz, extension = os.path.splitext(path)
+    return f"{raiz}_{nombre}{extension}"
+
+def leer_generacion_activa(directorio: str) -> str:
+    """Nombre de la generación activa según el puntero indice_activo.txt del directorio del backend"""
+    try:
+        with open(os.path.join(directorio, 'indice_activo.txt'), encoding='utf-8') as f:
+            return f.read().strip() or COLECCION_BASE
+    except FileNotFoundError:
+        return COLECCION_BASE
+
+class IndiceRAG:
+    """Una generación del índice: vectorstore, colección, manifiesto y BM25 que cambian juntos"""
+
+    def __init__(self, nombre: str, vectorstore, coleccion, manifest: RAGManifest, bm25: BM25Index):
+        self.nombre = nombre
+        self.vectorstore = vectorstore
+        self.coleccion = coleccion  # Colección de Chroma o índice NumPy: upsert/update/delete/get/count
+        self.manifest = manifest  # Archivo -> hash y chunk -> archivo
+        self.bm25 = bm25  # Índice léxico para códigos, marcas y siglas que la búsqueda vectorial resuelve mal
+        self.retirado = False  # Ya reemplazada y eliminada: quien la tenga fijada lee la activa
 
 class RAGSystem:
     def __init__(self):
         self.embeddings = None
-        self.vectorstore = None
-        self.retriever = None
+        self.indice: Optional[IndiceRAG] = None  # Generación activa; se reemplaza atómicamente (blue/green)
         self.last_update = 0
+        self.index_version = 0  # Se incrementa cada vez que cambia el contenido indexado
+        # Consultas en paralelo; cada escritura en el índice activo (lote, borrado, intercambio) es exclusiva
+        self._rw_lock = ReadWriteLock()
+        self._sync_lock = threading.Lock()  # Una sola sincronización o reindexación a la vez
+        self._por_retirar: List[IndiceRAG] = []  # Generaciones reemplazadas que algún snapshot aún puede tener fijadas
+        # Cuota de embeddings separada de la del LLM: la ingesta no compite con las respuestas
+        self.embedding_limiter = AdaptiveConcurrencyLimiter(
+            initial_limit=config.RAG_EMBED_CONCURRENCY,
+            max_limit=config.RAG_EMBED_CONCURRENCY,
+            name="embeddings"
+        )
+        # Preguntas repetidas: sin viaje de red para el embedding ni nueva búsqueda mientras no cambie el índice
+        self.query_embedding_cache = LRUTTLCache(
+            max_entries=config.RAG_QUERY_EMBEDDING_CACHE_MAX_ENTRIES,
+            ttl_seconds=config.RAG_QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+            nombre="embeddings de queries"
+        )
+        self.retrieval_cache = LRUTTLCache(
+            max_entries=config.RAG_RETRIEVAL_CACHE_MAX_ENTRIES,
+            ttl_seconds=config.RAG_RETRIEVAL_CACHE_TTL_SECONDS,
+            nombre="recuperaciones RAG"
+        )
         self.initialize_embeddings()
         self.initialize_vectorstore()
 
+    @property
+    def vectorstore(self):
+        return self.indice.vectorstore if self.indice else None
+
+    @property
+    def coleccion(self):
+        return self.indice.coleccion if self.indice else None
+
+    @property
+    def manifest(self) -> Optional[RAGManifest]:
+        return self.indice.manifest if self.indice else None
+
+    @property
+    def bm25(self) -> Optional[BM25Index]:
+        return self.indice.bm25 if self.indice else None
+
     def initialize_embeddings(self):
         """Inicializar los embeddings de Google GenAI"""
         try:
-            self.embeddings = GoogleGenerativeAIEmbeddings(
-                model="models/text-embedding-004",
+            from langchain_google_genai import GoogleGenerativeAIEmbeddings
+            embeddings = GoogleGenerativeAIEmbeddings(
+                model=config.EMBEDDING_MODEL_NAME,
                 google_api_key=config.GOOGLE_API_KEY
             )
+            # Los chunks ya embebidos alguna vez (renombrados, resubidos, reconstrucción de chroma_db) no vuelven a la API
+            self.embeddings = CachedEmbeddings(embeddings, config.EMBEDDING_MODEL_NAME, config.EMBEDDING_CACHE_PATH)
             logger.info("Embeddings de Google GenAI inicializados correctamente")
         except Exception as e:
             logger.error(f"Error al inicializar embeddings: {e}")
             self.embeddings = None
 
+    def _nueva_version(self):
+        """Registrar un cambio del contenido indexado: las recuperaciones cacheadas dejan de valer"""
+        self.last_update = time.time()
+        self.index_version += 1
+        self.retrieval_cache.clear()
+
+    def get_cache_stats(self) -> dict:
+        return {
+            'embeddings_queries': self.query_embedding_cache.get_stats(),
+            'recuperaciones': self.retrieval_cache.get_stats(),
+        }
+
+    def _directorio_base(self) -> str:
+        """Directorio del backend vectorial, donde viven los manifiestos y el puntero a la generación activa"""
+        if config.RAG_VECTOR_BACKEND == "numpy":
+            return config.RAG_NUMPY_INDEX_PATH
+        return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chroma_db')
+
+    def _leer_generacion_activa(self) -> str:
+        return leer_generacion_activa(self._directorio_base())
+
+    def _guardar_generacion_activa(self, nombre: str):
+        ruta = os.path.join(self._directorio_base(), 'indice_activo.txt')
+        with open(f"{ruta}.tmp", 'w', encoding='utf-8') as f:
+            f.write(nombre)
+        os.replace(f"{ruta}.tmp", ruta)
+
+    def _abrir_indice(self, nombre: str) -> IndiceRAG:
+        """Abrir (o crear vacía) una generación del índice y alinear manifiesto y BM25 con ella"""
+        persist_directory = self._directorio_base()
+        os.makedirs(persist_directory, exist_ok=True)
+        if config.RAG_VECTOR_BACKEND == "numpy":
+            vectorstore = NumpyVectorIndex(
+                config.RAG_NUMPY_INDEX_PATH if nombre == COLECCION_BASE else os.path.join(config.RAG_NUMPY_INDEX_PATH, nombre),
+                dtype=config.RAG_NUMPY_DTYPE
+            )
+            coleccion = vectorstore
+        else:
+            from langchain_chroma import Chroma  # Solo con el backend Chroma: el NumPy no lo necesita
+            vectorstore = Chroma(
+                embedding_function=self.embeddings,
+                persist_directory=persist_directory,
+                collection_name=nombre
+            )
+            coleccion = vectorstore._collection
+
+        indice = IndiceRAG(
+            nombre,
+            vectorstore,
+            coleccion,
+            RAGManifest(_ruta_generacion(os.path.join(persist_directory, 'manifest.sqlite3'), nombre)),
+            BM25Index(path=_ruta_generacion(config.RAG_BM25_PATH, nombre))
+        )
+        self._sincronizar_manifiesto(indice)
+        self._sincronizar_bm25(indice)
+        return indice
+
+    def _retirar_indice(self, indice: IndiceRAG):
+        """Eliminar una generación que ya no está activa (colección, manifiesto y BM25)"""
+        try:
+            if isinstance(indice.vectorstore, NumpyVectorIndex):
+                indice.vectorstore.eliminar_persistencia()
+            else:
+                indice.vectorstore.delete_collection()
+            indice.manifest.cerrar()
+            for ruta in (indice.manifest.path, f"{indice.manifest.path}-wal", f"{indice.manifest.path}-shm", indice.bm25.path):
+                if ruta and os.path.exists(ruta):
+                    os.remove(ruta)
+            logger.info(f"🧹 Generación del índice '{indice.nombre}' eliminada")
+        except Exception as e:
+            logger.warning(f"No se pudo eliminar la generación del índice '{indice.nombre}': {e}")
+
     def initialize_vectorstore(self):
-        """Inicializar ChromaDB vectorstore"""
+        """Inicializar el vectorstore (ChromaDB o índice NumPy en memoria según RAG_VECTOR_BACKEND)"""
         try:
             if self.embeddings is None:
                 logger.error("No se pueden inicializar vectorstore sin embeddings")
                 return
 
-            # Crear el directorio para ChromaDB si no existe
-            persist_directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'chroma_db')
-            os.makedirs(persist_directory, exist_ok=True)
-
-            self.vectorstore = Chroma(
-                embedding_function=self.embeddings,
-                persist_directory=persist_directory,
-                collection_name="kushki_docs"
-            )
-
-            # Configurar el retriever para obtener al menos 5 resultados
-            self.retriever = self.vectorstore.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 5}
-            )
-
-            logger.info("ChromaDB vectorstore inicializado correctamente")
+            self.indice = self._abrir_indice(self._leer_generacion_activa())
+            backend = "Índice vectorial NumPy" if config.RAG_VECTOR_BACKEND == "numpy" else "ChromaDB vectorstore"
+            logger.info(f"{backend} inicializado correctamente (colección {self.indice.nombre})")
         except Exception as e:
             logger.error(f"Error al inicializar vectorstore: {e}")
-            self.vectorstore = None
-            self.retriever = None
+            self.indice = None
 
-    def load_and_split_document(self, file_path: str) -> List[Document]:
-        """Cargar y dividir un documento en chunks"""
+    def _sincronizar_manifiesto(self, indice: IndiceRAG):
+        """Reconstruir el manifiesto con un único recorrido de la colección si no cuadra con ella"""
         try:
-            # Determinar el tipo de loader basado en la extensión
-            file_extension = os.path.splitext(file_path)[1].lower()
-            
-            if file_extension == '.pdf':
-                loader = UnstructuredPDFLoader(file_path)
-            elif file_extension in ['.docx', '.doc']:
-                loader = UnstructuredWordDocumentLoader(file_path)
-            else:
-                logger.warning(f"Tipo de archivo no soportado para RAG: {file_extension}")
-                return []
+            archivos, chunks = indice.manifest.totales()
+            total = indice.coleccion.count()
+            if chunks == total:
+                logger.info(f"🗂️ Manifiesto RAG: {archivos} archivos, {chunks} chunks")
+                return
+            logger.info(f"🗂️ Reconstruyendo manifiesto RAG desde el vectorstore ({chunks} != {total} chunks)")
+            datos = indice.coleccion.get(include=["metadatas"])
+            indice.manifest.reconstruir(datos['ids'], datos['metadatas'])
+        except Exception as e:
+            logger.error(f"Error al sincronizar manifiesto RAG: {e}")
 
-            # Cargar el documento
-            documents = loader.load()
-            logger.info(f"Documento cargado: {file_path} con {len(documents)} elementos")
+    @staticmethod
+    def _al_escribir_chunks(indice: IndiceRAG, ids: List[str], docs: List[Document]):
+        """Mantener BM25 y manifiesto al día con cada lote escrito en el vectorstore"""
+        indice.bm25.agregar(ids, [doc.page_content for doc in docs], [doc.metadata for doc in docs])
+        indice.manifest.registrar_chunks(ids, [doc.metadata['source_path'] for doc in docs],
+                                         [doc.metadata.get('chunk_id') for doc in docs])
 
-            # Configurar el text splitter optimizado para mejor retrieval
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=2000,  # Chunks más manejables para mejor precisión
-                chunk_overlap=400,  # Overlap optimizado
-                length_function=len,
-                separators=["\n\n", "\n", ". ", "! ", "? ", "; ", ", ", " ", ""]
-            )
+    def _sincronizar_bm25(self, indice: IndiceRAG):
+        """Cargar el índice BM25 persistido o reconstruirlo desde Chroma si no coincide"""
+        try:
+            cargado = indice.bm25.cargar()
+            total = indice.coleccion.count()
+            if cargado and len(indice.bm25) == total:
+                logger.info(f"🔤 Índice BM25 cargado: {total} chunks")
+                return
+            logger.info(f"🔤 Reconstruyendo índice BM25 desde el vectorstore ({total} chunks)")
+            datos = indice.coleccion.get(include=["documents", "metadatas"])
+            indice.bm25.limpiar()
+            indice.bm25.agregar(datos['ids'], datos['documents'], datos['metadatas'])
+            indice.bm25.guardar()
+        except Exception as e:
+            logger.error(f"Error al sincronizar índice BM25: {e}")
 
-            # Dividir documentos en chunks
-            splits = text_splitter.split_documents(documents)
-            
-            # Agregar metadata adicional
-            for i, split in enumerate(splits):
-                split.metadata.update({
-                    'source_file': os.path.basename(file_path),
-                    'chunk_id': i,
-                    'file_type': file_extension,
-                    'processed_time': time.time()
-                })
-
-            logger.info(f"Documento dividido en {len(splits)} chunks")
+    def load_and_split_document(self, file_path: str, source_path: Optional[str] = None,
+                                file_hash: Optional[str] = None) -> List[Document]:
+        """Cargar y dividir un documento en chunks"""
+        try:
+            splits = dividir_documento(file_path, source_path, file_hash)
+            logger.info(f"Documento {file_path} dividido en {len(splits)} chunks")
             return splits
-
         except Exception as e:
             logger.error(f"Error al cargar y dividir documento {file_path}: {e}")
             return []
 
-    def update_vectorstore(self, documents_dir: str):
-        """Actualizar el vectorstore incrementalmente solo con documentos nuevos o modificados"""
-        if self.vectorstore is None:
+    def _parsear_archivos(self, pendientes):
+        """Parsear y dividir archivos en paralelo, entregando cada resultado en cuanto termina.
+
+        Unstructured es intensivo en CPU y retiene el GIL, así que se usan procesos (contexto
+        spawn: los workers solo importan document_parser). Un archivo que falla, o un worker
+        que muere, solo afecta a ese archivo.
+        """
+        workers = min(config.RAG_INGEST_WORKERS, len(pendientes))
+        if workers <= 1:
+            for file_path, source_path, file_hash in pendientes:
+                yield procesar_archivo(file_path, source_path, file_hash)
+            return
+
+        logger.info(f"⚙️ Parseando {len(pendientes)} archivos con {workers} procesos")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futuros = {executor.submit(procesar_archivo, *pendiente): pendiente[1] for pendiente in pendientes}
+            for futuro in as_completed(futuros):
+                try:
+                    yield futuro.result()
+                except Exception as e:
+                    yield {'source_path': futuros[futuro], 'splits': [], 'error': f"{type(e).__name__}: {e}", 'segundos': 0.0}
+
+    def _planificar(self, documents_dir: str, manifest: RAGManifest) -> dict:
+        """Comparar el directorio con el manifiesto (O(archivos)), sin recorrer la colección"""
+        supported_extensions = ['.pdf', '.docx', '.doc']
+        archivos_indexados = manifest.archivos()
+        current_files = set()
+        pendientes = []
+        estado_archivo = {}  # source_path -> (file_hash, tamaño, mtime_ns)
+
+        for root, dirs, files in os.walk(documents_dir):
+            for file in files:
+                file_path = os.path.join(root, file)
+                file_extension = os.path.splitext(file)[1].lower()
+                if file_extension not in supported_extensions:
+                    continue
+
+                source_path = os.path.relpath(file_path, documents_dir).replace(os.sep, '/')
+                current_files.add(source_path)
+                stat = os.stat(file_path)
+                previo = archivos_indexados.get(source_path)
+
+                # Mismo tamaño y mtime: sin cambios, ni siquiera se calcula el hash
+                if previo and previo[0] and (previo[1], previo[2]) == (stat.st_size, stat.st_mtime_ns):
+                    continue
+
+                file_hash = hash_archivo(file_path)
+                if previo and previo[0] == file_hash:
+                    logger.debug(f"⏭️ Archivo sin cambios, saltando: {source_path}")
+                    manifest.fijar_archivo(source_path, file_hash, stat.st_size, stat.st_mtime_ns)
+                    continue
+
+                pendientes.append((file_path, source_path, file_hash))
+                estado_archivo[source_path] = (file_hash, stat.st_size, stat.st_mtime_ns)
+
+        return {
+            'archivos_indexados': archivos_indexados,
+            'pendientes': pendientes,
+            'estado_archivo': estado_archivo,
+            'eliminados': set(archivos_indexados) - current_files,
+        }
+
+    @staticmethod
+    def _requiere_reindexacion(plan: dict) -> bool:
+        """Un cambio que afecta a gran parte de los archivos se construye aparte (blue/green)"""
+        indexados = len([p for p in plan['archivos_indexados'] if p])
+        cambiados = len(plan['pendientes']) + len(plan['eliminados'])
+        return indexados > 1 and cambiados >= config.RAG_BLUE_GREEN_FRACTION * indexados
+
+    def _aplicar_plan(self, plan: dict, indice: IndiceRAG, bloqueo_escritura) -> bool:
+        """Parsear, embeber y escribir los cambios del plan en un índice; devuelve si cambió su contenido.
+
+        Cada escritura (lote de upsert, borrado o actualización de metadata) se hace bajo
+        bloqueo_escritura para que las consultas concurrentes nunca vean un lote a medias.
+        """
+        archivos_indexados = plan['archivos_indexados']
+        for _, source_path, _ in plan['pendientes']:
+            logger.info(f"{'📝 Procesando archivo MODIFICADO' if source_path in archivos_indexados else '🆕 Procesando archivo NUEVO'} para RAG: {source_path}")
+
+        # Los chunks se embeben a medida que llegan los archivos parseados, mientras
+        # los demás procesos siguen parseando
+        pipeline = EmbeddingPipeline(indice.coleccion, self.embeddings, self.embedding_limiter,
+                                     al_escribir=lambda ids, docs: self._al_escribir_chunks(indice, ids, docs),
+                                     bloqueo_escritura=bloqueo_escritura)
+        ids_a_borrar = []
+        procesados = []
+        ids_reordenados, metadatas_reordenadas = [], []
+
+        try:
+            for resultado in self._parsear_archivos(plan['pendientes']):
+                source_path = resultado['source_path']
+                document_splits = resultado['splits']
+                if resultado['error'] or not document_splits:
+                    # Si falla el parseo se conserva la versión anterior indexada y se reintenta en la próxima actualización
+                    logger.error(f"❌ Error procesando {source_path} ({resultado['segundos']:.1f}s): {resultado['error'] or 'sin contenido'}")
+                    continue
+                procesados.append(source_path)
+                ids_previos = indice.manifest.ids_de(source_path) if source_path in archivos_indexados else {}
+
+                ocurrencias = {}
+                ids_actuales = set()
+                nuevos_docs, nuevos_ids = [], []
+                for split in document_splits:
+                    chunk_hash = split.metadata['chunk_hash']
+                    ocurrencias[chunk_hash] = ocurrencias.get(chunk_hash, 0) + 1
+                    doc_id = id_chunk(source_path, chunk_hash, ocurrencias[chunk_hash])
+                    ids_actuales.add(doc_id)
+                    if doc_id not in ids_previos:
+                        nuevos_docs.append(split)
+                        nuevos_ids.append(doc_id)
+                    else:
+                        # Texto ya embebido: solo se actualiza la metadata (posición, hash del archivo)
+                        ids_reordenados.append(doc_id)
+                        metadatas_reordenadas.append(split.metadata)
+
+                obsoletos = [doc_id for doc_id in ids_previos if doc_id not in ids_actuales]
+                ids_a_borrar.extend(obsoletos)
+                logger.info(f"🧩 {source_path}: {len(document_splits)} chunks en {resultado['segundos']:.1f}s, "
+                            f"{len(nuevos_docs)} a embeber, {len(obsoletos)} obsoletos")
+                pipeline.agregar(nuevos_docs, nuevos_ids)
+        finally:
+            resumen = pipeline.finalizar()
+        total_nuevos = resumen['agregados']
+
+        # Remover archivos que ya no existen (y chunks heredados sin source_path)
+        files_to_remove = plan['eliminados']
+        if files_to_remove:
+            logger.info(f"🗑️ Removiendo {len(files_to_remove)} archivos eliminados del vectorstore")
+            for file_to_remove in files_to_remove:
+                ids_a_borrar.extend(indice.manifest.ids_de(file_to_remove))
+
+        cambios = total_nuevos > 0
+        if ids_a_borrar:
+            for i in range(0, len(ids_a_borrar), 500):
+                lote = ids_a_borrar[i:i + 500]
+                with bloqueo_escritura():
+                    indice.coleccion.delete(ids=lote)
+                    indice.bm25.eliminar(lote)
+                    indice.manifest.eliminar_chunks(lote)
+            logger.info(f"🗑️ {len(ids_a_borrar)} chunks obsoletos eliminados del vectorstore")
+            cambios = True
+        for file_to_remove in files_to_remove:
+            indice.manifest.olvidar_archivo(file_to_remove)
+
+        if ids_reordenados:
+            with bloqueo_escritura():
+                indice.coleccion.update(ids=ids_reordenados, metadatas=metadatas_reordenadas)
+                indice.bm25.actualizar_metadatas(ids_reordenados, metadatas_reordenadas)
+                indice.manifest.actualizar_posiciones(ids_reordenados, [m['chunk_id'] for m in metadatas_reordenadas])
+
+        # Registrar el hash de los archivos sincronizados; sin hash, la próxima
+        # actualización reprocesa los que tuvieron lotes fallidos (solo se embeben los chunks que falten)
+        if resumen['fallidos']:
+            logger.warning(f"⚠️ Archivos con chunks sin indexar, se reintentarán: {sorted(resumen['fallidos'])}")
+        for source_path in procesados:
+            file_hash, tamaño, mtime_ns = plan['estado_archivo'][source_path]
+            if source_path in resumen['fallidos']:
+                file_hash = ''
+            indice.manifest.fijar_archivo(source_path, file_hash, tamaño, mtime_ns)
+
+        if total_nuevos:
+            logger.info(f"🎉 Vectorstore actualizado incrementalmente: +{total_nuevos} chunks nuevos en {len(procesados)} archivos")
+        elif not cambios:
+            logger.info(f"✅ Vectorstore ya está actualizado, no hay archivos nuevos")
+
+        if cambios or ids_reordenados:
+            indice.bm25.guardar()
+            if isinstance(indice.vectorstore, NumpyVectorIndex):
+                indice.vectorstore.guardar()
+        return cambios
+
+    def _reindexar(self, documents_dir: str) -> IndiceRAG:
+        """Construir una generación nueva del índice sin tocar la activa (las consultas siguen usándola)"""
+        nuevo = self._abrir_indice(f"{COLECCION_BASE}_{time.strftime('%Y%m%d%H%M%S')}")
+        logger.info(f"🔁 Reindexación blue/green en la colección {nuevo.nombre}")
+        try:
+            # Nadie consulta la generación nueva hasta el intercambio: no hace falta bloquear
+            self._aplicar_plan(self._planificar(documents_dir, nuevo.manifest), nuevo, contextlib.nullcontext)
+        except Exception:
+            self._retirar_indice(nuevo)
+            raise
+        return nuevo
+
+    def _intercambiar_indice(self, nuevo: IndiceRAG):
+        """Activar una generación nueva de forma atómica.
+
+        La anterior no se elimina aquí: el snapshot de conocimiento publicado la tiene fijada
+        hasta que se publique uno con la nueva (ver retirar_generaciones_anteriores).
+        """
+        with self._rw_lock.escritura():
+            anterior = self.indice
+            self.indice = nuevo
+            self._guardar_generacion_activa(nuevo.nombre)
+            self._nueva_version()
+            self._por_retirar.append(anterior)
+        logger.info(f"🔀 Índice activo: {anterior.nombre} -> {nuevo.nombre}")
+
+    def retirar_generaciones_anteriores(self):
+        """Eliminar las generaciones reemplazadas una vez publicado el snapshot que fija la activa"""
+        with self._rw_lock.escritura():
+            retiradas, self._por_retirar = self._por_retirar, []
+            for indice in retiradas:
+                indice.retirado = True
+        # Tras el bloqueo de escritura ya no queda ninguna consulta usando las generaciones retiradas
+        for indice in retiradas:
+            self._retirar_indice(indice)
+
+    def update_vectorstore(self, documents_dir: str, completo: bool = False):
+        """Actualizar el vectorstore incrementalmente por hash de contenido.
+
+        Un archivo cuyo hash no cambió no se vuelve a procesar. Si cambió, se divide de nuevo
+        y solo se embeben los chunks cuyo texto es nuevo (el id del chunk se deriva de la ruta
+        y del hash del texto); los ids que ya no aparecen se eliminan. Con completo=True, o si
+        cambia al menos RAG_BLUE_GREEN_FRACTION de los archivos, se reindexa en una colección
+        nueva que reemplaza a la activa al terminar.
+        """
+        if self.indice is None:
             logger.error("Vectorstore no inicializado")
             return False
 
-        try:
-            # Obtener todos los archivos PDF y DOCX del directorio
-            supported_extensions = ['.pdf', '.docx', '.doc']
-            
-            if not os.path.exists(documents_dir):
-                logger.warning(f"Directorio de documentos no existe: {documents_dir}")
-                return False
+        if not os.path.exists(documents_dir):
+            logger.warning(f"Directorio de documentos no existe: {documents_dir}")
+            return False
 
-            # Obtener archivos existentes en vectorstore
+        with self._sync_lock:
             try:
-                existing_docs = self.vectorstore.get()
-                existing_files = set()
-                if existing_docs and 'metadatas' in existing_docs:
-                    for metadata in existing_docs['metadatas']:
-                        if metadata and 'source_file' in metadata:
-                            existing_files.add(metadata['source_file'])
-                logger.info(f"Archivos ya en vectorstore: {len(existing_files)}")
-            except Exception as e:
-                logger.warning(f"No se pudo obtener archivos existentes del vectorstore: {e}")
-                existing_files = set()
-
-            # Identificar archivos que necesitan procesamiento
-            current_files = set()
-            new_documents = []
-            
-            for root, dirs, files in os.walk(documents_dir):
-                for file in files:
-                    file_path = os.path.join(root, file)
-                    file_extension = os.path.splitext(file)[1].lower()
-                    
-                    if file_extension in supported_extensions:
-                        current_files.add(file)
-                        
-                        # Solo procesar si es nuevo o no está en vectorstore
-                        if file not in existing_files:
-                            logger.info(f"🆕 Procesando archivo NUEVO para RAG: {file}")
-                            document_splits = self.load_and_split_document(file_path)
-                            new_documents.extend(document_splits)
-                        else:
-                            logger.debug(f"⏭️ Archivo ya procesado, saltando: {file}")
-
-            # Remover archivos que ya no existen del vectorstore
-            files_to_remove = existing_files - current_files
-            if files_to_remove:
-                logger.info(f"🗑️ Removiendo {len(files_to_remove)} archivos eliminados del vectorstore")
-                for file_to_remove in files_to_remove:
-                    try:
-                        # Buscar y eliminar documentos de este archivo
-                        docs = self.vectorstore.get(where={"source_file": file_to_remove})
-                        if docs and docs['ids']:
-                            self.vectorstore.delete(ids=docs['ids'])
-                            logger.info(f"🗑️ Archivo {file_to_remove} removido del vectorstore")
-                    except Exception as e:
-                        logger.error(f"Error removiendo archivo {file_to_remove}: {e}")
-
-            # Solo agregar documentos nuevos si los hay
-            if new_documents:
-                logger.info(f"📚 Agregando {len(new_documents)} chunks nuevos al vectorstore")
-                
-                # Agregar documentos al vectorstore en lotes
-                batch_size = 50
-                total_docs = len(new_documents)
-                
-                for i in range(0, total_docs, batch_size):
-                    batch = new_documents[i:i + batch_size]
-                    self.vectorstore.add_documents(batch)
-                    logger.info(f"✅ Procesado lote {i//batch_size + 1}: {len(batch)} documentos")
+                indice = self.indice
+                plan = self._planificar(documents_dir, indice.manifest)
+                logger.info(f"Archivos ya en vectorstore: {len([p for p in plan['archivos_indexados'] if p])}")
+
+                if completo or self._requiere_reindexacion(plan):
+                    self._intercambiar_indice(self._reindexar(documents_dir))
+                elif self._aplicar_plan(plan, indice, self._rw_lock.escritura):
+                    self._nueva_version()
+
+                # Estadísticas finales
+                try:
+                    total_archivos, total_chunks = self.indice.manifest.totales()
+                    logger.info(f"📊 Total en vectorstore: {total_chunks} chunks de {total_archivos} archivos")
+                    logger.info(f"🧠 Caché de embeddings: {self.embeddings.get_stats()}")
+                    logger.info(f"⚡ Cachés de consultas RAG: {self.get_cache_stats()}")
+                except Exception as e:
+                    logger.debug(f"No se pudo obtener estadísticas finales: {e}")
+
+                return True
 
-                self.last_update = time.time()
-                logger.info(f"🎉 Vectorstore actualizado incrementalmente: +{total_docs} chunks nuevos")
-            else:
-                logger.info(f"✅ Vectorstore ya está actualizado, no hay archivos nuevos")
-
-            # Estadísticas finales
-            try:
-                final_docs = self.vectorstore.get()
-                total_chunks = len(final_docs['ids']) if final_docs and 'ids' in final_docs else 0
-                logger.info(f"📊 Total chunks en vectorstore: {total_chunks}")
             except Exception as e:
-                logger.debug(f"No se pudo obtener estadísticas finales: {e}")
-
-            return True
+                logger.error(f"Error al actualizar vectorstore: {e}")
+                return False
 
+    @staticmethod
+    def _normalizar_query(query: str) -> str:
+        return " ".join(query.split())
+
+    def embed_query(self, query: str) -> Optional[List[float]]:
+        """Calcular el embedding de una query (reutilizable para caché semántica y retrieval)"""
+        if self.embeddings is None:
+            return None
+        clave = self._normalizar_query(query)
+        embedding = self.query_embedding_cache.get(clave)
+        if embedding is not None:
+            return embedding
+        try:
+            embedding = self.embeddings.embed_query(query)
+            self.query_embedding_cache.put(clave, embedding)
+            return embedding
         except Exception as e:
-            logger.error(f"Error al actualizar vectorstore: {e}")
-            return False
-
-    def retrieve_documents(self, query: str, k: int = 5) -> List[Document]:
-        """Recuperar documentos relevantes basados en la query con logging detallado"""
-        if self.retriever is None:
+            logger.error(f"Error al calcular embedding de la query: {e}")
+            return None
+
+    def _recuperar(self, query: str, k: int, embedding: Optional[List[float]], filtro: Optional[dict],
+                   diversificar: bool = False, indice: Optional[IndiceRAG] = None):
+        """Ranking fusionado (vectorial + BM25) de candidatos; devuelve (docs, k efectivo).
+
+        indice: generación fijada por el snapshot de la pregunta (por defecto la activa).
+        """
+        # La versión forma parte de la clave: un resultado calculado durante una actualización
+        # queda bajo la versión anterior y nunca se sirve después
+        clave = (self._normalizar_query(query), k, repr(sorted(filtro.items())) if filtro else None,
+                 diversificar, self.index_version, indice.nombre if indice is not None else None)
+        cacheado = self.retrieval_cache.get(clave)
+        if cacheado is not None:
+            docs, k_efectivo = cacheado
+            logger.info(f"⚡ Recuperación RAG desde caché ({len(docs)} candidatos)")
+            return list(docs), k_efectivo
+
+        if embedding is None:
+            # Fuera del bloqueo de lectura: la llamada a la API no retrasa a los escritores
+            embedding = self.embed_query(query)
+            if embedding is None:
+                return [], k
+
+        with self._rw_lock.lectura():
+            if indice is None or indice.retirado:
+                indice = self.indice
+            # Las coincidencias léxicas (BM25) se fusionan con las vectoriales por reciprocal rank fusion
+            lexicos = indice.bm25.buscar(query, k=k + config.RAG_EXTRA_CANDIDATES, filtro=filtro)
+            # Solo se piden candidatos extra al vectorstore si hay otro ranking con el que fusionar
+            # o si después se va a diversificar con MMR
+            extra = config.RAG_EXTRA_CANDIDATES if lexicos or diversificar else 0
+            retrieved_docs = indice.vectorstore.similarity_search_by_vector(embedding, k=k + extra, filter=filtro)
+            docs, k_efectivo = self._fusionar_con_bm25(indice.bm25, query, retrieved_docs, lexicos, k)
+        self.retrieval_cache.put(clave, (tuple(docs), k_efectivo))
+        return docs, k_efectivo
+
+    def retrieve_documents(self, query: str, k: int = 5, embedding: Optional[List[float]] = None,
+                           filtro: Optional[dict] = None, indice: Optional[IndiceRAG] = None) -> List[Document]:
+        """Recuperar documentos relevantes basados en la query con logging detallado.
+
+        Reentrante: k y filtro (igualdad de metadata, p. ej. {"file_type": ".pdf"}) son por
+        llamada y no se modifica ningún estado compartido. indice fija la generación a consultar.
+        """
+        if not self.is_initialized():
             logger.error("Retriever no inicializado")
             return []
 
         try:
-            # Actualizar el número de documentos a recuperar (recuperar más para luego filtrar)
-            self.retriever.search_kwargs["k"] = k * 2  # Recuperar el doble para mejor selección
-            
-            retrieved_docs = self.retriever.invoke(query)
-            
+            retrieved_docs, k = self._recuperar(query, k, embedding, filtro, indice=indice)
+
             # Logging detallado de la recuperación
             logger.info(f"🔍 RAG RETRIEVAL para query: '{query[:100]}...'")
             logger.info(f"📊 Documentos recuperados: {len(retrieved_docs)}")
@@ -238,19 +603,90 @@ class RAGSystem:
             logger.error(f"Error al recuperar documentos: {e}")
             return []
 
-    def get_context_from_query(self, query: str, k: int = 5) -> str:
-        """Obtener contexto relevante como string para incluir en el prompt"""
-        retrieved_docs = self.retrieve_documents(query, k)
-        
+    @staticmethod
+    def _clave_chunk(texto: str, metadata: dict):
+        """Identidad de un chunk común a los resultados vectoriales y léxicos"""
+        return (metadata.get('source_path') or metadata.get('source_file'), metadata.get('chunk_hash') or hash_texto(texto))
+
+    def _fusionar_con_bm25(self, bm25: BM25Index, query: str, vector_docs: List[Document], lexicos: list, k: int):
+        """Combinar ranking vectorial y BM25; las consultas por término exacto usan menos chunks"""
+        if not lexicos:
+            return vector_docs, k
+
+        por_clave = {}
+        ranking_vectorial = []
+        for doc in vector_docs:
+            clave = self._clave_chunk(doc.page_content, doc.metadata)
+            por_clave.setdefault(clave, doc)
+            ranking_vectorial.append(clave)
+
+        ranking_lexico = []
+        for doc_id, _ in lexicos:
+            entrada = bm25.documento(doc_id)
+            if entrada is None:  # Eliminado por una actualización concurrente
+                continue
+            texto, metadata = entrada
+            clave = self._clave_chunk(texto, metadata)
+            por_clave.setdefault(clave, Document(page_content=texto, metadata=metadata))
+            ranking_lexico.append(clave)
+
+        # Si el mejor resultado léxico contiene todos los códigos/siglas pedidos, la consulta es
+        # de término exacto: pesa más el ranking léxico y bastan menos chunks
+        exactos = terminos_exactos(query)
+        peso_lexico = 1.0
+        if exactos and bm25.contiene_todos(lexicos[0][0], exactos):
+            peso_lexico = 2.0
+            k = min(k, config.RAG_EXACT_TERM_K)
+            logger.info(f"🎯 Consulta por término exacto {exactos}: k={k}")
+
+        fusion = fusion_rrf([ranking_vectorial, ranking_lexico], pesos=[1.0, peso_lexico])
+        return [por_clave[clave] for clave in fusion], k
+
+    def get_context_chunks(self, query: str, k: int = 5, embedding: Optional[List[float]] = None,
+                           filtro: Optional[dict] = None, indice: Optional[IndiceRAG] = None) -> List[str]:
+        """Obtener los fragmentos de contexto ordenados por relevancia (el primero es el mejor).
+
+        Sobre los candidatos recuperados se aplica MMR (menos casi-duplicados) y los chunks
+        contiguos de un mismo archivo se unen en un tramo sin el overlap del splitter.
+        indice fija la generación a consultar (la del snapshot de conocimiento de la pregunta).
+        """
+        if not self.is_initialized():
+            logger.error("Retriever no inicializado")
+            return []
+
+        try:
+            candidatos, k = self._recuperar(query, k, embedding, filtro, diversificar=True, indice=indice)
+            retrieved_docs = unir_contiguos(mmr(candidatos, k, config.RAG_MMR_LAMBDA))
+        except Exception as e:
+            logger.error(f"Error al recuperar documentos: {e}")
+            return []
+
+        logger.info(f"🔍 RAG RETRIEVAL para query: '{query[:100]}...'")
         if not retrieved_docs:
-            return ""
+            logger.warning("❌ No se recuperaron documentos del RAG")
+            return []
+        for i, doc in enumerate(retrieved_docs):
+            chunks = doc.metadata.get('chunk_id', 'N/A')
+            if 'chunk_id_final' in doc.metadata:
+                chunks = f"{chunks}-{doc.metadata['chunk_id_final']}"
+            logger.info(f"  📄 [{i+1}] Fuente: {doc.metadata.get('source_file', 'desconocida')} | Chunks: {chunks}")
+        logger.info(f"✅ RAG Context final: {len(retrieved_docs)} tramos, {sum(len(doc.page_content) for doc in retrieved_docs)} caracteres")
 
-        # Combinar el contenido de los documentos recuperados
         context_parts = []
-        for i, doc in enumerate(retrieved_docs):
+        for doc in retrieved_docs:
             source_info = f"[Fuente: {doc.metadata.get('source_file', 'desconocida')}]"
             context_parts.append(f"{source_info}\n{doc.page_content}")
+        return context_parts
+
+    def get_context_from_query(self, query: str, k: int = 5, embedding: Optional[List[float]] = None,
+                               filtro: Optional[dict] = None, indice: Optional[IndiceRAG] = None) -> str:
+        """Obtener contexto relevante como string para incluir en el prompt"""
+        context_parts = self.get_context_chunks(query, k, embedding=embedding, filtro=filtro, indice=indice)
 
+        if not context_parts:
+            return ""
+
+        # Combinar el contenido de los documentos recuperados
         context = "\n\n".join(context_parts)
         logger.info(f"Contexto RAG generado con {len(context)} caracteres")
         
@@ -258,9 +694,16 @@ class RAGSystem:
 
     def is_initialized(self) -> bool:
         """Verificar si el sistema RAG está completamente inicializado"""
-        return (self.embeddings is not None and 
-                self.vectorstore is not None and 
-                self.retriever is not None)
-
-# Instancia global del sistema RAG
-rag_system = RAGSystem() 
\ No newline at end of file
+        return self.embeddings is not None and self.indice is not None
+
+# Instancia global del sistema RAG: se crea en el primer uso (abre embeddings y el índice en disco)
+_rag_system: Optional[RAGSystem] = None
+_rag_system_lock = threading.Lock()
+
+def get_rag_system() -> RAGSystem:
+    global _rag_system
+    if _rag_system is None:
+        with _rag_system_lock:
+            if _rag_system is None:
+                _rag_system = RAGSystem()
+    return _rag_system
@@ -0,0 +1,183 @@
+import re
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from typing import Optional
+
+from logger_config import logger
+
+_RETRY_AFTER_RE = re.compile(r"retry(?:[ _-]?after|[ _-]?delay|\s+in)\D{0,20}?(\d+(?:\.\d+)?)", re.IGNORECASE)
+
+def es_error_rate_limit(error_str: str) -> bool:
+    """Detectar errores 429 (rate limit / cuota agotada)"""
+    return "429" in error_str or "quota" in error_str.lower() or "ResourceExhausted" in error_str
+
+def extraer_retry_after(error: Exception) -> Optional[float]:
+    """Extraer el tiempo de espera sugerido (Retry-After / retry_delay) de un error, si existe"""
+    valor = getattr(error, 'retry_after', None)
+    if valor is None:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None)
+        if headers:
+            valor = headers.get('Retry-After') or headers.get('retry-after')
+    if valor is None:
+        match = _RETRY_AFTER_RE.search(str(error))
+        if match:
+            valor = match.group(1)
+    try:
+        return float(valor) if valor is not None else None
+    except (TypeError, ValueError):
+        return None
+
+class _Waiter:
+    __slots__ = ('event', 'loop', 'future')
+
+    def __init__(self, event=None, loop=None, future=None):
+        self.event = event
+        self.loop = loop
+        self.future = future
+
+class AdaptiveConcurrencyLimiter:
+    """Limitador de concurrencia AIMD compartido entre hilos y corrutinas.
+
+    El límite sube de forma aditiva con cada éxito (+increase_step por ventana completa)
+    y se reduce multiplicativamente ante un 429, como máximo una vez por decrease_cooldown.
+    """
+
+    def __init__(self, initial_limit: int, min_limit: int = 1, max_limit: int = 15,
+                 decrease_factor: float = 0.5, increase_step: float = 1.0,
+                 decrease_cooldown: float = 2.0, backoff_base: float = 1.0, backoff_max: float = 30.0,
+                 name: str = "llm"):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease_factor = decrease_factor
+        self.increase_step = increase_step
+        self.decrease_cooldown = decrease_cooldown
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._limit = float(max(min_limit, min(initial_limit, max_limit)))
+        self._in_flight = 0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+        self._last_decrease = 0.0
+        self._successes = 0
+        self._rate_limited = 0
+        self._decreases = 0
+
+    @property
+    def limit(self) -> int:
+        return max(self.min_limit, int(self._limit))
+
+    def _dispatch(self):
+        """Despertar esperas mientras haya capacidad (llamar con el lock tomado)"""
+        while self._waiters and self._in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            self._in_flight += 1
+            if waiter.event is not None:
+                waiter.event.set()
+            else:
+                waiter.loop.call_soon_threadsafe(self._wake_future, waiter.future)
+
+    @staticmethod
+    def _wake_future(future):
+        if not future.done():
+            future.set_result(True)
+
+    def try_acquire(self) -> bool:
+        """Tomar un permiso solo si hay capacidad inmediata"""
+        with self._lock:
+            if self._in_flight < self.limit and not self._waiters:
+                self._in_flight += 1
+                return True
+            return False
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        """Esperar un permiso (hilos). Devuelve False si vence el timeout"""
+        with self._lock:
+            if self._in_flight < self.limit and not self._waiters:
+                self._in_flight += 1
+                return True
+            waiter = _Waiter(event=threading.Event())
+            self._waiters.append(waiter)
+
+        if waiter.event.wait(timeout):
+            return True
+        with self._lock:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                return False
+        # El permiso llegó justo al vencer el timeout
+        return True
+
+    async def acquire_async(self, timeout: Optional[float] = None) -> bool:
+        """Esperar un permiso (corrutinas). Devuelve False si vence el timeout"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._in_flight < self.limit and not self._waiters:
+                self._in_flight += 1
+                return True
+            waiter = _Waiter(loop=loop, future=loop.create_future())
+            self._waiters.append(waiter)
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter.future), timeout=timeout)
+            return True
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                    granted = False
+                else:
+                    granted = True
+            if granted:
+                # Se concedió mientras vencía el timeout: devolver el permiso
+                self.release()
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            return False
+
+    def release(self):
+        with self._lock:
+            self._in_flight = max(0, self._in_flight - 1)
+            self._dispatch()
+
+    def on_success(self):
+        """Incremento aditivo: +increase_step por cada ventana completa de éxitos"""
+        with self._lock:
+            self._successes += 1
+            self._limit = min(float(self.max_limit), self._limit + self.increase_step / max(self._limit, 1.0))
+            self._dispatch()
+
+    def on_rate_limited(self):
+        """Reducción multiplicativa ante un 429 (una sola vez por ráfaga)"""
+        with self._lock:
+            self._rate_limited += 1
+            now = time.monotonic()
+            if now - self._last_decrease < self.decrease_cooldown:
+                return
+            anterior = self.limit
+            self._limit = max(float(self.min_limit), self._limit * self.decrease_factor)
+            self._last_decrease = now
+            self._decreases += 1
+        logger.warning(f"📉 Limitador {self.name}: 429 detectado, concurrencia {anterior} -> {self.limit}")
+
+    def backoff_delay(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Backoff exponencial con jitter completo; respeta Retry-After si el servidor lo indica"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, retry_after + random.uniform(0, self.backoff_base))
+        return delay
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'limit': self.limit,
+                'in_flight': self._in_flight,
+                'waiting': len(self._waiters),
+                'successes': self._successes,
+                'rate_limited': self._rate_limited,
+                'decreases': self._decreases,
+            }
@@ -0,0 +1,130 @@
+import json
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, Optional
+
+from logger_config import logger
+
+# Dependencias pesadas que deberían cargarse solo al usarse: si una etapa que no las usa las carga, hay una regresión
+MODULOS_PESADOS = (
+    'langchain_google_genai', 'langchain_chroma', 'chromadb', 'langchain_community',
+    'unstructured', 'langchain_text_splitters', 'openpyxl', 'googleapiclient', 'google_auth_oauthlib',
+)
+
+class Readiness:
+    """Estado de arranque del bot y perfil de tiempos de cada etapa.
+
+    Slack se conecta de inmediato; mientras falte algún componente (conocimiento, RAG, LLM)
+    las preguntas reciben un aviso de "arrancando" en vez de esperar o fallar. Un componente
+    que falla al arrancar queda degradado: deja de bloquear y se atiende con lo disponible.
+    """
+
+    def __init__(self, componentes: Iterable[str]):
+        self._inicio = time.perf_counter()
+        self._lock = threading.Lock()
+        self._listo = threading.Event()
+        self._pendientes = set(componentes)
+        self._listos: Dict[str, float] = {}  # componente -> segundos desde el arranque
+        self._degradados: Dict[str, str] = {}  # componente -> error con el que falló al arrancar
+        self._etapas = []  # (nombre, segundos, módulos pesados que cargó)
+
+    def _transcurrido(self) -> float:
+        return time.perf_counter() - self._inicio
+
+    @contextmanager
+    def etapa(self, nombre: str):
+        """Medir una etapa del arranque (importaciones, restauración, conexión...)"""
+        previos = {m for m in MODULOS_PESADOS if m in sys.modules}
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - inicio
+            nuevos = [m for m in MODULOS_PESADOS if m in sys.modules and m not in previos]
+            with self._lock:
+                self._etapas.append((nombre, segundos, nuevos))
+            logger.info(f"⏱️ Arranque: {nombre} en {segundos * 1000:.0f} ms"
+                        + (f" (cargó {', '.join(nuevos)})" if nuevos else ""))
+
+    def marcar_listo(self, componente: str):
+        with self._lock:
+            if componente in self._listos:
+                return
+            self._listos[componente] = self._transcurrido()
+            self._degradados.pop(componente, None)
+            self._pendientes.discard(componente)
+            listo = not self._pendientes
+        logger.info(f"✅ Componente listo: {componente} ({self._listos[componente]:.2f}s desde el arranque)")
+        if listo:
+            self._abrir()
+
+    def marcar_degradado(self, componente: str, error):
+        """Registrar que un componente falló al arrancar; deja de bloquear el arranque"""
+        with self._lock:
+            if componente in self._listos or componente in self._degradados:
+                return
+            self._degradados[componente] = str(error)
+            self._pendientes.discard(componente)
+            listo = not self._pendientes
+        logger.warning(f"⚠️ Componente degradado: {componente} ({self._transcurrido():.2f}s desde el arranque): {error}")
+        if listo:
+            self._abrir()
+
+    def _abrir(self):
+        self._listo.set()
+        with self._lock:
+            degradados = sorted(self._degradados)
+        if degradados:
+            logger.warning(f"🚀 Bot listo en {self._transcurrido():.2f}s con componentes degradados: {', '.join(degradados)}")
+        else:
+            logger.info(f"🚀 Bot listo en {self._transcurrido():.2f}s")
+
+    def esta_listo(self) -> bool:
+        return self._listo.is_set()
+
+    def esperar(self, timeout: Optional[float] = None) -> bool:
+        return self._listo.wait(timeout)
+
+    def estado(self) -> dict:
+        with self._lock:
+            return {
+                'listo': self._listo.is_set(),
+                'pendientes': sorted(self._pendientes),
+                'listos': dict(self._listos),
+                'degradados': dict(self._degradados),
+            }
+
+    def reporte(self, ruta: Optional[str] = None) -> dict:
+        """Registrar el perfil de arranque en el log y, si se indica, agregarlo como una línea JSON a ruta"""
+        with self._lock:
+            perfil = {
+                'fecha': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'listo': self._listo.is_set(),
+                'segundos_total': round(self._transcurrido(), 3),
+                'etapas': [
+                    {'nombre': nombre, 'segundos': round(segundos, 3), 'modulos_pesados': nuevos}
+                    for nombre, segundos, nuevos in self._etapas
+                ],
+                'componentes': {nombre: round(segundos, 3) for nombre, segundos in self._listos.items()},
+                'pendientes': sorted(self._pendientes),
+                'degradados': dict(self._degradados),
+            }
+        lineas = [
+            f"  {etapa['nombre']:<32} {etapa['segundos'] * 1000:>8.0f} ms  {', '.join(etapa['modulos_pesados'])}"
+            for etapa in perfil['etapas']
+        ]
+        lineas += [f"  listo: {nombre:<25} {segundos:>8.2f} s" for nombre, segundos in perfil['componentes'].items()]
+        lineas += [f"  degradado: {nombre:<21} {error}" for nombre, error in perfil['degradados'].items()]
+        logger.info("📈 Perfil de arranque:\n" + "\n".join(lineas))
+        if ruta:
+            try:
+                with open(ruta, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(perfil, ensure_ascii=False) + "\n")
+            except Exception as e:
+                logger.warning(f"No se pudo guardar el perfil de arranque en {ruta}: {e}")
+        return perfil
+
+# Instancia global: el arranque la actualiza, slack_app la consulta
+readiness = Readiness(componentes=("slack", "rag", "conocimiento", "llm"))
@@ -0,0 +1,167 @@
+import time
+import threading
+from collections import deque
+from typing import Optional
+
+from logger_config import logger
+
+class LatencyTracker:
+    """Ventana deslizante de latencias de llamadas exitosas para calcular percentiles"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._muestras = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, segundos: float):
+        with self._lock:
+            self._muestras.append(segundos)
+
+    def percentile(self, q: float) -> Optional[float]:
+        """Percentil q (0-1) o None si aún no hay muestras suficientes"""
+        with self._lock:
+            if len(self._muestras) < self.min_samples:
+                return None
+            ordenadas = sorted(self._muestras)
+        indice = min(len(ordenadas) - 1, int(q * len(ordenadas)))
+        return ordenadas[indice]
+
+    def get_stats(self) -> dict:
+        p50 = self.percentile(0.5)
+        p95 = self.percentile(0.95)
+        return {
+            'samples': len(self._muestras),
+            'p50': round(p50, 2) if p50 is not None else None,
+            'p95': round(p95, 2) if p95 is not None else None,
+        }
+
+class PermisoCircuito:
+    """Llamada admitida por CircuitBreaker.permitir; se entrega al registrar su resultado"""
+
+    __slots__ = ('apertura', 'es_prueba')
+
+    def __init__(self, apertura: int, es_prueba: bool = False):
+        self.apertura = apertura  # Aperturas del circuito al admitir la llamada
+        self.es_prueba = es_prueba
+
+class CircuitBreaker:
+    """Circuit breaker por tasa de error sobre las últimas llamadas.
+
+    cerrado -> abierto cuando la tasa de fallos de la ventana supera failure_threshold;
+    abierto -> semiabierto pasados open_seconds (se deja pasar una sola llamada de prueba);
+    semiabierto -> cerrado si la prueba tiene éxito, o abierto de nuevo si falla.
+    Si la prueba termina sin resultado (liberar_prueba) o no se resuelve en open_seconds,
+    se entrega una nueva prueba en vez de quedar semiabierto para siempre.
+
+    permitir() devuelve un permiso por llamada: solo cuenta el resultado de llamadas admitidas
+    después de la última apertura, y en semiabierto solo el de la prueba vigente. Así una
+    llamada lenta de antes del corte no reabre, cierra ni libera la prueba de otra.
+    """
+
+    CERRADO = "cerrado"
+    ABIERTO = "abierto"
+    SEMIABIERTO = "semiabierto"
+
+    def __init__(self, failure_threshold: float = 0.5, window: int = 20, min_calls: int = 10,
+                 open_seconds: float = 30.0, nombre: str = "llm"):
+        self.nombre = nombre
+        self.failure_threshold = failure_threshold
+        self.min_calls = min_calls
+        self.open_seconds = open_seconds
+        self._resultados = deque(maxlen=window)  # True = fallo
+        self._estado = self.CERRADO
+        self._abierto_desde = 0.0
+        self._prueba: Optional[PermisoCircuito] = None  # Llamada de prueba en curso (semiabierto)
+        self._prueba_desde = 0.0
+        self._lock = threading.Lock()
+        self.rechazadas = 0
+        self.aperturas = 0
+        self.descartados = 0  # Resultados ignorados de llamadas admitidas antes de la última apertura
+
+    def esta_abierto(self) -> bool:
+        """True si las llamadas deben fallar rápido ahora mismo (no consume la llamada de prueba)"""
+        with self._lock:
+            if self._estado == self.ABIERTO:
+                return time.monotonic() - self._abierto_desde < self.open_seconds
+            return self._estado == self.SEMIABIERTO and self._prueba_vigente()
+
+    def _prueba_vigente(self) -> bool:
+        return self._prueba is not None and time.monotonic() - self._prueba_desde < self.open_seconds
+
+    def permitir(self) -> Optional[PermisoCircuito]:
+        """Decidir si una llamada puede salir hacia el servicio: su permiso, o None si debe fallar rápido"""
+        with self._lock:
+            if self._estado == self.CERRADO:
+                return PermisoCircuito(self.aperturas)
+            if self._estado == self.ABIERTO and time.monotonic() - self._abierto_desde >= self.open_seconds:
+                self._estado = self.SEMIABIERTO
+                self._prueba = None
+                logger.info(f"🔌 Circuito {self.nombre} semiabierto: probando una llamada")
+            if self._estado == self.SEMIABIERTO and not self._prueba_vigente():
+                if self._prueba is not None:
+                    logger.warning(f"🔌 Circuito {self.nombre}: la llamada de prueba no se resolvió en {self.open_seconds:.0f}s, probando otra")
+                self._prueba = PermisoCircuito(self.aperturas, es_prueba=True)
+                self._prueba_desde = time.monotonic()
+                return self._prueba
+            self.rechazadas += 1
+            return None
+
+    def _cuenta(self, permiso: PermisoCircuito) -> bool:
+        """True si el resultado de la llamada debe afectar al circuito (llamar con el lock tomado)"""
+        if self._estado == self.SEMIABIERTO:
+            vigente = permiso is self._prueba
+        else:
+            vigente = not permiso.es_prueba and permiso.apertura == self.aperturas
+        if not vigente:
+            self.descartados += 1
+        return vigente
+
+    def liberar_prueba(self, permiso: PermisoCircuito):
+        """Cerrar una llamada que terminó sin éxito ni fallo que contar (saturación local, error de payload,
+        stream abandonado): si era la prueba vigente, la siguiente llamada puede probar.
+        Sin efecto para cualquier otra llamada.
+        """
+        with self._lock:
+            if self._estado == self.SEMIABIERTO and permiso is self._prueba:
+                self._prueba = None
+
+    def registrar_exito(self, permiso: PermisoCircuito):
+        with self._lock:
+            if not self._cuenta(permiso):
+                return
+            self._resultados.append(False)
+            if self._estado == self.SEMIABIERTO:
+                self._estado = self.CERRADO
+                self._prueba = None
+                self._resultados.clear()
+                logger.info(f"🔌 Circuito {self.nombre} cerrado de nuevo")
+
+    def registrar_fallo(self, permiso: PermisoCircuito):
+        with self._lock:
+            if not self._cuenta(permiso):
+                return
+            self._resultados.append(True)
+            if self._estado == self.SEMIABIERTO:
+                self._abrir()
+                return
+            if self._estado == self.CERRADO and len(self._resultados) >= self.min_calls:
+                tasa = sum(self._resultados) / len(self._resultados)
+                if tasa >= self.failure_threshold:
+                    self._abrir()
+
+    def _abrir(self):
+        self._estado = self.ABIERTO
+        self._abierto_desde = time.monotonic()
+        self._prueba = None
+        self.aperturas += 1
+        logger.warning(f"🔌 Circuito {self.nombre} ABIERTO durante {self.open_seconds:.0f}s por tasa de errores")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'estado': self._estado,
+                'tasa_fallos': round(sum(self._resultados) / len(self._resultados), 2) if self._resultados else 0.0,
+                'aperturas': self.aperturas,
+                'rechazadas': self.rechazadas,
+                'descartados': self.descartados,
+            }
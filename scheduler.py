@@ -0,0 +1,182 @@
+import time
+import threading
+from collections import deque, defaultdict
+from typing import Optional
+
+from logger_config import logger
+
+class Ticket:
+    """Petición en espera de una instancia LLM"""
+
+    def __init__(self, user_id: str, prioridad: int = 0, deadline: Optional[float] = None):
+        self.user_id = user_id
+        self.prioridad = prioridad
+        self.encolado = time.time()
+        self.deadline = deadline
+        self.evento = threading.Event()
+        self.llm = None
+        self.descartado = False
+        self.tag_inicio = 0.0
+        self.tag_orden = 0.0  # Clave de atención: el tag de inicio, adelantado si la petición es prioritaria
+
+    def puede_terminar(self, ahora: float, servicio_estimado: float) -> bool:
+        return self.deadline is None or ahora + servicio_estimado <= self.deadline
+
+class _SchedulerBase:
+    """Estado común: estimación del tiempo de servicio y estadísticas de espera por usuario"""
+
+    def __init__(self):
+        self.servicio_estimado = 5.0  # EWMA (segundos) del tiempo que una petición retiene el LLM
+        self.descartados = 0
+        self._esperas = defaultdict(lambda: deque(maxlen=50))
+
+    def registrar_servicio(self, duracion: float, alpha: float = 0.2):
+        self.servicio_estimado = (1 - alpha) * self.servicio_estimado + alpha * duracion
+
+    def registrar_espera(self, ticket: Ticket):
+        self._esperas[ticket.user_id].append(time.time() - ticket.encolado)
+
+    def descartar(self, ticket: Ticket, motivo: str):
+        ticket.descartado = True
+        self.descartados += 1
+        logger.warning(f"🚫 Petición de {ticket.user_id} descartada: {motivo}")
+        ticket.evento.set()
+
+    def espera_estimada(self, capacidad: int) -> float:
+        """Espera aproximada de una petición nueva según la cola actual"""
+        return (len(self) / max(1, capacidad)) * self.servicio_estimado
+
+    def _stats_espera(self) -> dict:
+        stats = {}
+        for user_id, esperas in self._esperas.items():
+            if esperas:
+                stats[user_id] = {
+                    'espera_promedio': round(sum(esperas) / len(esperas), 2),
+                    'espera_max': round(max(esperas), 2),
+                }
+        return stats
+
+class FifoScheduler(_SchedulerBase):
+    """Orden de llegada (comportamiento original de queue.Queue)"""
+
+    def __init__(self):
+        super().__init__()
+        self._cola = deque()
+
+    def __len__(self):
+        return len(self._cola)
+
+    def encolar(self, ticket: Ticket):
+        self._cola.append(ticket)
+
+    def quitar(self, ticket: Ticket) -> bool:
+        try:
+            self._cola.remove(ticket)
+            return True
+        except ValueError:
+            return False
+
+    def siguiente(self) -> Optional[Ticket]:
+        ahora = time.time()
+        while self._cola:
+            ticket = self._cola.popleft()
+            if ticket.puede_terminar(ahora, self.servicio_estimado):
+                return ticket
+            self.descartar(ticket, "no puede completarse antes de su deadline")
+        return None
+
+    def get_stats(self) -> dict:
+        profundidad = defaultdict(int)
+        for ticket in self._cola:
+            profundidad[ticket.user_id] += 1
+        return {
+            'tipo': 'fifo',
+            'en_cola': len(self._cola),
+            'descartados': self.descartados,
+            'servicio_estimado': round(self.servicio_estimado, 2),
+            'cola_por_usuario': dict(profundidad),
+            'espera_por_usuario': self._stats_espera(),
+        }
+
+class FairScheduler(_SchedulerBase):
+    """Encolado justo por usuario (start-time fair queuing) con prioridades y deadlines.
+
+    Cada usuario tiene su propia cola FIFO. Una petición recibe un tag de inicio
+    max(tiempo_virtual, fin_del_usuario) y su coste 1/peso avanza el fin del usuario,
+    así diez menciones seguidas de un usuario no adelantan a los demás. Las peticiones
+    prioritarias (primer turno, preguntas cortas) pesan más y además se atienden como si
+    su tag fuera adelanto_prioritario unidades anterior; a igual tag se atiende la de
+    deadline más próximo. Las que ya no pueden terminar a tiempo se descartan.
+    """
+
+    def __init__(self, peso_prioritario: float = 2.0, adelanto_prioritario: float = 1.0):
+        super().__init__()
+        self.peso_prioritario = peso_prioritario
+        self.adelanto_prioritario = adelanto_prioritario
+        self._colas = {}  # user_id -> deque[Ticket]
+        self._fin_usuario = defaultdict(float)
+        self._tiempo_virtual = 0.0
+        self._total = 0
+
+    def __len__(self):
+        return self._total
+
+    def _peso(self, ticket: Ticket) -> float:
+        return self.peso_prioritario if ticket.prioridad > 0 else 1.0
+
+    def encolar(self, ticket: Ticket):
+        inicio = max(self._tiempo_virtual, self._fin_usuario[ticket.user_id])
+        ticket.tag_inicio = inicio
+        ticket.tag_orden = inicio - (self.adelanto_prioritario if ticket.prioridad > 0 else 0.0)
+        self._fin_usuario[ticket.user_id] = inicio + 1.0 / self._peso(ticket)
+        self._colas.setdefault(ticket.user_id, deque()).append(ticket)
+        self._total += 1
+
+    def quitar(self, ticket: Ticket) -> bool:
+        cola = self._colas.get(ticket.user_id)
+        if not cola:
+            return False
+        try:
+            cola.remove(ticket)
+        except ValueError:
+            return False
+        self._total -= 1
+        if not cola:
+            del self._colas[ticket.user_id]
+        return True
+
+    def siguiente(self) -> Optional[Ticket]:
+        ahora = time.time()
+        while self._colas:
+            user_id = min(
+                self._colas,
+                key=lambda u: (self._colas[u][0].tag_orden,
+                               self._colas[u][0].deadline if self._colas[u][0].deadline is not None else float('inf'))
+            )
+            cola = self._colas[user_id]
+            ticket = cola.popleft()
+            self._total -= 1
+            if not cola:
+                del self._colas[user_id]
+            if not ticket.puede_terminar(ahora, self.servicio_estimado):
+                self.descartar(ticket, "no puede completarse antes de su deadline")
+                continue
+            self._tiempo_virtual = max(self._tiempo_virtual, ticket.tag_inicio)
+            return ticket
+        return None
+
+    def get_stats(self) -> dict:
+        return {
+            'tipo': 'fair',
+            'en_cola': self._total,
+            'descartados': self.descartados,
+            'servicio_estimado': round(self.servicio_estimado, 2),
+            'cola_por_usuario': {user_id: len(cola) for user_id, cola in self._colas.items()},
+            'espera_por_usuario': self._stats_espera(),
+        }
+
+def crear_scheduler(nombre: str):
+    """Crear el scheduler configurado ('fair' o 'fifo')"""
+    if nombre == "fifo":
+        return FifoScheduler()
+    return FairScheduler()
@@ -0,0 +1,130 @@
+import time
+import threading
+from typing import FrozenSet, Iterable, Optional, Sequence
+
+import numpy as np
+
+from bm25_index import terminos_exactos, tokenizar
+from logger_config import logger
+
+class SemanticAnswerCache:
+    """Caché de respuestas por similitud de embeddings de la pregunta.
+
+    Guarda vectores normalizados en una matriz contigua float32; la búsqueda es un único
+    producto matriz-vector sobre las entradas ocupadas. Solo sirve entradas de la versión
+    de conocimiento vigente: al subir la versión se vacía, y las llamadas con una versión
+    anterior (preguntas que empezaron antes de publicar un snapshot) se ignoran.
+
+    La similitud no distingue preguntas que solo cambian en un código, número o país
+    ("producto 017" vs "producto 018"): además del umbral, los términos clave de ambas
+    preguntas deben coincidir.
+    """
+
+    def __init__(self, max_entries: int = 512, threshold: float = 0.92, ttl_seconds: float = 3600,
+                 terminos_clave: Iterable[str] = ()):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        # Palabras que cambian la respuesta aunque la pregunta sea casi igual (p. ej. países), ya tokenizadas
+        self.terminos_clave = frozenset(token for termino in terminos_clave for token in tokenizar(termino))
+        self._matriz = None
+        self._respuestas = [None] * max_entries
+        self._preguntas = [None] * max_entries
+        self._terminos = [None] * max_entries
+        self._expira_en = np.zeros(max_entries, dtype=np.float64)
+        self._ultimo_uso = np.zeros(max_entries, dtype=np.float64)
+        self._ocupadas = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _normalizar(embedding: Sequence[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norma = np.linalg.norm(vector)
+        if norma == 0:
+            return None
+        return vector / norma
+
+    def _extraer_terminos(self, pregunta: str) -> FrozenSet[str]:
+        """Códigos, números y siglas de la pregunta más los términos clave configurados que aparezcan"""
+        return frozenset(terminos_exactos(pregunta)) | (self.terminos_clave & set(tokenizar(pregunta)))
+
+    def _sincronizar_version(self, version) -> bool:
+        """Vaciar la caché si la versión de conocimiento subió; False si la versión es anterior a la vigente.
+
+        Llamar con el lock tomado.
+        """
+        if self._version is not None and version < self._version:
+            return False
+        if version != self._version:
+            self._version = version
+            self._ocupadas = 0
+            self._respuestas = [None] * self.max_entries
+            self._preguntas = [None] * self.max_entries
+            self._terminos = [None] * self.max_entries
+        return True
+
+    def get(self, embedding: Sequence[float], pregunta: str, version) -> Optional[str]:
+        """Devolver la respuesta de la pregunta más parecida que supere el umbral y tenga los mismos términos clave"""
+        vector = self._normalizar(embedding)
+        terminos = self._extraer_terminos(pregunta)
+        with self._lock:
+            if not self._sincronizar_version(version) or vector is None or self._ocupadas == 0 or self._matriz.shape[1] != vector.shape[0]:
+                self.misses += 1
+                return None
+            similitudes = self._matriz[:self._ocupadas] @ vector
+            similitudes[self._expira_en[:self._ocupadas] < time.monotonic()] = -1.0
+            candidatas = np.flatnonzero(similitudes >= self.threshold)
+            for indice in candidatas[np.argsort(-similitudes[candidatas])]:
+                if self._terminos[indice] != terminos:
+                    logger.info(f"🧭 Caché semántica descartada: '{pregunta[:60]}' ≈ '{self._preguntas[indice][:60]}' "
+                                f"(similitud {similitudes[indice]:.3f}) pero difieren en {sorted(self._terminos[indice] ^ terminos)}")
+                    continue
+                self._ultimo_uso[indice] = time.monotonic()
+                self.hits += 1
+                logger.info(f"🧭 Caché semántica: '{pregunta[:60]}' ≈ '{self._preguntas[indice][:60]}' (similitud {similitudes[indice]:.3f})")
+                return self._respuestas[indice]
+            self.misses += 1
+            return None
+
+    def put(self, embedding: Sequence[float], pregunta: str, respuesta: str, version):
+        vector = self._normalizar(embedding)
+        terminos = self._extraer_terminos(pregunta)
+        if vector is None:
+            return
+        with self._lock:
+            if not self._sincronizar_version(version):
+                return  # Respuesta generada con un snapshot ya reemplazado
+            if self._matriz is None or self._matriz.shape[1] != vector.shape[0]:
+                self._matriz = np.zeros((self.max_entries, vector.shape[0]), dtype=np.float32)
+                self._ocupadas = 0
+            if self._ocupadas < self.max_entries:
+                indice = self._ocupadas
+                self._ocupadas += 1
+            else:
+                # Expulsar la entrada usada hace más tiempo
+                indice = int(np.argmin(self._ultimo_uso))
+                self.evictions += 1
+            ahora = time.monotonic()
+            self._matriz[indice] = vector
+            self._respuestas[indice] = respuesta
+            self._preguntas[indice] = pregunta
+            self._terminos[indice] = terminos
+            self._expira_en[indice] = ahora + self.ttl_seconds
+            self._ultimo_uso[indice] = ahora
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                'entries': self._ocupadas,
+                'max_entries': self.max_entries,
+                'threshold': self.threshold,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / consultas, 3) if consultas else 0.0,
+                'evictions': self.evictions,
+            }
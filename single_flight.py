@@ -0,0 +1,108 @@
+import asyncio
+import threading
+from typing import Any, Callable, Hashable
+
+from logger_config import logger
+
+class _Llamada:
+    """Ejecución en curso compartida por todas las peticiones con la misma clave"""
+
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+        self.esperando = 0
+
+    def wait(self, timeout: float = None):
+        if not self.evento.wait(timeout):
+            raise TimeoutError("Tiempo de espera agotado en llamada compartida")
+        if self.error is not None:
+            raise self.error
+        return self.resultado
+
+class SingleFlight:
+    """Agrupa peticiones concurrentes idénticas en una sola ejecución (patrón single-flight).
+
+    El primer llamador (líder) ejecuta el trabajo; el resto espera y recibe el mismo resultado.
+    """
+
+    def __init__(self, nombre: str = "single_flight"):
+        self.nombre = nombre
+        self._lock = threading.Lock()
+        self._llamadas = {}
+        self._tareas_async = {}
+        self.total = 0
+        self.compartidas = 0
+
+    def unirse_o_liderar(self, clave: Hashable):
+        """Devolver (llamada, es_lider). El líder debe cerrar la llamada con completar() o fallar()"""
+        with self._lock:
+            self.total += 1
+            llamada = self._llamadas.get(clave)
+            if llamada is not None:
+                llamada.esperando += 1
+                self.compartidas += 1
+                return llamada, False
+            llamada = _Llamada()
+            self._llamadas[clave] = llamada
+            return llamada, True
+
+    def completar(self, clave: Hashable, llamada: _Llamada, resultado: Any):
+        with self._lock:
+            if self._llamadas.get(clave) is llamada:
+                del self._llamadas[clave]
+        llamada.resultado = resultado
+        llamada.evento.set()
+        if llamada.esperando:
+            logger.info(f"🔗 {self.nombre}: resultado compartido con {llamada.esperando} petición(es) en espera")
+
+    def fallar(self, clave: Hashable, llamada: _Llamada, error: BaseException):
+        with self._lock:
+            if self._llamadas.get(clave) is llamada:
+                del self._llamadas[clave]
+        llamada.error = error
+        llamada.evento.set()
+
+    def do(self, clave: Hashable, fn: Callable, *args, **kwargs):
+        """Ejecutar fn una sola vez por clave entre llamadas concurrentes (hilos)"""
+        llamada, es_lider = self.unirse_o_liderar(clave)
+        if not es_lider:
+            logger.info(f"🔗 {self.nombre}: uniéndose a una petición idéntica en curso")
+            return llamada.wait()
+        try:
+            resultado = fn(*args, **kwargs)
+        except BaseException as e:
+            self.fallar(clave, llamada, e)
+            raise
+        self.completar(clave, llamada, resultado)
+        return resultado
+
+    async def ado(self, clave: Hashable, fn: Callable, *args, **kwargs):
+        """Versión asíncrona de do: fn es una función que devuelve una corrutina"""
+        loop = asyncio.get_running_loop()
+        clave_loop = (id(loop), clave)
+        with self._lock:
+            self.total += 1
+            tarea = self._tareas_async.get(clave_loop)
+            if tarea is None:
+                tarea = loop.create_task(fn(*args, **kwargs))
+                self._tareas_async[clave_loop] = tarea
+                tarea.add_done_callback(lambda t: self._liberar_tarea(clave_loop, t))
+            else:
+                self.compartidas += 1
+                logger.info(f"🔗 {self.nombre}: uniéndose a una petición idéntica en curso (async)")
+        # shield: si un llamador se cancela, la tarea compartida sigue para el resto
+        return await asyncio.shield(tarea)
+
+    def _liberar_tarea(self, clave_loop, tarea):
+        with self._lock:
+            if self._tareas_async.get(clave_loop) is tarea:
+                del self._tareas_async[clave_loop]
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                'total': self.total,
+                'compartidas': self.compartidas,
+                'en_curso': len(self._llamadas) + len(self._tareas_async),
+            }
@@ -1,14 +1,87 @@
 import re
+import time
+import threading
 from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 
 import config
 from logger_config import logger
 import chatbot
+from readiness import readiness
 
 
 app = App(token=config.SLACK_BOT_TOKEN)
 
+MENSAJE_PLACEHOLDER = "_Pensando..._ :hourglass_flowing_sand:"
+MENSAJE_ERROR_ENVIO = "Hubo un problema al enviar la respuesta. Intenta de nuevo."
+MENSAJE_ARRANCANDO = "Estoy terminando de arrancar :hourglass_flowing_sand: Intenta de nuevo en unos segundos, por favor."
+
+def metadata_respuesta(snapshot):
+    """Metadata del mensaje de Slack con la versión de conocimiento usada (no se muestra en el canal)"""
+    return {"event_type": "chaski_respuesta", "event_payload": {"knowledge_version": snapshot.version}}
+
+def responder_en_streaming(client, channel_id, user_id, texto, historial, snapshot):
+    """Publicar un placeholder y actualizarlo (chat.update) a medida que llegan fragmentos del LLM.
+
+    Si el mensaje supera SLACK_MAX_MESSAGE_LENGTH se cierra y la respuesta continúa en uno nuevo.
+    Devuelve el texto completo generado por el LLM, o None si la generación falló a mitad de camino
+    (el mensaje en curso se reemplaza por el aviso de error en vez de quedar como placeholder).
+    """
+    max_length = config.SLACK_MAX_MESSAGE_LENGTH
+    metadata = metadata_respuesta(snapshot)
+    mensaje = client.chat_postMessage(channel=channel_id, text=MENSAJE_PLACEHOLDER, metadata=metadata)
+    ts = mensaje["ts"]
+    mensajes_publicados = 1
+
+    fragmentos = []
+    texto_actual = ""  # Texto (sin convertir) del mensaje de Slack en curso
+    texto_publicado = None
+    ultimo_update = 0.0
+
+    def actualizar(texto_mensaje):
+        nonlocal texto_publicado, ultimo_update
+        texto_slack = chatbot.convertir_a_slack_markdown(texto_mensaje) or MENSAJE_PLACEHOLDER
+        if texto_slack == texto_publicado:
+            return
+        try:
+            client.chat_update(channel=channel_id, ts=ts, text=texto_slack, metadata=metadata)
+            texto_publicado = texto_slack
+        except Exception as e:
+            logger.warning(f"No se pudo actualizar mensaje en streaming ({channel_id}): {e}")
+        ultimo_update = time.time()
+
+    try:
+        for fragmento in chatbot.generar_respuesta_stream(texto, historial, user_id, snapshot):
+            fragmentos.append(fragmento)
+            texto_actual += fragmento
+
+            # Rollover: cerrar el mensaje actual y continuar en uno nuevo
+            while len(texto_actual) > max_length:
+                corte = chatbot.punto_de_corte(texto_actual, max_length) or max_length
+                actualizar(texto_actual[:corte].strip())
+                texto_actual = texto_actual[corte:].lstrip()
+                texto_nuevo = chatbot.convertir_a_slack_markdown(texto_actual) or MENSAJE_PLACEHOLDER
+                nuevo = client.chat_postMessage(channel=channel_id, text=texto_nuevo, metadata=metadata)
+                ts = nuevo["ts"]
+                texto_publicado = texto_nuevo
+                mensajes_publicados += 1
+
+            if time.time() - ultimo_update >= config.SLACK_STREAM_UPDATE_INTERVAL:
+                actualizar(texto_actual)
+    except Exception as e:
+        logger.error(f"Error durante la respuesta en streaming a {channel_id}: {e}")
+        # Cerrar el mensaje en curso con el aviso (conservando lo ya escrito) en lugar de dejar el placeholder
+        parcial = chatbot.convertir_a_slack_markdown(texto_actual.strip()) if texto_actual.strip() else ""
+        parcial = parcial[:max_length - len(MENSAJE_ERROR_ENVIO) - 4]
+        client.chat_update(channel=channel_id, ts=ts, text=(parcial + "\n\n" if parcial else "") + f"_{MENSAJE_ERROR_ENVIO}_",
+                           metadata=metadata)
+        return None
+
+    actualizar(texto_actual)
+    logger.info(f"Respuesta en streaming enviada a {channel_id} en {mensajes_publicados} mensaje(s) "
+                f"(conocimiento v{snapshot.version})")
+    return "".join(fragmentos)
+
 @app.event("message")
 def handle_message_events(body, logger):
     # Simple controlador para evitar errores de "unhandled request"
@@ -73,7 +146,7 @@ def handle_message_events(body, say):
             break
 '''
 @app.event("app_mention")
-def handle_app_mention_events(body, say):
+def handle_app_mention_events(body, say, client):
     event = body["event"]
     channel_id = event["channel"]
     user_id = event["user"]
@@ -95,6 +168,12 @@ def handle_app_mention_events(body, say):
 
     logger.info(f"Mención recibida en {channel_id} de {user_id}. Texto procesado: {texto_limpio[:50]}...")
 
+    # Slack se conecta antes de que el conocimiento, el RAG y el pool estén listos
+    if not readiness.esperar(timeout=config.STARTUP_READY_WAIT_SECONDS):
+        logger.info(f"⏳ Bot aún arrancando ({readiness.estado()['pendientes']}), aviso enviado a {user_id}")
+        say(channel=channel_id, text=MENSAJE_ARRANCANDO)
+        return
+
     # Gestión thread-safe de conversaciones
     with chatbot.conversaciones_lock:
         if user_id not in chatbot.conversaciones:
@@ -104,11 +183,29 @@ def handle_app_mention_events(body, say):
         # Copiar historial para uso en generación de respuesta
         historial_actual = chatbot.conversaciones[user_id].copy()
 
-    # Generar respuesta con el nuevo sistema
-    respuesta_llm = chatbot.generar_respuesta(texto_limpio, historial_actual, user_id)
+    # Toda la respuesta se genera con el mismo snapshot de conocimiento, y se etiqueta con su versión
+    snapshot = chatbot.snapshot_actual()
 
-    respuesta_slack = chatbot.convertir_a_slack_markdown(respuesta_llm)
-    partes_respuesta = chatbot.dividir_mensaje(respuesta_slack)
+    if config.SLACK_STREAMING_ENABLED:
+        try:
+            respuesta_llm = responder_en_streaming(client, channel_id, user_id, texto_limpio, historial_actual, snapshot)
+        except Exception as e:
+            # No se pudo publicar el placeholder ni reemplazarlo por el aviso: avisar en un mensaje nuevo
+            logger.error(f"Error al enviar respuesta en streaming a Slack ({channel_id}): {e}")
+            try:
+                say(channel=channel_id, text=MENSAJE_ERROR_ENVIO)
+            except Exception as final_e:
+                logger.error(f"No se pudo enviar mensaje de error a Slack: {final_e}")
+            return
+        if respuesta_llm is None:
+            return  # El aviso de error ya quedó en el mensaje del streaming
+        partes_respuesta = []
+    else:
+        # Generar respuesta con el nuevo sistema
+        respuesta_llm = chatbot.generar_respuesta(texto_limpio, historial_actual, user_id, snapshot)
+
+        respuesta_slack = chatbot.convertir_a_slack_markdown(respuesta_llm)
+        partes_respuesta = chatbot.dividir_mensaje(respuesta_slack)
 
     # Actualizar historial de forma thread-safe
     with chatbot.conversaciones_lock:
@@ -121,7 +218,7 @@ def handle_app_mention_events(body, say):
 
     for i, parte in enumerate(partes_respuesta):
         try:
-            say(channel=channel_id, text=parte)
+            say(channel=channel_id, text=parte, metadata=metadata_respuesta(snapshot))
             logger.info(f"Respuesta a mención parte {i+1}/{len(partes_respuesta)} enviada a {channel_id}")
         except Exception as e:
             logger.error(f"Error al enviar parte {i+1} de mención a Slack ({channel_id}): {e}")
@@ -140,6 +237,9 @@ def start_slack_app():
              return
 
         handler = SocketModeHandler(app, config.SLACK_APP_TOKEN)
-        handler.start() 
+        with readiness.etapa("conexión a Slack"):
+            handler.connect()
+        readiness.marcar_listo("slack")
+        threading.Event().wait()  # Igual que handler.start(): mantener vivo el hilo principal
     except Exception as e:
         logger.error(f"Error fatal en SocketModeHandler: {e}")
@@ -0,0 +1,56 @@
+import time
+
+from resilience import CircuitBreaker
+
+def crear_breaker():
+    return CircuitBreaker(failure_threshold=0.5, window=2, min_calls=2, open_seconds=0.05, nombre="prueba")
+
+def abrir(breaker):
+    for _ in range(2):
+        breaker.registrar_fallo(breaker.permitir())
+    assert breaker.get_stats()['estado'] == CircuitBreaker.ABIERTO
+
+def test_llamada_previa_a_la_apertura_no_libera_la_prueba():
+    breaker = crear_breaker()
+    x = breaker.permitir()  # Admitida con el circuito cerrado, sigue en vuelo
+    abrir(breaker)
+    time.sleep(0.06)
+    y = breaker.permitir()
+    assert y is not None and y.es_prueba
+
+    breaker.liberar_prueba(x)  # X termina sin resultado
+    assert breaker.permitir() is None  # Z no entra como segunda prueba
+
+    breaker.liberar_prueba(y)
+    assert breaker.permitir() is not None
+
+def test_resultados_de_llamadas_previas_a_la_apertura_se_ignoran():
+    breaker = crear_breaker()
+    x_exito = breaker.permitir()
+    x_fallo = breaker.permitir()
+    abrir(breaker)
+    time.sleep(0.06)
+    y = breaker.permitir()
+
+    breaker.registrar_exito(x_exito)
+    breaker.registrar_fallo(x_fallo)
+    assert breaker.get_stats()['estado'] == CircuitBreaker.SEMIABIERTO
+    assert breaker.get_stats()['descartados'] == 2
+
+    breaker.registrar_exito(y)
+    assert breaker.get_stats()['estado'] == CircuitBreaker.CERRADO
+
+def test_prueba_sin_resolver_se_reemplaza_pasado_open_seconds():
+    breaker = crear_breaker()
+    abrir(breaker)
+    time.sleep(0.06)
+    vieja = breaker.permitir()
+    assert breaker.permitir() is None
+    time.sleep(0.06)
+    nueva = breaker.permitir()
+    assert nueva is not None and nueva is not vieja
+
+    breaker.registrar_fallo(vieja)  # La prueba reemplazada ya no decide
+    assert breaker.get_stats()['estado'] == CircuitBreaker.SEMIABIERTO
+    breaker.registrar_fallo(nueva)
+    assert breaker.get_stats()['estado'] == CircuitBreaker.ABIERTO
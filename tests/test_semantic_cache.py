@@ -0,0 +1,39 @@
+from semantic_cache import SemanticAnswerCache
+
+# Embeddings casi idénticos: la similitud coseno supera cualquier umbral razonable
+EMBEDDING = [1.0, 0.0, 0.0]
+EMBEDDING_PARECIDO = [0.99, 0.01, 0.0]
+
+def crear_cache():
+    return SemanticAnswerCache(max_entries=8, threshold=0.92, terminos_clave=("Colombia", "Perú", "Costa Rica"))
+
+def test_sirve_pregunta_parecida_con_los_mismos_terminos():
+    cache = crear_cache()
+    cache.put(EMBEDDING, "¿Qué tarjetas aceptan en Colombia?", "respuesta Colombia", version=1)
+    assert cache.get(EMBEDDING_PARECIDO, "que tarjetas se aceptan en colombia", version=1) == "respuesta Colombia"
+
+def test_no_sirve_si_cambia_el_codigo():
+    cache = crear_cache()
+    cache.put(EMBEDDING, "¿Qué comisión tiene el producto 017?", "respuesta 017", version=1)
+    assert cache.get(EMBEDDING_PARECIDO, "¿Qué comisión tiene el producto 018?", version=1) is None
+    assert cache.get(EMBEDDING_PARECIDO, "¿Qué comisión tiene el producto?", version=1) is None
+    assert cache.misses == 2
+
+def test_no_sirve_si_cambia_el_pais():
+    cache = crear_cache()
+    cache.put(EMBEDDING, "tarjetas en Colombia", "respuesta Colombia", version=1)
+    assert cache.get(EMBEDDING_PARECIDO, "tarjetas en Perú", version=1) is None
+    assert cache.get(EMBEDDING_PARECIDO, "tarjetas en Costa Rica", version=1) is None
+
+def test_elige_la_candidata_con_los_mismos_terminos():
+    cache = crear_cache()
+    cache.put(EMBEDDING, "tarjetas en Colombia", "respuesta Colombia", version=1)
+    cache.put(EMBEDDING_PARECIDO, "tarjetas en Perú", "respuesta Perú", version=1)
+    assert cache.get(EMBEDDING, "tarjetas en Perú", version=1) == "respuesta Perú"
+
+def test_ignora_versiones_anteriores():
+    cache = crear_cache()
+    cache.put(EMBEDDING, "tarjetas en Colombia", "respuesta v2", version=2)
+    assert cache.get(EMBEDDING, "tarjetas en Colombia", version=1) is None
+    cache.put(EMBEDDING, "tarjetas en Colombia", "respuesta v1", version=1)
+    assert cache.get(EMBEDDING, "tarjetas en Colombia", version=2) == "respuesta v2"
@@ -0,0 +1,72 @@
+import math
+from typing import List, Tuple
+
+import config
+from logger_config import logger
+
+def contar_tokens(texto: str) -> int:
+    """Estimación local de tokens (sin llamada a la API): caracteres / PROMPT_CHARS_PER_TOKEN"""
+    if not texto:
+        return 0
+    return math.ceil(len(texto) / config.PROMPT_CHARS_PER_TOKEN)
+
+def _recortar(partes: List[str], tokens: List[int], maximo: int, desde_el_final: bool) -> Tuple[List[str], List[int], int]:
+    """Descartar partes hasta que la suma quepa en maximo (del final o del principio)"""
+    partes, tokens = list(partes), list(tokens)
+    descartadas = 0
+    while partes and sum(tokens) > maximo:
+        indice = -1 if desde_el_final else 0
+        partes.pop(indice)
+        tokens.pop(indice)
+        descartadas += 1
+    return partes, tokens, descartadas
+
+def ensamblar_prompt(system_prompt: str, rag_chunks: List[str], historial: List[str], pregunta: str,
+                     presupuesto: int = None, tablas: List[str] = None) -> str:
+    """Construir el prompt respetando el presupuesto de tokens.
+
+    rag_chunks y tablas vienen ordenados por relevancia e historial del más antiguo al más
+    reciente. Primero se aplican los topes por sección y, si el total sigue excediendo el
+    presupuesto, se descartan los chunks RAG peor clasificados, luego las tablas menos
+    relevantes y luego los mensajes más antiguos. El system prompt y la pregunta nunca se recortan.
+    """
+    presupuesto = presupuesto or config.PROMPT_TOKEN_BUDGET
+    cola = f"Usuario: {pregunta}\nAsistente:"
+    tokens_fijos = contar_tokens(system_prompt) + contar_tokens(cola)
+    tokens_rag = [contar_tokens(chunk) for chunk in rag_chunks]
+    tokens_historial = [contar_tokens(linea) for linea in historial]
+    tablas = tablas or []
+    tokens_tablas = [contar_tokens(tabla) for tabla in tablas]
+
+    rag_chunks, tokens_rag, rag_descartados = _recortar(rag_chunks, tokens_rag, config.PROMPT_RAG_MAX_TOKENS, desde_el_final=True)
+    tablas, tokens_tablas, tablas_descartadas = _recortar(tablas, tokens_tablas, config.PROMPT_TABLES_MAX_TOKENS, desde_el_final=True)
+    historial, tokens_historial, hist_descartados = _recortar(historial, tokens_historial, config.PROMPT_HISTORY_MAX_TOKENS, desde_el_final=False)
+
+    disponible = max(0, presupuesto - tokens_fijos)
+    if sum(tokens_rag) + sum(tokens_tablas) + sum(tokens_historial) > disponible:
+        rag_chunks, tokens_rag, extra = _recortar(rag_chunks, tokens_rag, max(0, disponible - sum(tokens_tablas) - sum(tokens_historial)), desde_el_final=True)
+        rag_descartados += extra
+        tablas, tokens_tablas, extra = _recortar(tablas, tokens_tablas, max(0, disponible - sum(tokens_rag) - sum(tokens_historial)), desde_el_final=True)
+        tablas_descartadas += extra
+        historial, tokens_historial, extra = _recortar(historial, tokens_historial, max(0, disponible - sum(tokens_rag) - sum(tokens_tablas)), desde_el_final=False)
+        hist_descartados += extra
+
+    total = tokens_fijos + sum(tokens_rag) + sum(tokens_tablas) + sum(tokens_historial)
+    logger.info(
+        f"🧮 Tokens del prompt ≈ {total}/{presupuesto} | system: {contar_tokens(system_prompt)}, "
+        f"rag: {sum(tokens_rag)} ({len(rag_chunks)} chunks, -{rag_descartados}), "
+        f"tablas: {sum(tokens_tablas)} ({len(tablas)}, -{tablas_descartadas}), "
+        f"historial: {sum(tokens_historial)} ({len(historial)} msgs, -{hist_descartados}), pregunta: {contar_tokens(cola)}"
+    )
+    if total > presupuesto:
+        logger.warning(f"⚠️ El system prompt y la pregunta por sí solos exceden el presupuesto de tokens ({total}/{presupuesto})")
+
+    history_text = "".join(historial)
+    contexto = ""
+    if tablas:
+        contexto += "\n\n# Filas de las tablas XLSX relevantes a la pregunta:\n" + "\n\n".join(tablas)
+    if rag_chunks:
+        contexto += "\n\n# Contexto adicional de documentos PDF/DOCX:\n" + "\n\n".join(rag_chunks)
+    if contexto:
+        return f"{system_prompt}{contexto}\n\n{history_text}{cola}"
+    return f"{system_prompt}\n{history_text}{cola}"
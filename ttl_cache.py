@@ -0,0 +1,65 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Optional
+
+class LRUTTLCache:
+    """Caché acotada thread-safe con expulsión LRU y expiración por TTL"""
+
+    def __init__(self, max_entries: int = 512, ttl_seconds: float = 3600, nombre: str = "cache"):
+        self.nombre = nombre
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._datos = OrderedDict()  # clave -> (expira_en, valor)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, clave: Hashable) -> Optional[Any]:
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                self.misses += 1
+                return None
+            expira_en, valor = entrada
+            if expira_en < time.monotonic():
+                del self._datos[clave]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._datos.move_to_end(clave)
+            self.hits += 1
+            return valor
+
+    def put(self, clave: Hashable, valor: Any):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl_seconds, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entries:
+                self._datos.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self.invalidations += len(self._datos)
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                'entries': len(self._datos),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / consultas, 3) if consultas else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
@@ -0,0 +1,397 @@
+import os
+import math
+import time
+import pickle
+import hashlib
+import datetime
+from collections import Counter
+from typing import Any, BinaryIO, Dict, List, Optional, Set
+
+from bm25_index import tokenizar
+from logger_config import logger
+
+VERSION_PARSEO = 1  # Subir al cambiar cómo se construyen las tablas: invalida la caché en disco
+
+def _raiz(token: str) -> str:
+    """Singular aproximado para que "tarjetas" encuentre "tarjeta" y "comisiones" "comision" """
+    if token.isdigit():
+        return token
+    if len(token) > 4 and token.endswith('es'):
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s'):
+        return token[:-1]
+    return token
+
+def terminos(texto: str) -> List[str]:
+    return [_raiz(token) for token in tokenizar(texto)]
+
+def _formatear(valor: Any) -> str:
+    if valor is None:
+        return ""
+    if isinstance(valor, bool):
+        return "Sí" if valor else "No"
+    if isinstance(valor, float):
+        return str(int(valor)) if valor.is_integer() else f"{valor:g}"
+    if isinstance(valor, datetime.datetime):
+        return valor.date().isoformat() if valor.time() == datetime.time() else valor.isoformat(sep=' ', timespec='minutes')
+    if isinstance(valor, datetime.date):
+        return valor.isoformat()
+    return " ".join(str(valor).split())
+
+def _tipo(valores: List[Any]) -> str:
+    """Tipo dominante de una columna (ignorando vacíos)"""
+    tipos = Counter(
+        'número' if isinstance(v, (int, float)) and not isinstance(v, bool) else
+        'fecha' if isinstance(v, (datetime.date, datetime.datetime)) else
+        'booleano' if isinstance(v, bool) else 'texto'
+        for v in valores if v not in (None, "")
+    )
+    return tipos.most_common(1)[0][0] if tipos else 'texto'
+
+class Tabla:
+    """Tabla de una hoja en formato columnar, con encabezados y un índice invertido por columna"""
+
+    def __init__(self, archivo: str, hoja: str, encabezados: List[str], filas: List[List[Any]], titulo: str = ""):
+        self.archivo = archivo
+        self.hoja = hoja
+        self.titulo = titulo
+        self.encabezados = encabezados
+        self.columnas = [[fila[i] for fila in filas] for i in range(len(encabezados))]
+        self.tipos = [_tipo(columna) for columna in self.columnas]
+        self.num_filas = len(filas)
+        # término -> filas, por columna; y término -> columnas para los encabezados
+        self.indices: List[Dict[str, Set[int]]] = []
+        for columna in self.columnas:
+            indice = {}
+            for fila, valor in enumerate(columna):
+                for termino in set(terminos(_formatear(valor))):
+                    indice.setdefault(termino, set()).add(fila)
+            self.indices.append(indice)
+        self.indice_encabezados: Dict[str, Set[int]] = {}
+        for i, encabezado in enumerate(encabezados):
+            for termino in terminos(encabezado):
+                self.indice_encabezados.setdefault(termino, set()).add(i)
+        self.terminos_nombre = set(terminos(f"{archivo} {hoja} {titulo}"))
+
+    @property
+    def nombre(self) -> str:
+        partes = [self.archivo, self.hoja] + ([self.titulo] if self.titulo else [])
+        return " › ".join(partes)
+
+    def filas_con(self, termino: str) -> Set[int]:
+        filas = set()
+        for indice in self.indices:
+            filas |= indice.get(termino, set())
+        return filas
+
+    def seleccionar(self, terminos_pregunta: Set[str], max_filas: int, max_columnas: int) -> Optional[dict]:
+        """Filas y columnas relevantes para los términos de la pregunta (None si la tabla no aplica)"""
+        columnas_pedidas = set()
+        for termino in terminos_pregunta:
+            columnas_pedidas |= self.indice_encabezados.get(termino, set())
+        nombre_coincide = bool(terminos_pregunta & self.terminos_nombre)
+
+        # Puntaje por fila: suma del idf de cada término distinto de la pregunta presente en la fila
+        puntajes = Counter()
+        terminos_por_fila = Counter()
+        columnas_con_coincidencia = set()
+        for termino in terminos_pregunta:
+            filas = self.filas_con(termino)
+            if not filas or (len(filas) == self.num_filas > 1):
+                continue  # Un término presente en todas las filas no discrimina
+            idf = math.log(1 + self.num_filas / len(filas))
+            for fila in filas:
+                puntajes[fila] += idf
+                terminos_por_fila[fila] += 1
+            columnas_con_coincidencia |= {i for i, indice in enumerate(self.indices) if termino in indice}
+
+        if puntajes:
+            # Solo las filas que cumplen más términos a la vez ("Mastercard" + "débito" + "Perú"),
+            # ordenadas por idf: las que coinciden en un término suelto no entran
+            maximo = max(terminos_por_fila.values())
+            candidatas = [fila for fila, _ in puntajes.most_common() if terminos_por_fila[fila] == maximo]
+            filas = sorted(candidatas[:max_filas])
+            coincidencias = len(candidatas)
+            puntaje = max(puntajes.values()) + len(columnas_pedidas)
+        elif columnas_pedidas or nombre_coincide:
+            filas = list(range(min(self.num_filas, max_filas)))
+            coincidencias = 0
+            puntaje = 0.5 * len(columnas_pedidas) + (0.5 if nombre_coincide else 0.0)
+        else:
+            return None
+
+        if not puntajes and columnas_pedidas:
+            # Pregunta sobre una columna en general ("¿qué marcas hay?"): solo esas columnas
+            columnas = sorted(columnas_pedidas)[:max_columnas]
+        elif len(self.encabezados) <= max_columnas:
+            columnas = list(range(len(self.encabezados)))
+        else:
+            # Primera columna como identificador de la fila + las pedidas y las que coincidieron
+            elegidas = {0} | columnas_pedidas | columnas_con_coincidencia
+            columnas = sorted(elegidas)[:max_columnas]
+
+        if not puntajes and columnas_pedidas:
+            # y sus valores distintos
+            vistas, unicas = set(), []
+            for fila in range(self.num_filas):
+                clave = tuple(_formatear(self.columnas[i][fila]) for i in columnas)
+                if clave not in vistas and any(clave):
+                    vistas.add(clave)
+                    unicas.append(fila)
+            filas = unicas[:max_filas]
+
+        return {'tabla': self, 'filas': filas, 'columnas': columnas, 'puntaje': puntaje, 'coincidencias': coincidencias}
+
+    def renderizar(self, filas: List[int], columnas: List[int], coincidencias: int) -> str:
+        """Tabla compacta en Markdown con solo las filas y columnas elegidas"""
+        def celda(valor):
+            texto = _formatear(valor).replace("|", "/")
+            return texto if len(texto) <= 200 else texto[:197] + "..."
+
+        total = coincidencias or self.num_filas
+        nota = f" ({len(filas)} de {total} filas{' coincidentes' if coincidencias else ''})" if len(filas) < total else ""
+        lineas = [
+            f"### {self.nombre}{nota}",
+            "| " + " | ".join(self.encabezados[i] for i in columnas) + " |",
+            "|" + "---|" * len(columnas),
+        ]
+        for fila in filas:
+            lineas.append("| " + " | ".join(celda(self.columnas[i][fila]) for i in columnas) + " |")
+        return "\n".join(lineas)
+
+def _bloques(filas: List[List[Any]]) -> List[List[List[Any]]]:
+    """Separar una hoja en bloques de filas no vacías (varias tablas por hoja)"""
+    bloques, actual = [], []
+    for fila in filas:
+        if any(valor not in (None, "") for valor in fila):
+            actual.append(fila)
+        elif actual:
+            bloques.append(actual)
+            actual = []
+    if actual:
+        bloques.append(actual)
+    return bloques
+
+def _es_encabezado(fila: List[Any]) -> bool:
+    llenas = [valor for valor in fila if valor not in (None, "")]
+    textos = [valor for valor in llenas if isinstance(valor, str)]
+    return bool(textos) and len(textos) * 2 >= len(llenas)
+
+def _tablas_de_hoja(archivo: str, hoja) -> List[Tabla]:
+    # Celdas combinadas: el valor de la esquina superior izquierda vale para todo el rango
+    combinadas = {}
+    for rango in hoja.merged_cells.ranges:
+        valor = hoja.cell(rango.min_row, rango.min_col).value
+        for fila in range(rango.min_row, rango.max_row + 1):
+            for columna in range(rango.min_col, rango.max_col + 1):
+                combinadas[(fila, columna)] = valor
+
+    filas = []
+    for numero, fila in enumerate(hoja.iter_rows(values_only=True), start=1):
+        valores = [combinadas.get((numero, columna), valor) for columna, valor in enumerate(fila, start=1)]
+        filas.append([valor.strip() if isinstance(valor, str) else valor for valor in valores])
+
+    tablas = []
+    titulo = ""
+    for bloque in _bloques(filas):
+        def distintos(fila):
+            return {valor for valor in fila if valor not in (None, "")}
+
+        # Filas con un único texto (a menudo combinado sobre varias columnas) encima de una tabla
+        # de varias columnas son su título, no su encabezado
+        while len(bloque) > 1 and len(distintos(bloque[0])) == 1 and len(distintos(bloque[1])) > 1:
+            titulo = _formatear(next(iter(distintos(bloque[0]))))
+            bloque = bloque[1:]
+        if len(bloque) == 1 and len(distintos(bloque[0])) <= 1:
+            # Una fila suelta con un solo texto es el título de la tabla siguiente
+            titulo = _formatear(next(iter(distintos(bloque[0])), ""))
+            continue
+        if _es_encabezado(bloque[0]):
+            encabezados, datos = bloque[0], bloque[1:]
+        else:
+            encabezados, datos = [None] * len(bloque[0]), bloque
+
+        usadas = [i for i in range(len(encabezados))
+                  if encabezados[i] not in (None, "") or any(i < len(fila) and fila[i] not in (None, "") for fila in datos)]
+        nombres, vistos = [], Counter()
+        for i in usadas:
+            nombre = _formatear(encabezados[i]) or f"Columna {i + 1}"
+            vistos[nombre] += 1
+            nombres.append(nombre if vistos[nombre] == 1 else f"{nombre} ({vistos[nombre]})")
+        datos = [[fila[i] if i < len(fila) else None for i in usadas] for fila in datos]
+        if nombres and datos:
+            tablas.append(Tabla(archivo, hoja.title, nombres, datos, titulo))
+        titulo = ""
+    return tablas
+
+def leer_libro(archivo: str, contenido: BinaryIO) -> List[Tabla]:
+    """Parsear un XLSX con openpyxl (valores calculados de las fórmulas) en tablas tipadas"""
+    from openpyxl import load_workbook  # Solo al parsear: un arranque con todo en caché no lo carga
+    contenido.seek(0)
+    libro = load_workbook(contenido, data_only=True)
+    try:
+        tablas = []
+        for hoja in libro.worksheets:
+            tablas.extend(_tablas_de_hoja(archivo, hoja))
+        return tablas
+    finally:
+        libro.close()
+
+class IndiceTablas:
+    """Conjunto inmutable de tablas ya parseadas; por pregunta devuelve solo las filas y columnas relevantes.
+
+    El tamaño del prompt deja de crecer con el de las hojas: el system prompt solo lleva el
+    catálogo (archivo, hoja, columnas) y cada pregunta recibe unas pocas filas por tabla.
+    Cada carga crea un índice nuevo, así que puede leerse desde varios hilos sin lock.
+    """
+
+    def __init__(self, tablas: List[Tabla] = (), huella: str = "", max_filas: int = 30,
+                 max_columnas: int = 8, max_tablas: int = 4):
+        self._tablas = tuple(tablas)
+        self.huella = huella  # Hash del contenido de todos los libros cargados
+        self.max_filas = max_filas
+        self.max_columnas = max_columnas
+        self.max_tablas = max_tablas
+
+    def catalogo(self) -> str:
+        """Descripción corta de las tablas disponibles para el system prompt"""
+        lineas = []
+        for tabla in self._tablas:
+            columnas = ", ".join(f"{encabezado} ({tipo})" for encabezado, tipo in zip(tabla.encabezados[:15], tabla.tipos))
+            extra = f" y {len(tabla.encabezados) - 15} más" if len(tabla.encabezados) > 15 else ""
+            lineas.append(f"- {tabla.nombre}: {tabla.num_filas} filas; columnas: {columnas}{extra}")
+        return "\n".join(lineas)
+
+    def seleccionar(self, pregunta: str) -> List[str]:
+        """Tablas renderizadas con las filas relevantes, de la más a la menos relevante"""
+        terminos_pregunta = set(terminos(pregunta))
+        if not terminos_pregunta:
+            return []
+        selecciones = [
+            seleccion for seleccion in (
+                tabla.seleccionar(terminos_pregunta, self.max_filas, self.max_columnas) for tabla in self._tablas
+            ) if seleccion and seleccion['filas']
+        ]
+        selecciones.sort(key=lambda seleccion: seleccion['puntaje'], reverse=True)
+        bloques = [
+            seleccion['tabla'].renderizar(seleccion['filas'], seleccion['columnas'], seleccion['coincidencias'])
+            for seleccion in selecciones[:self.max_tablas]
+        ]
+        if bloques:
+            logger.info(f"📋 Tablas XLSX para la pregunta: {[s['tabla'].nombre for s in selecciones[:self.max_tablas]]} "
+                        f"({sum(len(s['filas']) for s in selecciones[:self.max_tablas])} filas)")
+        return bloques
+
+    def __len__(self):
+        return len(self._tablas)
+
+class MotorTablas:
+    """Construye un IndiceTablas a partir de los XLSX en memoria, reutilizando el parseo de los libros sin cambios"""
+
+    def __init__(self, max_filas: int = 30, max_columnas: int = 8, max_tablas: int = 4,
+                 cache_dir: Optional[str] = None, cache_dias: float = 7):
+        self.max_filas = max_filas
+        self.max_columnas = max_columnas
+        self.max_tablas = max_tablas
+        # Caché de parseo por libro: clave (nombre + contenido) -> tablas, en memoria y en disco
+        self.cache_dir = cache_dir
+        self.cache_dias = cache_dias
+        self._cache: Dict[str, List[Tabla]] = {}
+        self.parseados = 0
+        self.reutilizados = 0
+
+    @staticmethod
+    def _clave(archivo: str, datos: bytes) -> str:
+        sha = hashlib.sha256(f"{VERSION_PARSEO}|{archivo}|".encode('utf-8'))
+        sha.update(datos)
+        return sha.hexdigest()
+
+    def _ruta_cache(self, clave: str) -> str:
+        return os.path.join(self.cache_dir, f"{clave}.pkl")
+
+    def _leer_cache_disco(self, clave: str) -> Optional[List[Tabla]]:
+        if not self.cache_dir:
+            return None
+        ruta = self._ruta_cache(clave)
+        try:
+            with open(ruta, 'rb') as f:
+                tablas = pickle.load(f)
+            os.utime(ruta)  # Marca de uso para la limpieza
+            return tablas
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Caché de tablas XLSX ilegible ({ruta}), se volverá a parsear: {e}")
+            return None
+
+    def _guardar_cache_disco(self, clave: str, tablas: List[Tabla]):
+        if not self.cache_dir:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            ruta = self._ruta_cache(clave)
+            with open(f"{ruta}.tmp", 'wb') as f:
+                pickle.dump(tablas, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(f"{ruta}.tmp", ruta)
+        except Exception as e:
+            logger.warning(f"No se pudo guardar la caché de tablas XLSX: {e}")
+
+    def _limpiar_cache_disco(self, vigentes: set):
+        """Borrar entradas sin uso reciente; las de libros vigentes se conservan siempre"""
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return
+        limite = time.time() - self.cache_dias * 86400
+        for nombre in os.listdir(self.cache_dir):
+            clave = nombre.split('.', 1)[0]
+            ruta = os.path.join(self.cache_dir, nombre)
+            try:
+                if clave not in vigentes and os.path.getmtime(ruta) < limite:
+                    os.remove(ruta)
+            except OSError:
+                pass
+
+    def _tablas_de(self, archivo: str, datos: bytes, contenido: BinaryIO) -> List[Tabla]:
+        """Tablas de un libro: de la caché si su contenido no cambió, si no se parsea"""
+        clave = self._clave(archivo, datos)
+        tablas = self._cache.get(clave)
+        if tablas is None:
+            tablas = self._leer_cache_disco(clave)
+        if tablas is not None:
+            self.reutilizados += 1
+            logger.info(f"♻️ {archivo}: {len(tablas)} tablas desde caché (sin cambios)")
+        else:
+            tablas = leer_libro(archivo, contenido)
+            self.parseados += 1
+            logger.info(f"📊 {archivo}: {len(tablas)} tablas, {sum(t.num_filas for t in tablas)} filas")
+            self._guardar_cache_disco(clave, tablas)
+        self._cache[clave] = tablas
+        return tablas
+
+    def cargar(self, archivos: Dict[str, BinaryIO]) -> IndiceTablas:
+        """Construir un índice nuevo con las tablas de los libros dados.
+
+        Solo se parsean los libros cuyo contenido cambió desde la última carga (o desde el
+        último arranque, gracias a la caché en disco).
+        """
+        tablas = []
+        sha = hashlib.sha1()
+        vigentes = set()
+        parseados, reutilizados = self.parseados, self.reutilizados
+        for archivo in sorted(archivos):
+            contenido = archivos[archivo]
+            try:
+                contenido.seek(0)
+                datos = contenido.read()
+                sha.update(archivo.encode('utf-8'))
+                sha.update(datos)
+                vigentes.add(self._clave(archivo, datos))
+                tablas.extend(self._tablas_de(archivo, datos, contenido))
+            except Exception as e:
+                logger.error(f"Error al leer tablas del XLSX {archivo}: {e}")
+        # En memoria solo quedan los libros actuales; en disco, además, los usados hace poco
+        self._cache = {clave: valor for clave, valor in self._cache.items() if clave in vigentes}
+        self._limpiar_cache_disco(vigentes)
+        if archivos:
+            logger.info(f"📋 Libros XLSX: {self.parseados - parseados} parseados, "
+                        f"{self.reutilizados - reutilizados} reutilizados de la caché")
+        return IndiceTablas(tablas, sha.hexdigest() if archivos else "", self.max_filas, self.max_columnas, self.max_tablas)